@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+
+'''
+Koud archief: afgesloten maanden uit locations als kolommen op schijf.
+
+Per apparaat en maand komt er een map archief/<tid>/<YYYY-MM>/ met één
+.npy-bestand per kolom en een meta.json:
+  - ts.npy         uint32, seconden sinds het begin van de maand
+  - lat/lon.npy    int32, vaste komma (graden x 10^7, ~1 cm)
+  - acc, vel, ...  float32, NaN = NULL
+  - batt, bs, m    kleinste int-type waar de waarden in passen
+  - SSID, topic .. woordenboek-codes (uint8/16/32); de woorden staan in meta.json
+Een kolom met overal dezelfde waarde (vaak: overal NULL) krijgt geen
+bestand; de waarde staat dan in meta.json.
+readable_time wordt uit ts berekend (lokale tijd, zoals de ingest hem
+schrijft); alleen als dat bij oude of geïmporteerde rijen niet klopt komt
+er een kolom met het verschil bij. tid is de map zelf. Een punt kost zo
+rond de 20-30 bytes in plaats van een rij met 19 kolommen en vier indexen.
+
+De bestanden worden met mmap geopend (np.load(mmap_mode='r')): een dag uit
+het archief lezen is een searchsorted op ts en alleen die plak van de
+kolommen decoderen. De leespaden (timeline, export, trips,
+locatie_visualisatie) voegen het archief samen met wat nog in locations
+staat, dus een punt dat na het archiveren nog binnenkomt (offline-wachtrij)
+wordt ook gewoon getoond; een volgende run neemt het alsnog mee.
+
+Archiveren schrijft eerst de maand (naar een tijdelijke map, dan rename) en
+verwijdert pas daarna de rijen op id. Met MariaDB komt de ruimte vrij met
+partitions.py --verwijder-voor (lege partities) of OPTIMIZE TABLE.
+
+Gebruik:
+    python archive.py                    # maanden ouder dan KEEP_MONTHS archiveren
+    python archive.py --voor 2025-01     # alles vóór januari 2025
+    python archive.py --lijst            # overzicht van het archief
+'''
+
+import argparse
+import heapq
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+import config
+import storage
+from partitions import add_months, month_of, month_start, parse_month
+from storage import Error, local_tz, day_bounds
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+# Standaard naast deze module (zoals tiles.CACHE_DIR), niet in de huidige map:
+# anders archiveert python archive.py vanuit een andere map naar een plek die
+# de server nooit leest
+ARCHIVE_DIR = os.environ.get("TIMELINE_ARCHIVE_DIR") or getattr(config, "ARCHIVE_DIR", None) or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "archief")
+KEEP_MONTHS = int(getattr(config, "ARCHIVE_KEEP_MONTHS", 12))  # zoveel maanden blijven in locations
+FORMAT_VERSION = 1
+FIXED = 10 ** 7         # lat/lon als int32 in 10^-7 graden
+FLOAT_DECIMALS = 6      # float32 heeft ~7 significante cijfers
+DELETE_CHUNK = 1000     # ids per DELETE
+META = "meta.json"
+NO_TID = "_"            # map voor punten zonder tid
+
+FLOATS = ("acc", "alt", "cog", "vac", "vel", "err_bound")
+INTS = ("batt", "bs", "m")
+STRINGS = ("SSID", "conn", "source", "topic")
+
+SELECT_COLUMNS = ("id", "timestamp", "lat", "lon", "created_at") + FLOATS + INTS + STRINGS + ("readable_time",)
+
+
+def device_dir(tid):
+    return quote(tid, safe="") if tid else NO_TID
+
+
+def dir_tid(name):
+    return "" if name == NO_TID else unquote(name)
+
+# =====================
+# CODEREN
+# =====================
+
+def local_times(ts):
+    """Lokale tijd (datetime64[s]) voor een array epoch-seconden"""
+    ts = np.asarray(ts, dtype=np.int64)
+    if not len(ts):
+        return ts.astype("datetime64[s]")
+    # De UTC-offset verandert alleen op hele uren; één keer per uur uitrekenen
+    hours, inverse = np.unique(ts // 3600, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(h) * 3600, local_tz).utcoffset().total_seconds()
+                        for h in hours], dtype=np.int64)
+    return (ts + offsets[inverse]).astype("datetime64[s]")
+
+
+def readable_times(times):
+    """'YYYY-MM-DD HH:MM:SS' zoals CAST(readable_time AS CHAR); NaT wordt None"""
+    return [None if s == "NaT" else s.replace("T", " ")
+            for s in np.datetime_as_string(times).tolist()]
+
+
+def readable_corrections(stored, ts):
+    """Verschil in seconden tussen de opgeslagen readable_time en de berekende
+
+    None als alles klopt (de normale situatie), anders een lijst met per rij
+    het verschil (None voor een lege readable_time).
+    """
+    stored = np.array([v if v is not None else "NaT" for v in stored], dtype="datetime64[s]")
+    diff = (stored - local_times(ts)).astype(np.int64)
+    missing = np.isnat(stored)
+    if not missing.any() and not diff.any():
+        return None
+    return [None if m else d for m, d in zip(missing.tolist(), diff.tolist())]
+
+
+def int_array(values):
+    """Kleinste int-type waar alle waarden in passen; NULL wordt het minimum van dat type"""
+    present = [v for v in values if v is not None]
+    lo, hi = (min(present), max(present)) if present else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min < lo and hi <= info.max:
+            return np.array([info.min if v is None else v for v in values], dtype=dtype)
+    raise ValueError(f"waarden buiten int64: {lo}..{hi}")
+
+
+def dictionary(values):
+    """(codes, woorden) voor een kolom met veel herhaalde teksten"""
+    words, index, codes = [], {}, []
+    for v in values:
+        code = index.get(v)
+        if code is None:
+            code = index[v] = len(words)
+            words.append(v)
+        codes.append(code)
+    dtype = np.uint8 if len(words) <= 1 << 8 else np.uint16 if len(words) <= 1 << 16 else np.uint32
+    return np.array(codes, dtype=dtype), words
+
+
+def is_constant(arr):
+    """Alle elementen bytegewijs gelijk (dus ook overal NaN)"""
+    raw = arr.view(np.uint8).reshape(len(arr), -1)
+    return bool((raw == raw[0]).all())
+
+
+def encode(columns, base):
+    """Kolommen (naam -> lijst waarden, op tijd gesorteerd) naar arrays en woordenboeken"""
+    ts = np.asarray(columns["timestamp"], dtype=np.int64)
+    arrays = {
+        "ts": (ts - base).astype(np.uint32),
+        "lat": np.round(np.asarray(columns["lat"], dtype=float) * FIXED).astype(np.int32),
+        "lon": np.round(np.asarray(columns["lon"], dtype=float) * FIXED).astype(np.int32),
+        # Meestal (bijna) gelijk aan timestamp: als verschil past het in een klein type
+        "created_at": int_array([None if c is None else int(c) - t
+                                 for c, t in zip(columns["created_at"], ts.tolist())]),
+    }
+    for name in FLOATS:
+        arrays[name] = np.array([np.nan if v is None else v for v in columns[name]], dtype=np.float32)
+    for name in INTS:
+        arrays[name] = int_array([None if v is None else int(v) for v in columns[name]])
+    corrections = readable_corrections(columns["readable_time"], ts)
+    if corrections is not None:
+        arrays["readable_time"] = int_array(corrections)
+    words = {}
+    for name in STRINGS:
+        arrays[name], words[name] = dictionary(columns[name])
+    return arrays, words
+
+# =====================
+# LEZEN
+# =====================
+
+class Month:
+    """Eén archiefmaand van één apparaat; kolommen worden bij gebruik ge-mmapt"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        self.tid = self.meta["tid"]
+        self.base = self.meta["base"]
+        self.count = self.meta["count"]
+        self._arrays = {}
+
+    def array(self, name):
+        arr = self._arrays.get(name)
+        if arr is None:
+            if name in self.meta["constant"]:
+                value, dtype = self.meta["constant"][name]
+                # Alleen-lezen view van één waarde, geen kopie per punt
+                arr = np.broadcast_to(np.array(value, dtype=dtype), (self.count,))
+            else:
+                arr = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+            self._arrays[name] = arr
+        return arr
+
+    def span(self, start_ts, end_ts):
+        """(i, j): de punten met start_ts <= timestamp < end_ts"""
+        ts = self.array("ts")
+        lo = min(max(start_ts - self.base, 0), 2 ** 32 - 1)
+        hi = min(max(end_ts - self.base, 0), 2 ** 32 - 1)
+        return int(np.searchsorted(ts, lo)), int(np.searchsorted(ts, hi))
+
+    def column(self, name, i, j):
+        """Waarden van één kolom als lijst, zoals de database ze zou geven"""
+        if name == "tid":
+            return [self.tid] * (j - i)
+        if name == "timestamp":
+            return (self.array("ts")[i:j].astype(np.int64) + self.base).tolist()
+        if name == "readable_time":
+            times = local_times(self.array("ts")[i:j].astype(np.int64) + self.base)
+            if "readable_time" in self.meta["kolommen"]:
+                diff = self.array("readable_time")[i:j].astype(np.int64)
+                null = diff == np.iinfo(self.array("readable_time").dtype).min
+                times = np.where(null, np.datetime64("NaT", "s"), times + diff)
+            return readable_times(times)
+        if name in ("lat", "lon"):
+            return (self.array(name)[i:j] / FIXED).tolist()
+        if name in FLOATS:
+            # float32 terug naar de decimalen die erin gingen (3.3 en niet 3.2999999523)
+            values = np.round(self.array(name)[i:j].astype(float), FLOAT_DECIMALS)
+            return [None if v != v else v for v in values.tolist()]
+        if name in STRINGS:
+            words = self.meta["words"][name]
+            return [words[c] for c in self.array(name)[i:j].tolist()]
+        values = self.array(name)[i:j]
+        null = np.iinfo(values.dtype).min
+        if name == "created_at":
+            ts = self.array("ts")[i:j].astype(np.int64) + self.base
+            return [None if d == null else t + d for d, t in zip(values.tolist(), ts.tolist())]
+        return [None if v == null else v for v in values.tolist()]
+
+    def rows(self, start_ts, end_ts, columns, bbox=None):
+        i, j = self.span(start_ts, end_ts)
+        if i == j:
+            return iter(())
+        if bbox is None:
+            return zip(*(self.column(name, i, j) for name in columns))
+        # Eerst op de int32-kolommen filteren, dan pas lijsten maken van het stuk met treffers
+        south, west, north, east = bbox
+        lat, lon = self.array("lat")[i:j], self.array("lon")[i:j]
+        hit = ((lat >= south * FIXED) & (lat <= north * FIXED)
+               & (lon >= west * FIXED) & (lon <= east * FIXED))
+        idx = np.flatnonzero(hit)
+        if not len(idx):
+            return iter(())
+        lo, hi = i + int(idx[0]), i + int(idx[-1]) + 1
+        keep = hit[idx[0]:idx[-1] + 1].tolist()
+        return (row for row, k in zip(zip(*(self.column(name, lo, hi) for name in columns)), keep) if k)
+
+
+_months = {}
+
+
+def open_month(path):
+    """Month uit de cache; opnieuw openen als de maand intussen herschreven is"""
+    try:
+        mtime = os.stat(os.path.join(path, META)).st_mtime_ns
+    except OSError:
+        return None
+    cached = _months.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _months[path] = (mtime, Month(path))
+    return cached[1]
+
+
+def device_dirs(tid=None):
+    """[(tid, map)] van het archief, op tid gesorteerd; tid '' is zonder tid"""
+    if tid is not None:
+        path = os.path.join(ARCHIVE_DIR, device_dir(tid))
+        return [(tid, path)] if os.path.isdir(path) else []
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except OSError:
+        return []
+    return sorted((dir_tid(name), os.path.join(ARCHIVE_DIR, name))
+                  for name in names if os.path.isdir(os.path.join(ARCHIVE_DIR, name)))
+
+
+def devices():
+    return [tid for tid, _ in device_dirs()]
+
+
+def months(start_ts, end_ts, tid=None):
+    """Archiefmaanden die [start_ts, end_ts) raken, per apparaat in tijdsvolgorde"""
+    found = []
+    for _, path in device_dirs(tid):
+        for name in sorted(os.listdir(path)):
+            try:
+                year, month = parse_month(name)
+            except ValueError:
+                continue
+            if month_start(year, month) < end_ts and month_start(*add_months(year, month, 1)) > start_ts:
+                m = open_month(os.path.join(path, name))
+                if m is not None:
+                    found.append(m)
+    return found
+
+
+def rows(start_ts, end_ts, tid=None, columns=("tid", "timestamp", "lat", "lon"), by_time=False,
+         bbox=None):
+    """Tuples met de gevraagde kolommen uit het archief
+
+    Per apparaat in tijdsvolgorde (apparaten op tid, zoals ORDER BY tid,
+    timestamp), of met by_time alle apparaten door elkaar op timestamp.
+    Met bbox (zuid, west, noord, oost) alleen de punten daarbinnen.
+    """
+    per_device = {}
+    for m in months(start_ts, end_ts, tid):
+        per_device.setdefault(m.tid, []).append(m)
+    streams = [
+        (row for m in ms for row in m.rows(start_ts, end_ts, columns, bbox))
+        for _, ms in sorted(per_device.items())
+    ]
+    if by_time and len(streams) > 1:
+        at = columns.index("timestamp")
+        return heapq.merge(*streams, key=lambda row: row[at])
+    return (row for stream in streams for row in stream)
+
+
+def merge(db_rows, archive_rows, key, unique=True):
+    """Twee gesorteerde stromen samenvoegen
+
+    Met unique komt een punt dat in beide staat (zelfde key) één keer; dat
+    kan alleen als key het punt bepaalt, dus tid en timestamp.
+    """
+    merged = heapq.merge(archive_rows, db_rows, key=key)
+    if not unique:
+        yield from merged
+        return
+    last = object()
+    for row in merged:
+        k = key(row)
+        if k != last:
+            yield row
+        last = k
+
+
+def fetch_day_points(conn, day_str, tid=None):
+    """storage.fetch_day_points, aangevuld met de punten uit het archief"""
+    points = storage.fetch_day_points(conn, day_str, tid)
+    start_ts, end_ts = day_bounds(day_str)
+    columns = ("lat", "lon", "vel", "timestamp", "readable_time")
+    archived = [dict(zip(columns, row))
+                for row in rows(start_ts, end_ts, tid, columns, by_time=True)]
+    if not archived:
+        return points
+    return list(merge(points, archived, key=lambda p: p["timestamp"], unique=bool(tid)))
+
+# =====================
+# ARCHIVEREN
+# =====================
+
+def decode_all(month):
+    """Alle kolommen van een bestaande maand terug naar lijsten (om samen te voegen)"""
+    n = month.count
+    columns = {name: month.column(name, 0, n) for name in SELECT_COLUMNS if name != "id"}
+    columns["id"] = [None] * n
+    return columns
+
+
+def write_month(path, tid, year, month, columns):
+    """Schrijf de maand naar een tijdelijke map en zet die in één rename op zijn plek
+
+    Alleen als de tijdelijke map terugleest wat er in columns staat; anders
+    ValueError en blijft de oude maand (en dus ook locations) zoals hij was.
+    """
+    base = month_start(year, month)
+    arrays, words = encode(columns, base)
+    tmp = f"{path}.nieuw"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    constants = {}
+    for name, arr in arrays.items():
+        if name != "ts" and is_constant(arr):
+            # Overal dezelfde waarde (vaak: overal NULL): geen bestand, alleen de waarde
+            constants[name] = [arr[0].item(), arr.dtype.str]
+            continue
+        with open(os.path.join(tmp, f"{name}.npy"), "wb") as f:
+            np.save(f, arr)
+            f.flush()
+            os.fsync(f.fileno())
+    meta = {
+        "versie": FORMAT_VERSION,
+        "tid": tid,
+        "maand": f"{year:04d}-{month:02d}",
+        "base": base,
+        "count": len(arrays["ts"]),
+        "fixed": FIXED,
+        "kolommen": sorted(arrays),
+        "constant": constants,
+        "words": words,
+    }
+    with open(os.path.join(tmp, META), "w") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        verify_month(tmp, columns)
+    except ValueError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # Lezers met de oude bestanden open houden hun mmap; de inode blijft bestaan
+    old = f"{path}.oud"
+    if os.path.isdir(path):
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def verify_month(path, columns):
+    """Lees de geschreven maand terug; ValueError als hij niet klopt met columns"""
+    month = Month(path)     # niet uit de cache: de bestanden zelf
+    n = len(columns["timestamp"])
+    if month.count != n:
+        raise ValueError(f"{path}: {month.count} punten teruggelezen, {n} geschreven")
+    if month.column("timestamp", 0, n) != list(columns["timestamp"]):
+        raise ValueError(f"{path}: timestamps lezen niet terug zoals geschreven")
+    for name in ("lat", "lon"):
+        back = np.array(month.column(name, 0, n), dtype=float)
+        if not np.allclose(back, np.array(columns[name], dtype=float), rtol=0, atol=2 / FIXED):
+            raise ValueError(f"{path}: kolom {name} leest niet terug zoals geschreven")
+
+
+def select_month(cur, tid, start_ts, end_ts):
+    sql = f"""
+        SELECT {", ".join(SELECT_COLUMNS[:-1])}, CAST(readable_time AS CHAR)
+        FROM locations
+        WHERE timestamp >= %s AND timestamp < %s AND lat IS NOT NULL AND lon IS NOT NULL
+    """
+    params = [start_ts, end_ts]
+    if tid:
+        sql += " AND tid = %s"
+        params.append(tid)
+    else:
+        sql += " AND (tid IS NULL OR tid = '')"
+    cur.execute(sql + " ORDER BY timestamp, id", params)
+    return cur.fetchall()
+
+
+def archive_month(conn, tid, year, month):
+    """Verplaats de punten van één apparaat in één maand naar het archief
+
+    Geeft (punten, bytes) terug; (0, 0) als er niets te doen was.
+    """
+    start_ts, end_ts = month_start(year, month), month_start(*add_months(year, month, 1))
+    cur = conn.cursor()
+    fetched = select_month(cur, tid, start_ts, end_ts)
+    if not fetched:
+        cur.close()
+        return 0, 0
+
+    ids = [row[0] for row in fetched]
+    columns = {name: list(values) for name, values in zip(SELECT_COLUMNS, zip(*fetched))}
+
+    path = os.path.join(ARCHIVE_DIR, device_dir(tid), f"{year:04d}-{month:02d}")
+    existing = open_month(path)
+    if existing is not None:
+        # Nagekomen punten bij een eerder gearchiveerde maand: samenvoegen
+        old = decode_all(existing)
+        columns = {name: old[name] + columns[name] for name in SELECT_COLUMNS}
+
+    # Op tijd sorteren; bij dezelfde timestamp wint het eerste (het archief)
+    order = sorted(range(len(columns["timestamp"])), key=lambda k: columns["timestamp"][k])
+    keep, seen = [], set()
+    for k in order:
+        if columns["timestamp"][k] not in seen:
+            seen.add(columns["timestamp"][k])
+            keep.append(k)
+    columns = {name: [values[k] for k in keep] for name, values in columns.items()}
+
+    size = write_month(path, tid, year, month, columns)
+
+    # Pas na een geslaagde (en teruggelezen) schrijfactie uit de tabel halen
+    for i in range(0, len(ids), DELETE_CHUNK):
+        chunk = ids[i:i + DELETE_CHUNK]
+        cur.execute(f"DELETE FROM locations WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+    conn.commit()
+    cur.close()
+    return len(keep), size
+
+
+def archive_before(year, month):
+    """Archiveer alle maanden vóór (year, month), per apparaat"""
+    cutoff = month_start(year, month)
+    conn = storage.get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(timestamp) FROM locations WHERE timestamp < %s", (cutoff,))
+    oldest = cur.fetchone()[0]
+    cur.close()
+    if oldest is None:
+        print("Niets te archiveren")
+        conn.close()
+        return
+
+    current = month_of(oldest)
+    total_points = total_bytes = 0
+    started = time.perf_counter()
+    try:
+        while month_start(*current) < cutoff:
+            start_ts, end_ts = month_start(*current), month_start(*add_months(*current, 1))
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT DISTINCT COALESCE(tid, '') FROM locations
+                WHERE timestamp >= %s AND timestamp < %s
+            """, (start_ts, end_ts))
+            tids = sorted(r[0] for r in cur.fetchall())
+            cur.close()
+            for tid in tids:
+                try:
+                    points, size = archive_month(conn, tid, *current)
+                except ValueError as e:
+                    print(f"Overgeslagen: {e}")
+                    continue
+                if points:
+                    total_points += points
+                    total_bytes += size
+                    print(f"{tid or '-':<8} {current[0]:04d}-{current[1]:02d} "
+                          f"{points:>9} punten {size / 1024:>9.0f} KB ({size / points:.1f} B/punt)")
+            current = add_months(*current, 1)
+    finally:
+        conn.close()
+
+    if total_points:
+        print(f"\n{total_points} punten, {total_bytes / 1e6:.1f} MB in "
+              f"{time.perf_counter() - started:.1f}s ({total_bytes / total_points:.1f} B/punt)")
+
+
+def list_archive():
+    for tid, path in device_dirs():
+        for name in sorted(os.listdir(path)):
+            m = open_month(os.path.join(path, name))
+            if m is None:
+                continue
+            size = sum(os.path.getsize(os.path.join(m.path, f)) for f in os.listdir(m.path))
+            print(f"{tid or '-':<8} {name} {m.count:>9} punten {size / 1024:>9.0f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Afgesloten maanden naar het kolomarchief verplaatsen")
+    parser.add_argument("--voor", metavar="YYYY-MM",
+                        help=f"alles vóór deze maand (standaard: ouder dan {KEEP_MONTHS} maanden)")
+    parser.add_argument("--lijst", action="store_true", help="overzicht van het archief")
+    args = parser.parse_args()
+
+    if args.lijst:
+        list_archive()
+        return
+    if args.voor:
+        try:
+            cutoff = parse_month(args.voor)
+        except ValueError:
+            parser.error(f"geen maand: {args.voor}")
+    else:
+        cutoff = add_months(*month_of(time.time()), -KEEP_MONTHS)
+    # De lopende maand blijft altijd in de tabel
+    cutoff = min(cutoff, month_of(time.time()))
+    try:
+        archive_before(*cutoff)
+    except Error as e:
+        print(f"Fout bij archiveren: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark: MariaDB versus SQLite als opslag voor ingest en dagquery's.
+
+Beide backends gaan door dezelfde code als de timeline (storage.get_connection,
+INSERT_SQL met batches van BATCH_SIZE en één commit per batch, de dagquery
+van fetch_day_points) op een losse tabel locations_bench met dezelfde
+indexen. Gemeten worden rijen per seconde bij het vullen en de mediaan van
+het ophalen van één dag.
+
+Gebruik (op de NAS):
+    python benchmarks/bench_backends.py --rows 1000000
+    python benchmarks/bench_backends.py --backends sqlite --sqlite /volume1/tmp/bench.db
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from storage import BATCH_SIZE, INDEXES, UNIQUE_KEY, day_bounds
+
+TABLE = "locations_bench"
+START_TS = 1577836800   # 2020-01-01 00:00 UTC
+STEP = 10               # seconden tussen punten van één apparaat
+DEVICES = ("xm", "ab")
+
+INSERT_SQL = storage.INSERT_SQL.replace("INTO locations ", f"INTO {TABLE} ")
+
+DAY_SQL = f"""
+    SELECT lat, lon, vel, timestamp, CAST(readable_time AS CHAR) as readable_time
+    FROM {TABLE}
+    WHERE timestamp >= %s AND timestamp < %s
+    ORDER BY timestamp ASC
+"""
+
+
+def use_backend(backend, sqlite_path):
+    storage.close_pool()
+    storage.BACKEND = backend
+    storage.SQLITE_PATH = sqlite_path
+
+
+def create_table(conn):
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cur.execute(storage.LOCATIONS_DDL[storage.BACKEND].replace(
+        "IF NOT EXISTS locations", TABLE))
+    if storage.BACKEND == "sqlite":
+        # MariaDB heeft de indexen al in de DDL, SQLite krijgt ze los
+        for name, columns in INDEXES:
+            storage.add_index(cur, TABLE, f"{TABLE}_{name}", columns)
+        storage.add_index(cur, TABLE, f"{TABLE}_{UNIQUE_KEY[0]}", UNIQUE_KEY[1], unique=True)
+    conn.commit()
+    cur.close()
+
+
+def rows(count):
+    for i in range(count):
+        ts = START_TS + (i // len(DEVICES)) * STEP
+        tid = DEVICES[i % len(DEVICES)]
+        yield (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)),
+               52.0 + (i % 1000) * 1e-4, 5.0 + (i % 777) * 1e-4, 5.0, ts,
+               (i % 30) * 1.0, tid, f"owntracks/bench/{tid}", None)
+
+
+def ingest(conn, count):
+    """Vul de tabel zoals de BatchWriter: batches van BATCH_SIZE, één commit per batch"""
+    cur = conn.cursor()
+    batch = []
+    started = time.perf_counter()
+    for row in rows(count):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            cur.executemany(INSERT_SQL, batch)
+            conn.commit()
+            batch.clear()
+    if batch:
+        cur.executemany(INSERT_SQL, batch)
+        conn.commit()
+    cur.close()
+    return count / (time.perf_counter() - started)
+
+
+def day_query(conn, count, repeat):
+    # Een dag in het midden van de gevulde periode
+    ts = START_TS + (count // len(DEVICES) // 2) * STEP
+    day = time.strftime('%Y-%m-%d', time.localtime(ts))
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cur = conn.cursor(dictionary=True)
+        cur.execute(DAY_SQL, day_bounds(day))
+        n = len(cur.fetchall())
+        cur.close()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MariaDB versus SQLite voor ingest en dagquery's")
+    parser.add_argument("--backends", nargs="+", default=["mariadb", "sqlite"],
+                        choices=["mariadb", "sqlite"])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--sqlite", default="bench_backends.db",
+                        help="SQLite-bestand voor de benchmark (wordt na afloop verwijderd)")
+    args = parser.parse_args()
+
+    print(f"{'backend':<10} {'rijen':>10} {'ingest rijen/s':>15} {'dag punten':>11} {'dag ms':>8}")
+    for backend in args.backends:
+        use_backend(backend, args.sqlite)
+        conn = storage.get_connection()
+        create_table(conn)
+        rate = ingest(conn, args.rows)
+        ms, n = day_query(conn, args.rows, args.repeat)
+        print(f"{backend:<10} {args.rows:>10} {rate:>15.0f} {n:>11} {ms:>8.1f}")
+
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE {TABLE}")
+        conn.commit()
+        cur.close()
+        conn.close()
+        storage.close_pool()
+        if backend == "sqlite":
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(args.sqlite + suffix):
+                    os.remove(args.sqlite + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark: dagquery op DATE(readable_time) versus een timestamp-bereik.
+
+Vult een losse tabel locations_bench met synthetische punten (één punt per
+30 seconden, twee apparaten) en meet voor oplopende tabelgroottes hoe lang
+het ophalen van één dag duurt. De oude query moet elke rij langs, de nieuwe
+gebruikt de index en blijft vlak.
+
+Gebruik:
+    python benchmarks/bench_dagquery.py --sizes 10000 100000 1000000 10000000
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import mysql.connector
+from config import DB_CONFIG
+from storage import day_bounds
+
+TABLE = "locations_bench"
+START_TS = 1577836800   # 2020-01-01 00:00 UTC
+STEP = 30               # seconden tussen punten
+CHUNK = 5000
+DEVICES = ("xm", "ab")
+
+OLD_SQL = f"""
+    SELECT lat, lon, vel, CAST(readable_time AS CHAR)
+    FROM {TABLE}
+    WHERE DATE(readable_time) = %s
+    ORDER BY timestamp ASC
+"""
+
+NEW_SQL = f"""
+    SELECT lat, lon, vel, CAST(readable_time AS CHAR)
+    FROM {TABLE}
+    WHERE timestamp >= %s AND timestamp < %s
+    ORDER BY timestamp ASC
+"""
+
+
+def create_table(cur):
+    cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cur.execute(f"""
+        CREATE TABLE {TABLE} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            readable_time DATETIME,
+            lat DOUBLE,
+            lon DOUBLE,
+            vel FLOAT,
+            tid VARCHAR(10),
+            timestamp BIGINT,
+            INDEX (readable_time),
+            INDEX idx_timestamp (timestamp),
+            INDEX idx_tid_timestamp (tid, timestamp)
+        )
+    """)
+
+
+def fill(conn, cur, have, want):
+    """Vul de tabel aan van `have` tot `want` rijen"""
+    sql = f"""INSERT INTO {TABLE} (readable_time, lat, lon, vel, tid, timestamp)
+              VALUES (FROM_UNIXTIME(%s), %s, %s, %s, %s, %s)"""
+    for start in range(have, want, CHUNK):
+        rows = []
+        for i in range(start, min(start + CHUNK, want)):
+            ts = START_TS + (i // len(DEVICES)) * STEP
+            rows.append((ts, 52.0 + (i % 1000) * 1e-4, 5.0 + (i % 777) * 1e-4,
+                         (i % 30) * 1.0, DEVICES[i % len(DEVICES)], ts))
+        cur.executemany(sql, rows)
+        conn.commit()
+    cur.execute(f"ANALYZE TABLE {TABLE}")
+    cur.fetchall()
+
+
+def timed(cur, sql, params, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        n = len(cur.fetchall())
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), n
+
+
+def middle_day(rows):
+    """Een dag in het midden van de gevulde periode"""
+    ts = START_TS + (rows // len(DEVICES) // 2) * STEP
+    return time.strftime('%Y-%m-%d', time.localtime(ts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    create_table(cur)
+
+    print(f"{'rijen':>12} {'punten':>8} {'DATE() ms':>12} {'bereik ms':>12}")
+    have = 0
+    for size in sorted(args.sizes):
+        fill(conn, cur, have, size)
+        have = size
+
+        day = middle_day(size)
+        old_ms, n = timed(cur, OLD_SQL, (day,), args.repeat)
+        new_ms, _ = timed(cur, NEW_SQL, day_bounds(day), args.repeat)
+        print(f"{size:>12} {n:>8} {old_ms:>12.1f} {new_ms:>12.1f}")
+
+    cur.execute("EXPLAIN " + NEW_SQL, day_bounds(middle_day(have)))
+    print("\nEXPLAIN bereikquery:")
+    for row in cur.fetchall():
+        print("  ", row)
+
+    cur.execute(f"DROP TABLE {TABLE}")
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark: grootte en bouwtijd van de folium-export per aantal punten.
+
+Vergelijkt de oude create_route_map (PolyLine plus een CircleMarker met
+popup per punt) met de canvaslaag uit kaartlaag.py, op een synthetische
+track (random walk rond Utrecht, één punt per 5 seconden). Gemeten: tijd
+voor opbouwen en opslaan, en de grootte van het HTML-bestand. De tijd om
+te openen in een browser schaalt met het aantal Leaflet-objecten (oud: één
+per punt, nieuw: één laag) en is hier niet gemeten.
+
+Gebruik:
+    python benchmarks/bench_export.py --points 1000 10000 100000 --max-old 20000
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import folium
+import numpy as np
+
+from kaartlaag import TrackCanvas
+
+
+def make_locations(n, seed=1):
+    rng = np.random.default_rng(seed)
+    lat = 52.09 + np.cumsum(rng.normal(0, 5e-5, n))
+    lon = 5.12 + np.cumsum(rng.normal(0, 8e-5, n))
+    ts = 1767292555 + np.arange(n) * 5
+    acc = rng.integers(3, 30, n)
+    vel = np.abs(rng.normal(8, 4, n))
+    return [
+        {"lat": float(lat[i]), "lon": float(lon[i]), "timestamp": int(ts[i]),
+         "readable_time": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(ts[i]))),
+         "acc": int(acc[i]), "vel": round(float(vel[i]), 1)}
+        for i in range(n)
+    ]
+
+
+def old_map(locations):
+    """Zoals create_route_map in locatie_visualisatie.py was"""
+    m = folium.Map(location=[locations[0]['lat'], locations[0]['lon']], zoom_start=13)
+    folium.PolyLine([(loc['lat'], loc['lon']) for loc in locations],
+                    color='blue', weight=4, opacity=0.8).add_to(m)
+    for loc in locations:
+        folium.CircleMarker(
+            [loc['lat'], loc['lon']],
+            radius=3,
+            popup=f"Tijd: {loc['readable_time']}, Acc: {loc['acc']}m, Snelheid: {loc['vel']} km/h",
+            color='red',
+            fill=True,
+            fillColor='red'
+        ).add_to(m)
+    return m
+
+
+def canvas_map(locations):
+    m = folium.Map(location=[locations[0]['lat'], locations[0]['lon']], zoom_start=13)
+    TrackCanvas(locations).add_to(m)
+    return m
+
+
+def measure(build, locations, path):
+    started = time.perf_counter()
+    build(locations).save(path)
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(path)
+    os.remove(path)
+    return seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grootte en bouwtijd van de kaartexport")
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--max-old", type=int, default=20000,
+                        help="oude methode alleen tot zoveel punten (traag)")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.gettempdir(), "bench_export.html")
+    print(f"{'punten':>8} {'methode':<14} {'tijd s':>8} {'KB':>10} {'bytes/punt':>11}")
+    for n in args.points:
+        locations = make_locations(n)
+        for name, build in (("CircleMarker", old_map), ("canvaslaag", canvas_map)):
+            if build is old_map and n > args.max_old:
+                print(f"{n:>8} {name:<14} {'(overgeslagen)':>20}")
+                continue
+            seconds, size = measure(build, locations, path)
+            print(f"{n:>8} {name:<14} {seconds:>8.2f} {size / 1024:>10.1f} {size / n:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
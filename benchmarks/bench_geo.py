@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+'''
+Micro-benchmark: scalaire distance_m-lus versus geo.track_metrics.
+
+Genereert een synthetische track (random walk rond Utrecht, één punt per
+5 seconden) en vergelijkt de oude Python-lus van de timelinepagina met de
+gevectoriseerde doorloop. Beide moeten dezelfde totale afstand geven.
+
+Gebruik:
+    python benchmarks/bench_geo.py --points 100000
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from geo import distance_m, track_metrics, NOISE_DIST
+
+
+def make_track(n, seed=1):
+    rng = np.random.default_rng(seed)
+    lat = 52.09 + np.cumsum(rng.normal(0, 5e-5, n))
+    lon = 5.12 + np.cumsum(rng.normal(0, 8e-5, n))
+    ts = 1767292555 + np.arange(n) * 5
+    return lat, lon, ts
+
+
+def scalar_total(rows):
+    """De lus zoals die in timeline.py stond"""
+    total = 0
+    for i in range(len(rows) - 1):
+        d = distance_m(rows[i]['lat'], rows[i]['lon'], rows[i+1]['lat'], rows[i+1]['lon'])
+        if d > NOISE_DIST:
+            total += d
+    return total
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="distance_m versus track_metrics")
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lat, lon, ts = make_track(args.points)
+    rows = [{"lat": float(a), "lon": float(o)} for a, o in zip(lat, lon)]
+
+    t_scalar, d_scalar = best_of(lambda: scalar_total(rows), args.repeat)
+    t_vector, metrics = best_of(lambda: track_metrics(lat, lon, ts), args.repeat)
+    d_vector = metrics["distance_m"]
+
+    print(f"punten:          {args.points}")
+    print(f"scalair:         {t_scalar * 1000:8.1f} ms  ({d_scalar / 1000:.3f} km)")
+    print(f"gevectoriseerd:  {t_vector * 1000:8.1f} ms  ({d_vector / 1000:.3f} km)")
+    print(f"versnelling:     {t_scalar / t_vector:8.1f}x")
+    print(f"verschil:        {abs(d_scalar - d_vector):.6f} m")
+
+
+if __name__ == "__main__":
+    main()
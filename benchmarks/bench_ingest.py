@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+'''
+Belastingstest voor /pub: Flask (timeline.py) versus aiohttp (ingest_async.py).
+
+Stuurt met een instelbaar aantal gelijktijdige verbindingen OwnTracks-
+berichten (zelfde payload als zendertest.py) naar één of meer URL's. Elk
+virtueel apparaat rijdt een rechte lijn met een punt per seconde, zodat
+de berichten door de stilstand- en MIN_DIST-filters komen. Per URL worden
+requests per seconde en p50/p99 latency gerapporteerd.
+
+Gebruik:
+    python timeline.py &            # poort 5000
+    python ingest_async.py &        # poort 5001
+    python benchmarks/bench_ingest.py \\
+        --url flask=http://127.0.0.1:5000/pub --url async=http://127.0.0.1:5001/pub
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aiohttp
+from zendertest import maak_payload
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def device_worker(session, url, device, count, latencies, statuses, start_tst):
+    tid = f"b{device:02d}"
+    topic = f"owntracks/bench/{tid}"
+    for i in range(count):
+        # ~11 m per bericht naar het noorden
+        payload = maak_payload(52.0 + device * 0.01 + i * 1e-4, 5.0 + device * 0.01,
+                               tid=tid, tst=start_tst + i, topic=topic)
+        started = time.perf_counter()
+        async with session.post(url, json=payload) as response:
+            await response.read()
+            statuses[response.status] += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run(url, devices, per_device):
+    latencies, statuses = [], Counter()
+    start_tst = int(time.time())
+    connector = aiohttp.TCPConnector(limit=devices)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            device_worker(session, url, d, per_device, latencies, statuses, start_tst)
+            for d in range(devices)
+        ))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "statuses": dict(statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Belastingstest voor /pub")
+    parser.add_argument("--url", action="append", required=True,
+                        help="naam=url, bv. flask=http://127.0.0.1:5000/pub")
+    parser.add_argument("--devices", type=int, default=32, help="gelijktijdige apparaten")
+    parser.add_argument("--per-device", type=int, default=200, help="berichten per apparaat")
+    args = parser.parse_args()
+
+    print(f"{'server':<10} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}  status")
+    for item in args.url:
+        name, _, url = item.partition("=")
+        result = asyncio.run(run(url, args.devices, args.per_device))
+        print(f"{name:<10} {result['requests']:>9} {result['rps']:>9.0f} "
+              f"{result['p50']:>8.1f} {result['p99']:>8.1f}  {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark: OwnTracks via MQTT (mqtt_ingest.py) versus HTTP /pub.
+
+Alles draait in dit proces op een tijdelijk SQLite-bestand:
+  - een minimale MQTT 3.1.1-broker als stand-in voor mosquitto (CONNECT,
+    SUBSCRIBE met + en #, PUBLISH QoS 0/1, PINGREQ; geen retained berichten
+    en geen opslag van sessies)
+  - de abonnee uit mqtt_ingest.py op owntracks/#
+  - de Flask-app uit timeline.py achter de werkzeug-server (HTTP/1.1, keep-alive)
+Elk virtueel apparaat rijdt een rechte lijn met een punt per seconde (zoals
+bench_ingest.py). Over MQTT publiceert elk apparaat met QoS 1 zonder op
+antwoord te wachten; over HTTP wacht elk apparaat op het antwoord, zoals
+de telefoon doet.
+
+Gemeten: berichten per seconde tot het laatste punt gecommit is, en de
+latency van versturen tot commit (inclusief de flush-tijd van de
+BatchWriter, FLUSH_INTERVAL).
+
+Gebruik:
+    python benchmarks/bench_mqtt.py --devices 8 --per-device 500
+'''
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Vóór het importeren van timeline: een eigen SQLite-bestand
+TMP = tempfile.mkdtemp()
+os.environ["TIMELINE_BACKEND"] = "sqlite"
+os.environ["TIMELINE_SQLITE_PATH"] = os.path.join(TMP, "bench_mqtt.db")
+os.environ["TIMELINE_TILE_CACHE"] = os.path.join(TMP, "tiles")
+
+import paho.mqtt.client as mqtt
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import mqtt_ingest
+import storage
+import timeline
+from zendertest import maak_payload
+
+# =====================
+# STAND-IN BROKER
+# =====================
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 12, 13, 14
+
+
+def topic_matches(pattern, topic):
+    p, t = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(p):
+        if part == "#":
+            return True
+        if i >= len(t) or (part != "+" and part != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def mqtt_string(s):
+    data = s.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.request.makefile("rb")
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.next_id = 0
+
+    def send(self, packet_type, flags, body):
+        with self.lock:
+            self.request.sendall(bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body)
+
+    def read_packet(self):
+        first = self.file.read(1)
+        if not first:
+            return None, None, None
+        length, shift = 0, 0
+        while True:
+            b = self.file.read(1)[0]
+            length |= (b & 0x7f) << shift
+            shift += 7
+            if b < 0x80:
+                break
+        return first[0] >> 4, first[0] & 0x0f, self.file.read(length)
+
+    def deliver(self, topic, payload, qos):
+        if qos:
+            self.next_id = self.next_id % 65535 + 1
+            self.send(PUBLISH, qos << 1, mqtt_string(topic) + struct.pack("!H", self.next_id) + payload)
+        else:
+            self.send(PUBLISH, 0, mqtt_string(topic) + payload)
+
+    def handle(self):
+        broker = self.server
+        try:
+            while True:
+                kind, flags, body = self.read_packet()
+                if kind is None or kind == DISCONNECT:
+                    break
+                if kind == CONNECT:
+                    self.send(CONNACK, 0, b"\x00\x00")
+                elif kind == SUBSCRIBE:
+                    pid, pos, granted = body[:2], 2, bytearray()
+                    while pos < len(body):
+                        n = struct.unpack("!H", body[pos:pos + 2])[0]
+                        pattern, qos = body[pos + 2:pos + 2 + n].decode(), body[pos + 2 + n]
+                        pos += 3 + n
+                        self.subscriptions.append((pattern, qos))
+                        granted.append(qos)
+                    with broker.lock:
+                        broker.clients.append(self)
+                    self.send(SUBACK, 0, pid + bytes(granted))
+                elif kind == PUBLISH:
+                    qos = (flags >> 1) & 3
+                    n = struct.unpack("!H", body[:2])[0]
+                    topic, pos = body[2:2 + n].decode(), 2 + n
+                    if qos:
+                        pid, pos = body[pos:pos + 2], pos + 2
+                    payload = body[pos:]
+                    with broker.lock:
+                        clients = list(broker.clients)
+                    for client in clients:
+                        for pattern, sub_qos in client.subscriptions:
+                            if topic_matches(pattern, topic):
+                                client.deliver(topic, payload, min(qos, sub_qos))
+                                break
+                    if qos:
+                        self.send(PUBACK, 0, pid)
+                elif kind == PINGREQ:
+                    self.send(PINGRESP, 0, b"")
+                # PUBACK van abonnees: niets te doen, er wordt niets opnieuw verstuurd
+        except (OSError, IndexError):
+            pass
+        finally:
+            with broker.lock:
+                if self in broker.clients:
+                    broker.clients.remove(self)
+
+
+class StandInBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), BrokerHandler)
+        self.lock = threading.Lock()
+        self.clients = []
+
+# =====================
+# METEN
+# =====================
+
+OUT = sys.stdout
+commits = {}                # (tid, tst) -> perf_counter bij commit
+commits_lock = threading.Lock()
+
+
+def record_commit(batch):
+    now = time.perf_counter()
+    with commits_lock:
+        for row in batch:
+            commits[(row[6], row[4])] = now
+
+
+def payloads(prefix, device, count, start_tst):
+    tid = f"{prefix}{device:02d}"
+    topic = f"owntracks/bench/{tid}"
+    for i in range(count):
+        # ~11 m per bericht naar het noorden, één per seconde
+        payload = maak_payload(52.0 + device * 0.01 + i * 1e-4, 5.0 + device * 0.01,
+                               tid=tid, tst=start_tst + i, topic=topic)
+        yield tid, topic, payload
+
+
+def wait_for(keys, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with commits_lock:
+            if all(k in commits for k in keys):
+                return True
+        time.sleep(0.01)
+    return False
+
+
+def report(name, sent, started):
+    first = {}
+    for tid, tst in sent:
+        first[tid] = min(tst, first.get(tid, tst))
+    # De eerste twee punten per apparaat blijven in de smoothing-buffer
+    expected = [k for k in sent if k[1] - first[k[0]] >= 2]
+    ok = wait_for(expected)
+    with commits_lock:
+        done = [commits[k] for k in expected if k in commits]
+        latencies = sorted((commits[k] - sent[k]) * 1000 for k in expected if k in commits)
+    elapsed = max(done) - started if done else float("nan")
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * (len(latencies) - 1)))] if latencies else 0
+
+    print(f"{name:<6} {len(sent):>9} {len(latencies):>9} {len(sent) / elapsed:>11.0f} "
+          f"{pct(50):>9.1f} {pct(95):>9.1f} {pct(99):>9.1f}{'' if ok else '  (niet alles gecommit)'}",
+          file=OUT)
+
+
+def run_mqtt(host, port, devices, per_device, start_tst):
+    sent = {}
+    publishers = []
+    for d in range(devices):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-pub-{d}")
+        client.max_inflight_messages_set(1000)
+        client.connect(host, port)
+        client.loop_start()
+        publishers.append(client)
+
+    def publish(d):
+        client = publishers[d]
+        infos = []
+        for tid, topic, payload in payloads("mq", d, per_device, start_tst):
+            # Via MQTT zit het topic niet in het bericht
+            del payload["topic"]
+            sent[(tid, payload["tst"])] = time.perf_counter()
+            infos.append(client.publish(topic, json.dumps(payload), qos=1))
+        for info in infos:
+            info.wait_for_publish()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=publish, args=(d,)) for d in range(devices)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report("mqtt", sent, started)
+    for client in publishers:
+        client.disconnect()
+        client.loop_stop()
+
+
+def run_http(port, devices, per_device, start_tst):
+    sent = {}
+
+    def post(d):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        for tid, topic, payload in payloads("ht", d, per_device, start_tst):
+            body = json.dumps(payload)
+            sent[(tid, payload["tst"])] = time.perf_counter()
+            conn.request("POST", "/pub", body, {"Content-Type": "application/json"})
+            conn.getresponse().read()
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=post, args=(d,)) for d in range(devices)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report("http", sent, started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT-ingest versus HTTP /pub")
+    parser.add_argument("--devices", type=int, default=8, help="gelijktijdige apparaten")
+    parser.add_argument("--per-device", type=int, default=500, help="berichten per apparaat")
+    args = parser.parse_args()
+
+    timeline.init_db()
+    timeline.writer.after_commit.append(record_commit)
+    timeline.writer.start()
+
+    broker = StandInBroker()
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    host, port = broker.server_address
+
+    subscribed = threading.Event()
+    subscriber = mqtt_ingest.make_client(client_id="bench-ingest")
+    subscriber.on_subscribe = lambda *a: subscribed.set()
+    subscriber.connect(host, port)
+    subscriber.loop_start()
+    subscribed.wait(10)
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"   # keep-alive, het beste geval voor HTTP
+    server = make_server("127.0.0.1", 0, timeline.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"{'pad':<6} {'verstuurd':>9} {'gecommit':>9} {'berichten/s':>11} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}", file=OUT)
+    # Geen print per punt tijdens het meten
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start_tst = int(time.time())
+        run_mqtt(host, port, args.devices, args.per_device, start_tst)
+        run_http(server.server_port, args.devices, args.per_device, start_tst)
+    finally:
+        sys.stdout = OUT
+
+    subscriber.disconnect()
+    subscriber.loop_stop()
+    server.shutdown()
+    broker.shutdown()
+    timeline.writer.stop()
+    storage.close_pool()
+    shutil.rmtree(TMP, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark: "wanneer was ik hier?" met en zonder ruimtelijke index.
+
+Vult een tijdelijk SQLite-bestand met het echte schema (storage.create_schema
+en spatial.ensure_column) met synthetische ritten door Nederland: een
+willekeurige wandeling per apparaat, één punt per 10 seconden. Daarna
+dezelfde straalvragen op drie manieren:
+  - volledige scan met distance_m() per rij in Python (zoals vroeger nodig)
+  - bbox op de (lat, lon)-index, precieze afstand in NumPy
+  - spatial.query_radius() op de cell-index
+
+Gebruik:
+    python benchmarks/bench_spatial.py --rows 5000000 --queries 20
+'''
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+
+import storage
+import spatial
+from geo import distance_m, haversine
+
+START_TS = 1577836800   # 2020-01-01 00:00 UTC
+STEP = 10               # seconden tussen punten
+BATCH = 5000
+DEVICES = ("xm", "ab", "cd")
+
+
+def fill(conn, count, seed=1):
+    rng = random.Random(seed)
+    pos = {tid: [52.0 + rng.random(), 4.5 + rng.random() * 1.5] for tid in DEVICES}
+    cur = conn.cursor()
+    batch = []
+    for i in range(count):
+        tid = DEVICES[i % len(DEVICES)]
+        p = pos[tid]
+        # ~50 m per stap, met af en toe een sprong naar een andere plek
+        if rng.random() < 1e-4:
+            p[0], p[1] = 52.0 + rng.random(), 4.5 + rng.random() * 1.5
+        p[0] = min(53.5, max(50.8, p[0] + rng.uniform(-4.5e-4, 4.5e-4)))
+        p[1] = min(7.2, max(3.4, p[1] + rng.uniform(-7e-4, 7e-4)))
+        ts = START_TS + (i // len(DEVICES)) * STEP
+        batch.append((time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)),
+                      p[0], p[1], 5.0, ts, 1.0, tid, f"owntracks/bench/{tid}", None))
+        if len(batch) == BATCH:
+            cur.executemany(storage.INSERT_SQL, batch)
+            conn.commit()
+            batch.clear()
+    if batch:
+        cur.executemany(storage.INSERT_SQL, batch)
+        conn.commit()
+    cur.close()
+
+
+def full_scan(conn, lat, lon, radius):
+    cur = conn.cursor()
+    cur.execute("SELECT lat, lon, timestamp FROM locations")
+    hits = sum(1 for a, b, _ in cur if distance_m(lat, lon, a, b) <= radius)
+    cur.close()
+    return hits
+
+
+def latlon_index(conn, lat, lon, radius):
+    south, west, north, east = spatial.radius_bbox(lat, lon, radius)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT lat, lon, timestamp FROM locations
+        WHERE lat >= %s AND lat <= %s AND lon >= %s AND lon <= %s
+    """, (south, north, west, east))
+    rows = cur.fetchall()
+    cur.close()
+    if not rows:
+        return 0
+    a = np.array([r[0] for r in rows])
+    b = np.array([r[1] for r in rows])
+    return int((haversine(a, b, lat, lon) <= radius).sum())
+
+
+def cell_index(conn, lat, lon, radius):
+    return spatial.query_radius(conn, lat, lon, radius)["punten"]
+
+
+def timed(fn, conn, targets, radius):
+    times, hits = [], []
+    for lat, lon in targets:
+        started = time.perf_counter()
+        hits.append(fn(conn, lat, lon, radius))
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), sum(hits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Straalvragen met en zonder ruimtelijke index")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--radius", type=float, default=200, help="meter")
+    parser.add_argument("--scan-queries", type=int, default=3,
+                        help="aantal vragen voor de (trage) volledige scan")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    storage.BACKEND = "sqlite"
+    storage.SQLITE_PATH = os.path.join(tmp, "bench_spatial.db")
+    conn = storage.get_connection()
+    cur = conn.cursor()
+    storage.create_schema(cur)
+    spatial.ensure_column(cur)
+    cur.execute("CREATE TABLE IF NOT EXISTS trips (kind TEXT, tid TEXT, start_ts INTEGER, end_ts INTEGER)")
+    conn.commit()
+    cur.close()
+
+    started = time.perf_counter()
+    fill(conn, args.rows)
+    print(f"{args.rows} punten geschreven in {time.perf_counter() - started:.1f}s")
+
+    # Vraagpunten op bestaande punten, zodat er treffers zijn
+    cur = conn.cursor()
+    cur.execute("SELECT lat, lon FROM locations WHERE id %% %s = 0 LIMIT %s",
+                (max(1, args.rows // args.queries), args.queries))
+    targets = cur.fetchall()
+    cur.close()
+
+    print(f"{'methode':<22} {'vragen':>7} {'mediaan ms':>11} {'treffers':>9}")
+    for name, fn, n in (
+        ("volledige scan", full_scan, args.scan_queries),
+        ("(lat, lon)-index", latlon_index, len(targets)),
+        ("cell-index", cell_index, len(targets)),
+    ):
+        ms, hits = timed(fn, conn, targets[:n], args.radius)
+        print(f"{name:<22} {n:>7} {ms:>11.1f} {hits:>9}")
+
+    conn.close()
+    storage.close_pool()
+    for suffix in ("", "-wal", "-shm"):
+        path = storage.SQLITE_PATH + suffix
+        if os.path.exists(path):
+            os.remove(path)
+    os.rmdir(tmp)
+
+
+if __name__ == "__main__":
+    main()
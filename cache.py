@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+'''
+Begrensde LRU-cache voor gerenderde dagpagina's en API-responses.
+
+Sleutel is (dag, apparaat) met daaronder per route/zoom een variant. De
+ingest roept invalidate() aan voor elke dag waarvoor een punt is opgeslagen,
+zodat alleen een dag met nieuwe data opnieuw uit de database komt.
+
+Elke entry onthoudt de generatie van zijn (dag, apparaat) van vóór het
+renderen; invalidate() verhoogt die. Een dag die tijdens het renderen nieuwe
+punten kreeg, wordt zo niet (of niet bruikbaar) in de cache gezet. Met
+meerdere workers is de teller gedeeld (shared.CacheGenerations) en telt een
+entry van een oudere generatie in elke worker als miss; met één proces
+houdt LocalGenerations hem in het geheugen bij.
+'''
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+MAX_ENTRIES = 500
+MAX_BYTES = 64 * 1024 * 1024
+GZIP_MIN = 1024        # kleinere bodies niet comprimeren
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "gz", "gen")
+
+    def __init__(self, body, gen=0):
+        self.body = body
+        self.gen = gen
+        self.etag = hashlib.sha1(body).hexdigest()
+        # Eén keer comprimeren bij het vullen, niet bij elke request
+        self.gz = gzip.compress(body, compresslevel=6) if len(body) > GZIP_MIN else None
+
+    def size(self):
+        return len(self.body) + (len(self.gz) if self.gz else 0)
+
+
+class LocalGenerations:
+    """Versienummer per (dag, tid) binnen dit proces; zelfde vorm als shared.CacheGenerations"""
+
+    def __init__(self):
+        self._gens = {}
+        self._lock = threading.Lock()
+
+    def get(self, day, tid):
+        return self._gens.get((day, tid or ""), 0)
+
+    def bump(self, day, tid):
+        with self._lock:
+            key = (day, tid or "")
+            self._gens[key] = self._gens.get(key, 0) + 1
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, generations=None):
+        self.max_entries = max_entries
+        self.generations = generations if generations is not None else LocalGenerations()
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # (dag, tid, variant) -> CacheEntry
+        self._by_day = {}               # (dag, tid) -> {variant, ...}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def generation(self, day, tid):
+        """Huidige generatie; vraag hem op vóór het renderen en geef hem aan put()"""
+        return self.generations.get(day, tid)
+
+    def get(self, day, tid, variant):
+        key = (day, tid or "", variant)
+        gen = self.generation(day, tid)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.gen != gen:
+                # Ongeldig gemaakt (door een andere worker, of tijdens het renderen)
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.CACHE.inc(result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.CACHE.inc(result="hit")
+            return entry
+
+    def put(self, day, tid, variant, body, gen=0):
+        entry = CacheEntry(body, gen)
+        key = (day, tid or "", variant)
+        if gen != self.generation(day, tid):
+            # Tijdens het renderen ongeldig gemaakt: wel teruggeven, niet bewaren
+            return entry
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._by_day.setdefault(key[:2], set()).add(variant)
+            self._bytes += entry.size()
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, day, tid=None):
+        """Vergeet alle varianten van een dag, voor dit apparaat en voor 'alle'"""
+        day_keys = {(day, tid or ""), (day, "")}
+        for day_key in day_keys:
+            self.generations.bump(*day_key)
+        with self._lock:
+            for day_key in day_keys:
+                for variant in list(self._by_day.get(day_key, ())):
+                    self._remove(day_key + (variant,))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size()
+        variants = self._by_day.get(key[:2])
+        if variants is not None:
+            variants.discard(key[2])
+            if not variants:
+                del self._by_day[key[:2]]
+
+    def status(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
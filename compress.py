@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+'''
+Online compressie van de track bij het binnenkomen (dead reckoning).
+
+Uit de laatste twee opgeslagen punten van een apparaat volgt een snelheid
+en richting; daarmee wordt voorspeld waar het volgende punt zou moeten
+liggen. Ligt een nieuw punt binnen ERROR_BOUND meter van die voorspelling,
+dan voegt het niets toe en wordt het niet opgeslagen. Rechte stukken met
+constante snelheid kosten zo nog maar een paar rijen; bochten, optrekken
+en remmen blijven staan.
+
+De beslissing valt per punt, zonder buffer, dus past in process_location().
+Het laatst weggelaten punt wordt onthouden en alsnog opgeslagen vlak vóór
+het volgende punt dat wel bewaard wordt: dat is het einde van het rechte
+stuk (vóór een bocht) of van de rit (vóór een tijdgat). Zo volgt de lijn
+tussen de opgeslagen punten de voorspelde lijn, en niet de koorde door de
+bocht of over het gat. Alleen het allerlaatste punt van een rit komt pas
+met het volgende bericht in de database. Na MAX_GAP seconden zonder
+opgeslagen punt wordt altijd opgeslagen. Elke rij krijgt de gebruikte foutgrens in de kolom err_bound, dan
+weten de views hoe ver een weggelaten punt van de lijn kan hebben gelegen
+(NULL: niet gecomprimeerd).
+
+Standaard uit (ERROR_BOUND = 0). Aanzetten met COMPRESS_ERROR_M in
+config.py of TIMELINE_COMPRESS_ERROR.
+
+Rapport op de bestaande geschiedenis (compressieverhouding en afwijking
+van elk weggelaten punt tot de lijn tussen de opgeslagen punten, op
+hetzelfde tijdstip):
+    python compress.py --van 2025-01-01 --tot 2025-12-31 --fout 5 10 25
+'''
+
+import argparse
+import math
+import os
+
+import numpy as np
+
+import config
+from export import period_bounds, stream_rows
+from geo import distance_m, haversine
+from storage import Error
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+ERROR_BOUND = float(os.environ.get("TIMELINE_COMPRESS_ERROR") or getattr(config, "COMPRESS_ERROR_M", 0) or 0)
+MAX_GAP = 60            # seconden – daarna altijd opslaan
+
+# =====================
+# VOORSPELLING
+# =====================
+
+def predicted_deviation(prev, last, lat, lon, tst):
+    """Afstand in meter tussen (lat, lon) en de voorspelling uit prev en last
+
+    prev en last zijn (lat, lon, timestamp) van de laatste twee opgeslagen
+    punten. Zonder twee punten is er geen voorspelling (oneindig).
+    """
+    if prev is None or last is None:
+        return math.inf
+    dt = last[2] - prev[2]
+    if dt <= 0:
+        return math.inf
+    f = (tst - last[2]) / dt
+    return distance_m(last[0] + (last[0] - prev[0]) * f,
+                      last[1] + (last[1] - prev[1]) * f, lat, lon)
+
+
+def keep(prev, last, lat, lon, tst, bound=ERROR_BOUND, max_gap=MAX_GAP):
+    """True als het punt opgeslagen moet worden"""
+    if not bound or last is None or tst - last[2] >= max_gap:
+        return True
+    return predicted_deviation(prev, last, lat, lon, tst) > bound
+
+# =====================
+# RAPPORT
+# =====================
+
+def replay(lat, lon, ts, bound, max_gap=MAX_GAP):
+    """Indexen van de punten die process_location() bij deze foutgrens zou bewaren"""
+    kept = []
+    prev = last = pending = None
+    for i in range(len(ts)):
+        if not keep(prev, last, lat[i], lon[i], ts[i], bound, max_gap):
+            pending = i
+            continue
+        for j in ((pending, i) if pending is not None else (i,)):
+            kept.append(j)
+            prev, last = last, (lat[j], lon[j], ts[j])
+        pending = None
+    return np.array(kept, dtype=np.int64)
+
+
+def deviations(lat, lon, ts, kept):
+    """Afstand (m) van elk weggelaten punt tot de lijn tussen de opgeslagen punten
+
+    Op hetzelfde tijdstip (lineair in de tijd tussen de buren), zoals een
+    view de track uit de opgeslagen punten zou reconstrueren.
+    """
+    dropped = np.setdiff1d(np.arange(len(ts)), kept)
+    if not len(dropped) or len(kept) < 2:
+        return np.zeros(0)
+    # Na het laatste opgeslagen punt is er geen lijn; die punten tellen niet mee
+    dropped = dropped[dropped < kept[-1]]
+    right = kept[np.searchsorted(kept, dropped)]
+    left = kept[np.searchsorted(kept, dropped) - 1]
+    span = (ts[right] - ts[left]).astype(float)
+    f = np.where(span > 0, (ts[dropped] - ts[left]) / np.where(span > 0, span, 1), 0.0)
+    ilat = lat[left] + (lat[right] - lat[left]) * f
+    ilon = lon[left] + (lon[right] - lon[left]) * f
+    return haversine(lat[dropped], lon[dropped], ilat, ilon)
+
+
+def device_tracks(start_ts, end_ts, tid=None):
+    """(tid, lat, lon, ts) als arrays per apparaat, in tijdsvolgorde"""
+    current, rows = None, []
+    for r_tid, ts, _, lat, lon, acc, vel in stream_rows(start_ts, end_ts, tid):
+        if r_tid != current and rows:
+            yield current, *_arrays(rows)
+            rows = []
+        current = r_tid
+        rows.append((lat, lon, ts))
+    if rows:
+        yield current, *_arrays(rows)
+
+
+def _arrays(rows):
+    data = np.array(rows, dtype=float)
+    return data[:, 0], data[:, 1], data[:, 2].astype(np.int64)
+
+
+def report(start_ts, end_ts, bounds, tid=None, max_gap=MAX_GAP):
+    totals = {bound: [0, 0, np.zeros(0)] for bound in bounds}
+    print(f"{'tid':<8} {'fout m':>7} {'punten':>9} {'bewaard':>9} {'verhouding':>10} "
+          f"{'p95 m':>8} {'max m':>8}")
+    for r_tid, lat, lon, ts in device_tracks(start_ts, end_ts, tid):
+        for bound in bounds:
+            kept = replay(lat, lon, ts, bound, max_gap)
+            dev = deviations(lat, lon, ts, kept)
+            _line(r_tid or "-", bound, len(ts), len(kept), dev)
+            total = totals[bound]
+            total[0] += len(ts)
+            total[1] += len(kept)
+            total[2] = np.concatenate([total[2], dev])
+    for bound, (count, kept, dev) in totals.items():
+        if count:
+            _line("totaal", bound, count, kept, dev)
+    return totals
+
+
+def _line(name, bound, count, kept, dev):
+    ratio = count / kept if kept else float("nan")
+    p95 = np.percentile(dev, 95) if len(dev) else 0.0
+    worst = dev.max() if len(dev) else 0.0
+    print(f"{name:<8} {bound:>7g} {count:>9} {kept:>9} {ratio:>9.1f}x {p95:>8.1f} {worst:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressie doorrekenen op de opgeslagen punten")
+    parser.add_argument("--van", required=True, help="eerste dag YYYY-MM-DD")
+    parser.add_argument("--tot", help="laatste dag YYYY-MM-DD (standaard gelijk aan --van)")
+    parser.add_argument("--tid")
+    parser.add_argument("--fout", type=float, nargs="+", default=[ERROR_BOUND or 10],
+                        help="foutgrens(en) in meter")
+    parser.add_argument("--max-gap", type=int, default=MAX_GAP, help="seconden, daarna altijd opslaan")
+    args = parser.parse_args()
+
+    try:
+        start_ts, end_ts = period_bounds(args.van, args.tot)
+        report(start_ts, end_ts, args.fout, args.tid, args.max_gap)
+    except ValueError as e:
+        parser.error(str(e))
+    except Error as e:
+        print(f"Fout bij ophalen locaties: {e}")
+
+
+if __name__ == "__main__":
+    main()
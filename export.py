@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+'''
+Export van de punten als GPX, KML, GeoJSON of CSV.
+
+De punten komen via een server-side cursor (ongebufferd, FETCH_SIZE rijen
+tegelijk) en gaan per blok van CHUNK_SIZE bytes de deur uit, eventueel
+door gzip. Er staat dus nooit meer dan één blok in het geheugen, of het nu
+om één dag of vijf jaar gaat.
+
+Daggrenzen en apparaatfilter zijn die van de timelinepagina
+(storage.day_bounds, tid = %s). Zonder tid komen de apparaten na elkaar,
+elk in tijdsvolgorde; in GPX en KML elk als eigen track. Gearchiveerde
+maanden (archive.py) worden in dezelfde volgorde meegenomen.
+
+Gebruik (Flask):
+    /export?from=2026-01-01&to=2026-01-31&format=gpx&tid=xm
+Of vanaf de commandoregel:
+    python export.py --van 2025-01-01 --tot 2025-12-31 --formaat csv > punten.csv
+'''
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+import zlib
+from xml.sax.saxutils import escape
+
+import archive
+import storage
+from storage import Error, day_bounds
+from trips import GAP_THRESHOLD_SECONDS
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+FETCH_SIZE = 5000       # rijen per fetchmany
+CHUNK_SIZE = 64 * 1024  # bytes per blok naar de client
+GZIP_LEVEL = 6
+
+COLUMNS = ("tid", "timestamp", "readable_time", "lat", "lon", "acc", "vel")
+
+
+def iso_time(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts))
+
+# =====================
+# LEZEN
+# =====================
+
+def period_bounds(van, tot):
+    """(start_ts, end_ts) van de eerste tot en met de laatste dag; ValueError bij een foute datum"""
+    start_ts = day_bounds(van)[0]
+    end_ts = day_bounds(tot or van)[1]
+    if end_ts <= start_ts:
+        raise ValueError(f"{tot} ligt voor {van}")
+    return start_ts, end_ts
+
+
+def db_rows(cur):
+    while True:
+        rows = cur.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+
+def stream_rows(start_ts, end_ts, tid=None):
+    """Rijen (zie COLUMNS) per apparaat in tijdsvolgorde; eigen verbinding uit de pool
+
+    De query draait al bij de aanroep, niet pas bij de eerste rij: een
+    databasefout komt dan nog vóór de headers van een gestreamde response.
+    """
+    sql = """
+        SELECT COALESCE(tid, ''), timestamp, CAST(readable_time AS CHAR), lat, lon, acc, vel
+        FROM locations
+        WHERE timestamp >= %s AND timestamp < %s
+    """
+    params = [start_ts, end_ts]
+    if tid:
+        sql += " AND tid = %s ORDER BY timestamp"
+        params.append(tid)
+    else:
+        sql += " ORDER BY COALESCE(tid, ''), timestamp"
+
+    # Afgesloten maanden staan (deels) in het kolomarchief; zelfde volgorde
+    archived = archive.rows(start_ts, end_ts, tid, COLUMNS)
+
+    conn = storage.get_connection()
+    try:
+        cur = conn.cursor(buffered=False)
+        cur.execute(sql, params)
+    except Error:
+        conn.close()
+        raise
+    return _merged_rows(conn, cur, archived)
+
+
+def _merged_rows(conn, cur, archived):
+    try:
+        yield from archive.merge(db_rows(cur), archived, key=lambda row: (row[0], row[1]))
+    finally:
+        # Ook als de client halverwege afhaakt (GeneratorExit)
+        try:
+            cur.close()
+        except Error:
+            pass
+        conn.close()
+
+# =====================
+# FORMATEN
+# =====================
+# Elke functie krijgt de rijen en geeft stukken tekst; chunked() bundelt ze.
+
+def gpx(rows):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="timeline" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    tid = prev_ts = None
+    for r_tid, ts, _, lat, lon, acc, vel in rows:
+        if r_tid != tid:
+            if tid is not None:
+                yield '</trkseg></trk>\n'
+            yield f'<trk><name>{escape(r_tid or "-")}</name><trkseg>\n'
+            tid = r_tid
+        elif ts - prev_ts > GAP_THRESHOLD_SECONDS:
+            # Tijdgat: nieuw segment, net als een nieuwe rit in trips.py
+            yield '</trkseg><trkseg>\n'
+        prev_ts = ts
+        yield f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><time>{iso_time(ts)}</time></trkpt>\n'
+    if tid is not None:
+        yield '</trkseg></trk>\n'
+    yield '</gpx>\n'
+
+
+def kml(rows):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+           '<Document>\n')
+    tid = None
+    for r_tid, ts, _, lat, lon, acc, vel in rows:
+        if r_tid != tid:
+            if tid is not None:
+                yield '</gx:Track></Placemark>\n'
+            yield f'<Placemark><name>{escape(r_tid or "-")}</name><gx:Track>\n'
+            tid = r_tid
+        # gx:Track staat when en coord door elkaar toe, zolang ze om en om komen
+        yield f'<when>{iso_time(ts)}</when><gx:coord>{lon:.7f} {lat:.7f} 0</gx:coord>\n'
+    if tid is not None:
+        yield '</gx:Track></Placemark>\n'
+    yield '</Document>\n</kml>\n'
+
+
+def geojson(rows):
+    yield '{"type":"FeatureCollection","features":[\n'
+    sep = ''
+    for tid, ts, readable_time, lat, lon, acc, vel in rows:
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, 7), round(lat, 7)]},
+            "properties": {"tid": tid or None, "timestamp": ts, "time": readable_time,
+                           "acc": acc, "vel": vel},
+        }
+        yield sep + json.dumps(feature, separators=(',', ':'), default=float)
+        sep = ',\n'
+    yield '\n]}\n'
+
+
+def csv_rows(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+FORMATS = {
+    # formaat: (functie, mimetype, extensie)
+    "gpx": (gpx, "application/gpx+xml", "gpx"),
+    "kml": (kml, "application/vnd.google-earth.kml+xml", "kml"),
+    "geojson": (geojson, "application/geo+json", "geojson"),
+    "csv": (csv_rows, "text/csv", "csv"),
+}
+
+
+def chunked(parts, size=CHUNK_SIZE):
+    """Kleine stukken tekst bundelen tot blokken bytes van ongeveer size"""
+    buf, length = [], 0
+    for part in parts:
+        buf.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buf).encode()
+            buf, length = [], 0
+    if buf:
+        yield "".join(buf).encode()
+
+
+def gzipped(chunks, level=GZIP_LEVEL):
+    """Blokken door gzip (met header, dus een geldig .gz-bestand)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(fmt, start_ts, end_ts, tid=None, gzip=False):
+    """Generator met de bytes van de hele export
+
+    Het eerste blok wordt hier al gemaakt, zodat een fout bij de query of
+    het archief een foutmelding wordt in plaats van een afgekapt bestand.
+    """
+    chunks = chunked(FORMATS[fmt][0](stream_rows(start_ts, end_ts, tid)))
+    chunks = itertools.chain([next(chunks, b"")], chunks)
+    return gzipped(chunks) if gzip else chunks
+
+
+def filename(fmt, van, tot, tid=None):
+    name = f"timeline_{van}_{tot or van}" + (f"_{tid}" if tid else "")
+    return f"{name}.{FORMATS[fmt][2]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Punten exporteren als GPX, KML, GeoJSON of CSV")
+    parser.add_argument("--van", required=True, help="eerste dag YYYY-MM-DD")
+    parser.add_argument("--tot", help="laatste dag YYYY-MM-DD (standaard gelijk aan --van)")
+    parser.add_argument("--formaat", choices=sorted(FORMATS), default="gpx")
+    parser.add_argument("--tid")
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        start_ts, end_ts = period_bounds(args.van, args.tot)
+        for chunk in export(args.formaat, start_ts, end_ts, args.tid, args.gzip):
+            sys.stdout.buffer.write(chunk)
+    except ValueError as e:
+        parser.error(str(e))
+    except Error as e:
+        print(f"Fout bij exporteren: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
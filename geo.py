@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+'''
+Gedeelde geo-functies: haversine-afstand en trackmetrieken.
+
+distance_m() is de scalaire versie voor de ingest-filters (één punt per
+bericht). De overige functies werken in één gevectoriseerde doorloop op
+NumPy-arrays van lat/lon/timestamp van een hele track.
+'''
+
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+
+R = 6371000             # aardstraal in meter
+NOISE_DIST = 5          # meter – kleinere stappen tellen niet mee voor de afstand
+MOVING_SPEED = 1.0      # m/s – sneller dan dit telt als bewegen
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Afstand tussen twee GPS-punten in meters"""
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
+    return R * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Afstand in meters tussen arrays van punten (elementsgewijs)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def pairwise_distances(lat, lon):
+    """Afstand van elk punt naar het volgende (lengte n-1)"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    return haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+
+def bearings(lat, lon):
+    """Koers in graden (0 = noord) van elk punt naar het volgende"""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    dlon = lon[1:] - lon[:-1]
+    y = np.sin(dlon) * np.cos(lat[1:])
+    x = np.cos(lat[:-1]) * np.sin(lat[1:]) - np.sin(lat[:-1]) * np.cos(lat[1:]) * np.cos(dlon)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def speeds(lat, lon, ts):
+    """Snelheid in m/s per stap; 0 waar de tijdstap 0 is"""
+    d = pairwise_distances(lat, lon)
+    dt = np.diff(np.asarray(ts, dtype=float))
+    return np.divide(d, dt, out=np.zeros_like(d), where=dt > 0)
+
+
+def total_distance(lat, lon, noise=NOISE_DIST):
+    """Totale afstand in meters, stappen van `noise` meter of minder tellen niet"""
+    if len(lat) < 2:
+        return 0.0
+    d = pairwise_distances(lat, lon)
+    return float(d[d > noise].sum())
+
+
+def track_metrics(lat, lon, ts, noise=NOISE_DIST, moving_speed=MOVING_SPEED):
+    """Afstanden, snelheden, koersen en totalen van een track in één doorloop"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    ts = np.asarray(ts, dtype=float)
+    if len(lat) < 2:
+        empty = np.zeros(0)
+        return {
+            "steps": empty, "speeds": empty, "bearings": empty,
+            "distance_m": 0.0, "moving_s": 0,
+        }
+
+    d = pairwise_distances(lat, lon)
+    dt = np.diff(ts)
+    v = np.divide(d, dt, out=np.zeros_like(d), where=dt > 0)
+    counted = d > noise
+    moving = counted & (v >= moving_speed)
+    return {
+        "steps": d,
+        "speeds": v,
+        "bearings": bearings(lat, lon),
+        "distance_m": float(d[counted].sum()),
+        "moving_s": int(dt[moving].sum()),
+    }
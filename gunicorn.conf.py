@@ -0,0 +1,49 @@
+# Gunicorn-configuratie voor timeline.py met meerdere workers.
+#
+# Starten (zie timeline-gunicorn.service):
+#     gunicorn -c gunicorn.conf.py timeline:app
+#
+# Filterstatus en cache-generaties gaan via een gedeeld SQLite/WAL-bestand,
+# zodat elke worker dezelfde stilstand/MIN_DIST/smoothing-beslissingen neemt.
+
+import multiprocessing
+import os
+
+os.environ.setdefault(
+    "TIMELINE_SHARED_STATE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_state.db"),
+)
+
+bind = "0.0.0.0:5000"
+workers = multiprocessing.cpu_count()
+threads = 4
+timeout = 60
+# Let op: on_starting importeert timeline al in de master, dus de workers erven
+# de module via fork; preload_app = False verandert daar niets aan. Dat gaat
+# goed omdat niets procesgebonden de fork overleeft: de MariaDB-pool wordt in
+# on_starting gesloten, de SQLite-pool, de verbinding met het gedeelde bestand
+# en de log-listener kijken naar os.getpid() en beginnen in de worker opnieuw,
+# en de writer-thread start pas in post_worker_init.
+preload_app = False
+
+
+def on_starting(server):
+    # Schema-migraties en het vullen van de gedeelde filterstatus één keer, in de
+    # master (zie hierboven: de workers erven de geïmporteerde modules)
+    import storage
+    import timeline
+    timeline.init_db()
+    timeline.warm_devices()
+    # Geen open databaseverbindingen meegeven aan de workers
+    storage.close_pool()
+
+
+def post_worker_init(worker):
+    from timeline import writer
+    writer.start()
+
+
+def worker_exit(server, worker):
+    # Wachtrij van deze worker leegschrijven voordat hij stopt
+    from timeline import writer
+    writer.stop()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+'''
+Importeer OwnTracks-historie in de database, in stukken en hervatbaar.
+
+Bronnen:
+  - een SQLite database met een tabel locations (zoals location_data.db)
+  - OwnTracks Recorder .rec bestanden
+  - GPX bestanden (trkpt met <time>)
+
+De rijen worden in blokken van --chunk gelezen en weggeschreven met één
+commit per blok. Na elk blok wordt de positie in de bron opgeslagen in het
+checkpointbestand, zodat een afgebroken import verder gaat waar hij was.
+Dankzij de unieke sleutel op (tid, timestamp) levert opnieuw importeren
+geen dubbele punten op: bestaande punten worden bijgewerkt.
+
+Gebruik:
+    python importeer.py location_data.db
+    python importeer.py recorder/ajan/a14xm/*.rec
+    python importeer.py --tid xm rit.gpx
+'''
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import pytz
+
+import storage
+from storage import Error
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+CHUNK_SIZE = 5000
+CHECKPOINT_FILE = "importeer_checkpoint.json"
+local_tz = pytz.timezone('Europe/Amsterdam')
+
+COLUMNS = (
+    "readable_time", "SSID", "acc", "alt", "batt", "bs", "cog", "conn",
+    "created_at", "lat", "lon", "m", "source", "tid", "topic", "vac", "vel",
+    "timestamp",
+)
+
+UPSERT_SQL = """
+    INSERT INTO locations ({columns}) VALUES ({values})
+    ON DUPLICATE KEY UPDATE {updates}
+""".format(
+    columns=", ".join(COLUMNS),
+    values=", ".join(["%s"] * len(COLUMNS)),
+    updates=", ".join(f"{c} = VALUES({c})" for c in COLUMNS if c not in ("tid", "timestamp")),
+)
+
+# =====================
+# BRONNEN
+# =====================
+# Elke lezer geeft (positie, rij) terug; positie is waar een hervatting begint.
+
+def owntracks_row(data, tid=None):
+    """Rij voor locations uit een OwnTracks location-bericht"""
+    tst = int(data["tst"])
+    readable_time = datetime.fromtimestamp(tst, pytz.utc).astimezone(local_tz)
+    values = dict(data, tid=data.get("tid") or tid or "", timestamp=tst,
+                  readable_time=readable_time.strftime('%Y-%m-%d %H:%M:%S'))
+    return tuple(values.get(c) for c in COLUMNS)
+
+
+def read_sqlite(path, start, tid=None):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    last = start or 0
+    while True:
+        cur.execute(f"""
+            SELECT rowid, {", ".join(COLUMNS)} FROM locations
+            WHERE rowid > ? ORDER BY rowid LIMIT ?
+        """, (last, CHUNK_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        for row in rows:
+            last = row[0]
+            row = list(row[1:])
+            row[COLUMNS.index("tid")] = row[COLUMNS.index("tid")] or tid or ""
+            yield last, tuple(row)
+    conn.close()
+
+
+def read_rec(path, start, tid=None):
+    """OwnTracks Recorder: 'tijd<TAB>label<TAB>json' per regel"""
+    with open(path, "rb") as f:
+        f.seek(start or 0)
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            parts = line.decode("utf-8", "replace").split("\t", 2)
+            if len(parts) < 3:
+                continue
+            try:
+                data = json.loads(parts[2])
+            except ValueError:
+                continue
+            if data.get("_type") != "location" or "tst" not in data:
+                continue
+            yield f.tell(), owntracks_row(data, tid)
+
+
+def read_gpx(path, start, tid=None):
+    """GPX trackpunten; positie is het aantal al verwerkte punten"""
+    index = 0
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if not elem.tag.endswith("trkpt"):
+            continue
+        index += 1
+        if index > (start or 0):
+            point = {"lat": float(elem.get("lat")), "lon": float(elem.get("lon"))}
+            for child in elem:
+                name = child.tag.rsplit("}", 1)[-1]
+                if name == "time":
+                    dt = datetime.fromisoformat(child.text.strip().replace("Z", "+00:00"))
+                    point["tst"] = int(dt.timestamp())
+                elif name == "ele":
+                    point["alt"] = float(child.text)
+            if "tst" in point:
+                point["source"] = "gpx"
+                yield index, owntracks_row(point, tid)
+        # Geheugen constant houden: verwerkte elementen weggooien
+        elem.clear()
+
+
+def reader_for(path):
+    if path.endswith(".rec"):
+        return read_rec
+    if path.endswith(".gpx"):
+        return read_gpx
+    return read_sqlite
+
+# =====================
+# IMPORT
+# =====================
+
+def load_checkpoints(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_checkpoints(path, checkpoints):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoints, f, indent=1)
+    os.replace(tmp, path)
+
+
+def import_source(conn, path, checkpoints, checkpoint_file, chunk_size=CHUNK_SIZE, tid=None):
+    key = os.path.abspath(path)
+    start = checkpoints.get(key)
+    if start:
+        print(f"⏩ {path}: hervatten vanaf positie {start}")
+
+    cur = conn.cursor()
+    started = time.perf_counter()
+    total = 0
+    chunk = []
+    position = start
+
+    def flush():
+        nonlocal total
+        cur.executemany(UPSERT_SQL, chunk)
+        conn.commit()
+        checkpoints[key] = position
+        save_checkpoints(checkpoint_file, checkpoints)
+        total += len(chunk)
+        chunk.clear()
+        rate = total / max(time.perf_counter() - started, 1e-9)
+        print(f"   {path}: {total} rijen, {rate:.0f} rijen/s")
+
+    for position, row in reader_for(path)(path, start, tid):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    cur.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importeer OwnTracks-historie in de database")
+    parser.add_argument("bronnen", nargs="+", help="SQLite .db, .rec of .gpx bestanden")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rijen per commit")
+    parser.add_argument("--tid", help="tid voor punten zonder eigen tid (bv. GPX)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="checkpointbestand")
+    parser.add_argument("--opnieuw", action="store_true", help="checkpoints negeren")
+    args = parser.parse_args()
+
+    checkpoints = {} if args.opnieuw else load_checkpoints(args.checkpoint)
+    conn = storage.get_connection()
+    started = time.perf_counter()
+    total = 0
+    try:
+        for path in args.bronnen:
+            total += import_source(conn, path, checkpoints, args.checkpoint, args.chunk, args.tid)
+    except Error as e:
+        print(f"Fout bij importeren: {e}")
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {total} rijen in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rijen/s)")
+    if total:
+        print("Werk daarna de afgeleide tabellen bij: python summary.py --backfill && python trips.py")
+
+
+if __name__ == "__main__":
+    main()
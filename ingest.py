@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+'''
+Filters en filterstatus per apparaat voor de /pub ingest.
+
+Elk apparaat (OwnTracks topic, of anders tid) krijgt zijn eigen laatst
+opgeslagen punt en smoothing-buffer, zodat twee telefoons elkaars stilstand-,
+MIN_DIST- en smoothing-beslissingen niet meer verstoren. Apparaten die lang
+niets sturen vallen er via LRU uit. Bij het opstarten wordt het register
+gevuld met het laatste punt per apparaat uit de tabel locations.
+
+process_location() is de filterketen zelf (accuracy, stilstand, MIN_DIST,
+smoothing en optioneel de compressie uit compress.py); de Flask-route en
+de andere ingangen gebruiken allemaal deze.
+parse_messages() en process_bulk() doen hetzelfde voor een hele achterstand
+in één request (JSON-array of NDJSON).
+'''
+
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import pytz
+import compress
+import metrics
+from config import STATIONARY_RADIUS, STATIONARY_TIME
+from geo import distance_m
+from log import log
+from storage import COL
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+MAX_ACC = 20            # meter – alles erboven weggooien
+MIN_DIST = 3            # meter – minimale verplaatsing
+SMOOTH_WINDOW = 3       # aantal punten voor smoothing
+MAX_DEVICES = 256       # max aantal apparaten in het geheugen
+IDLE_TIMEOUT = 7 * 24 * 3600  # seconden zonder bericht voordat een apparaat vervalt
+local_tz = pytz.timezone('Europe/Amsterdam')
+
+# Antwoord als het punt wel door de filters komt maar de wachtrij vol zit
+QUEUE_FULL = "queue full"
+
+# Uitkomst van de filterketen (label in /metrics) -> antwoord voor de client
+OUTCOMES = {
+    "ignored": "ignored",               # geen locatiebericht of velden ontbreken
+    "accuracy": "ignored",              # acc > MAX_ACC
+    "stationary": "stationary ignored",
+    "too_close": "too close ignored",
+    "buffering": "buffering",
+    "compressed": "compressed",
+    "stored": "ok",
+    "queue_full": QUEUE_FULL,
+    "invalid": "invalid",               # velden van het verkeerde type
+}
+
+# =====================
+# STATUS PER APPARAAT
+# =====================
+
+def device_key(data):
+    """Sleutel voor een OwnTracks bericht: topic, anders tid"""
+    return data.get("topic") or data.get("tid") or ""
+
+
+class DeviceState:
+    __slots__ = ("last_saved_point", "prev_saved_point", "pending_row", "last_points",
+                 "last_seen", "lock")
+
+    def __init__(self):
+        # last_saved_point formaat: (lat, lon, timestamp)
+        self.last_saved_point = None
+        # Het punt daarvoor, voor de voorspelling van compress.py
+        self.prev_saved_point = None
+        # Laatste rij die compress.py wegliet; wordt opgeslagen vóór het volgende bewaarde punt
+        self.pending_row = None
+        self.last_points = deque(maxlen=SMOOTH_WINDOW)
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class DeviceRegistry:
+    """LRU-register van DeviceState per apparaat"""
+
+    def __init__(self, max_devices=MAX_DEVICES, idle_timeout=IDLE_TIMEOUT):
+        self.max_devices = max_devices
+        self.idle_timeout = idle_timeout
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = DeviceState()
+            else:
+                self._states.move_to_end(key)
+            state.last_seen = now
+            self._evict(now)
+            return state
+
+    def _evict(self, now):
+        # Oudste apparaten staan vooraan; stop bij het eerste dat nog actief is
+        while len(self._states) > self.max_devices:
+            self._states.popitem(last=False)
+        while self._states:
+            key, oldest = next(iter(self._states.items()))
+            if now - oldest.last_seen <= self.idle_timeout:
+                break
+            del self._states[key]
+
+    def __len__(self):
+        return len(self._states)
+
+    def warm(self, conn):
+        """Vul het register met het laatste opgeslagen punt per apparaat"""
+        rows = latest_points(conn)
+        for key, lat, lon, ts in rows:
+            self.get(key).last_saved_point = (lat, lon, ts)
+        return len(rows)
+
+
+def latest_points(conn):
+    """(sleutel, lat, lon, timestamp) van het laatste punt per apparaat"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT l.tid, l.topic, l.lat, l.lon, l.timestamp
+        FROM locations l
+        JOIN (
+            SELECT tid, topic, MAX(timestamp) AS ts
+            FROM locations
+            GROUP BY tid, topic
+        ) laatste
+          ON l.timestamp = laatste.ts
+         AND (l.tid = laatste.tid OR (l.tid IS NULL AND laatste.tid IS NULL))
+         AND (l.topic = laatste.topic OR (l.topic IS NULL AND laatste.topic IS NULL))
+        ORDER BY l.timestamp ASC
+    """)
+    rows = cur.fetchall()
+    cur.close()
+    return [(topic or tid or "", lat, lon, ts) for tid, topic, lat, lon, ts in rows]
+
+# =====================
+# FILTERKETEN
+# =====================
+
+def process_location(devices, data, store):
+    """Stuur één OwnTracks-bericht door de filters
+
+    store(row) zet een rij in de schrijfwachtrij en geeft False als dat niet
+    lukt. Geeft het antwoord voor de client terug: 'ignored',
+    'stationary ignored', 'too close ignored', 'buffering', 'compressed',
+    'ok' of QUEUE_FULL. De uitkomst wordt geteld in /metrics.
+    """
+    outcome = filter_location(devices, data, store)
+    metrics.INGEST.inc(outcome=outcome)
+    return OUTCOMES[outcome]
+
+
+def filter_location(devices, data, store):
+    """De filterketen zelf; geeft de uitkomst (een sleutel van OUTCOMES)"""
+    if data.get("_type") != "location":
+        return "ignored"
+
+    lat, lon, acc = data.get("lat"), data.get("lon"), data.get("acc")
+    tst = data.get('tst')
+
+    # 1. Basis filters (Accuracy)
+    if lat is None or lon is None or acc is None or tst is None:
+        return "ignored"
+    # Vóór het aanraken van de filterstatus: een kapot bericht mag die niet verschuiven
+    if not all(isinstance(v, (int, float)) for v in (lat, lon, acc, tst, data.get("vel", 0))):
+        return "invalid"
+    if not all(isinstance(v, (str, type(None))) for v in (data.get("tid"), data.get("topic"))):
+        return "invalid"
+    if acc > MAX_ACC:
+        return "accuracy"
+
+    state = devices.get(device_key(data))
+    with state.lock:
+        last_saved_point = state.last_saved_point
+
+        # 2. Stilstand filter
+        dist = 0.0
+        if last_saved_point:
+            # last_saved_point formaat: (lat, lon, timestamp)
+            dist = distance_m(last_saved_point[0], last_saved_point[1], lat, lon)
+            time_diff = tst - last_saved_point[2]
+
+            # Ben je binnen de straal?
+            if dist < STATIONARY_RADIUS:
+                # Ben je hier al langer dan de STATIONARY_TIME?
+                if time_diff > STATIONARY_TIME:
+                    # We slaan dit punt niet op, want we staan al stil op deze plek
+                    log.info("Stilstand gedetecteerd (> %ss), punt genegeerd.", STATIONARY_TIME)
+                    return "stationary"
+
+            # Ben je nog heel dichtbij het vorige punt (tegen jitter), maar nog niet lang genoeg?
+            if dist < MIN_DIST:
+                return "too_close"
+
+        # 3. Smoothing (optioneel, als je dit nog gebruikt)
+        state.last_points.append((lat, lon))
+        if len(state.last_points) < SMOOTH_WINDOW:
+            return "buffering"
+
+        dt_nl = datetime.fromtimestamp(tst, pytz.utc).astimezone(local_tz)
+        readable_time = dt_nl.strftime('%Y-%m-%d %H:%M:%S')
+
+        # Zonder tid als '' (zoals importeer.py): NULL telt niet mee in de unieke sleutel
+        row = (readable_time, lat, lon, acc, tst, data.get('vel', 0),
+               data.get('tid') or "", data.get('topic'), compress.ERROR_BOUND or None)
+
+        # 4. Compressie (optioneel): ligt het punt op de voorspelde lijn, dan niet opslaan
+        if not compress.keep(state.prev_saved_point, last_saved_point, lat, lon, tst):
+            state.pending_row = row
+            return "compressed"
+
+        # 5. Opslaan via de schrijfwachtrij; eerst het laatst weggelaten punt
+        # (einde van het rechte stuk of van de rit), daarna dit punt
+        if state.pending_row is not None:
+            if not store(state.pending_row):
+                log.warning("Wachtrij vol, punt niet opgeslagen")
+                return "queue_full"
+            pending = state.pending_row
+            state.pending_row = None
+            last_saved_point = (pending[COL["lat"]], pending[COL["lon"]], pending[COL["timestamp"]])
+            state.prev_saved_point, state.last_saved_point = state.last_saved_point, last_saved_point
+
+        if not store(row):
+            log.warning("Wachtrij vol, punt niet opgeslagen")
+            return "queue_full"
+
+        # Update het laatste punt met de huidige locatie en TIJD
+        state.prev_saved_point = last_saved_point
+        state.last_saved_point = (lat, lon, tst)
+    log.info("Locatie in wachtrij: %s (afstand: %.1fm)", readable_time, dist)
+    return "stored"
+
+# =====================
+# BULK
+# =====================
+
+def parse_messages(body):
+    """Berichten uit een request-body: één JSON-object, een JSON-array of NDJSON
+
+    Geeft (berichten, is_bulk). Een NDJSON-regel die geen JSON is komt als
+    None in de lijst, zodat hij een eigen status krijgt. ValueError als de
+    body helemaal niets bruikbaars bevat.
+    """
+    text = body.decode("utf-8") if isinstance(body, bytes) else body
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    else:
+        if isinstance(data, list):
+            return data, True
+        return [data], False
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) < 2:
+        raise ValueError("geen JSON of NDJSON")
+    messages = []
+    for line in lines:
+        try:
+            messages.append(json.loads(line))
+        except ValueError:
+            messages.append(None)
+    return messages, True
+
+
+def _tst_order(message):
+    tst = message.get("tst") if isinstance(message, dict) else None
+    return (0, tst) if isinstance(tst, (int, float)) else (1, 0)
+
+
+def process_bulk(devices, messages):
+    """Alle berichten op tst-volgorde door de filters
+
+    Geeft (rijen, statussen): de rijen om in één keer op te slaan en per
+    bericht (in de volgorde van de request) het antwoord van process_location,
+    of 'invalid' voor iets dat geen bericht is. Een bericht waar de filters
+    op stuklopen krijgt ook 'invalid'; de rest van de achterstand gaat door.
+    """
+    rows = []
+
+    def collect(row):
+        rows.append(row)
+        return True
+
+    statuses = [None] * len(messages)
+    # Een achterstand komt vaak nieuwste-eerst binnen; de filters willen tijdsvolgorde
+    for i in sorted(range(len(messages)), key=lambda i: _tst_order(messages[i])):
+        message = messages[i]
+        if not isinstance(message, dict):
+            metrics.INGEST.inc(outcome="invalid")
+            statuses[i] = "invalid"
+            continue
+        try:
+            statuses[i] = process_location(devices, message, collect)
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            log.warning("Bericht %d uit achterstand overgeslagen: %s", i, e)
+            metrics.INGEST.inc(outcome="invalid")
+            statuses[i] = "invalid"
+    return rows, statuses
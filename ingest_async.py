@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+'''
+Asynchrone ingest-server voor OwnTracks /pub (aiohttp).
+
+Neemt dezelfde berichten aan als de Flask-route in timeline.py en stuurt ze
+door dezelfde filterketen (ingest.process_location). Opslaan gebeurt niet in
+de request: de rij gaat in de wachtrij van de BatchWriter, die in een eigen
+thread in batches naar de database schrijft. Zit die wachtrij vol, dan krijgt de
+client direct 503 met Retry-After, zodat de telefoon het punt later opnieuw
+stuurt in plaats van dat requests zich opstapelen.
+
+Gebruik:
+    python ingest_async.py --port 5001
+'''
+
+import argparse
+import asyncio
+
+from aiohttp import web
+
+import metrics
+from storage import Error
+from ingest import process_location, parse_messages, QUEUE_FULL
+from timeline import init_db, get_db_connection, devices, writer, receive_bulk
+
+RETRY_AFTER = 30        # seconden – advies aan de client bij een volle wachtrij
+
+
+def store_nowait(row):
+    # Nooit blokkeren in de event loop: vol is vol
+    return writer.put(row, timeout=0)
+
+
+async def receive_location(request):
+    try:
+        messages, bulk = parse_messages(await request.read())
+    except ValueError:
+        return web.Response(text="bad request", status=400)
+    if bulk:
+        # Filters en de transactie zijn blokkerend werk: buiten de event loop
+        result = await asyncio.get_running_loop().run_in_executor(None, receive_bulk, messages)
+        return web.json_response(result)
+
+    data = messages[0]
+    if not isinstance(data, dict):
+        metrics.INGEST.inc(outcome="invalid")
+        return web.Response(text="ignored")
+
+    result = process_location(devices, data, store_nowait)
+    if result == QUEUE_FULL:
+        return web.Response(text="busy", status=503,
+                            headers={"Retry-After": str(RETRY_AFTER)})
+    return web.Response(text=result)
+
+
+async def status(request):
+    return web.json_response(writer.status())
+
+
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.render().encode(),
+                        content_type="text/plain; version=0.0.4", charset="utf-8")
+
+
+def warm_up():
+    init_db()
+    try:
+        conn = get_db_connection()
+        print(f"Filterstatus geladen voor {devices.warm(conn)} apparaten")
+        conn.close()
+    except Error as e:
+        print(f"Fout bij laden filterstatus: {e}")
+
+
+async def on_startup(app):
+    # Database-werk bij het opstarten buiten de event loop
+    await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    writer.start()
+
+
+async def on_cleanup(app):
+    # Wachtrij leegschrijven voordat het proces stopt
+    await asyncio.get_running_loop().run_in_executor(None, writer.stop)
+
+
+def make_app():
+    app = web.Application()
+    app.router.add_post("/pub", receive_location)
+    app.router.add_get("/status", status)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Asynchrone OwnTracks ingest")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+    # web.run_app vangt SIGTERM/SIGINT af en draait daarna on_cleanup
+    web.run_app(make_app(), host=args.host, port=args.port)
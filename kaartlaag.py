@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+'''
+Eén canvaslaag voor alle punten in de folium-exports.
+
+Vroeger kreeg elk punt een eigen folium.CircleMarker met popup: zo'n 600
+bytes HTML/JS per punt en één Leaflet-object per punt in de browser. Een
+dag was al 200 KB, meerdere dagen werden tientallen MB die de browser
+nauwelijks opende.
+
+TrackCanvas zet de hele track in één compacte reeks (encoded polyline voor
+de coördinaten, polyline-gecodeerde verschillen voor tijd, nauwkeurigheid
+en snelheid: samen ~6-10 bytes per punt) en tekent lijn en punten op één
+canvas. Per pixel wordt hooguit één punt getekend, dus uitgezoomd kost het
+tekenen niet meer dan het scherm groot is. Popups worden pas bij een klik
+gemaakt, voor het dichtstbijzijnde punt.
+
+Gebruik:
+    m = folium.Map(...)
+    TrackCanvas(locations).add_to(m)     # dicts met lat, lon, timestamp, acc, vel
+'''
+
+import json
+
+from branca.element import Element
+from folium.map import Layer
+from folium.template import Template
+
+from polyline import encode_polyline, encode_values, PRECISION
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+VEL_FACTOR = 10         # snelheid (m/s) met één decimaal als geheel getal
+UNKNOWN = -1            # acc/vel onbekend
+
+# Wordt één keer per HTML-bestand in de header gezet, hoeveel lagen er ook zijn
+TRACK_CANVAS_JS = """
+<script>
+(function () {
+    function decode(text, dims) {
+        var out = [], prev = new Array(dims).fill(0), index = 0;
+        for (var d = 0; d < dims; d++) out.push([]);
+        while (index < text.length) {
+            for (var d = 0; d < dims; d++) {
+                // Rekenen i.p.v. bitoperaties: die zijn 32 bits en tijdstempels groter
+                var factor = 1, result = 0, b;
+                do {
+                    b = text.charCodeAt(index++) - 63;
+                    result += (b & 0x1f) * factor;
+                    factor *= 32;
+                } while (b >= 0x20);
+                prev[d] += (result % 2) ? -(result + 1) / 2 : result / 2;
+                out[d].push(prev[d]);
+            }
+        }
+        return out;
+    }
+
+    window.TrackCanvasLayer = L.Layer.extend({
+        options: { lineColor: 'blue', lineWeight: 4, pointColor: 'red',
+                   pointRadius: 3, line: true, points: true, tolerance: 8 },
+
+        initialize: function (data, options) {
+            L.setOptions(this, options);
+            var factor = Math.pow(10, data.precision), ll = decode(data.p, 2);
+            var n = ll[0].length, crs = L.CRS.EPSG3857;
+            this._n = n;
+            this._lat = new Float64Array(n);
+            this._lon = new Float64Array(n);
+            // Eenmalig projecteren op zoom 0; per zoom alleen nog schalen
+            this._x = new Float64Array(n);
+            this._y = new Float64Array(n);
+            for (var i = 0; i < n; i++) {
+                this._lat[i] = ll[0][i] / factor;
+                this._lon[i] = ll[1][i] / factor;
+                var p = crs.latLngToPoint(L.latLng(this._lat[i], this._lon[i]), 0);
+                this._x[i] = p.x;
+                this._y[i] = p.y;
+            }
+            this._data = data;
+        },
+
+        getBounds: function () {
+            var b = L.latLngBounds([]);
+            for (var i = 0; i < this._n; i++) b.extend([this._lat[i], this._lon[i]]);
+            return b;
+        },
+
+        onAdd: function (map) {
+            this._canvas = L.DomUtil.create('canvas', 'leaflet-zoom-hide');
+            this._canvas.style.pointerEvents = 'none';
+            map.getPanes().overlayPane.appendChild(this._canvas);
+            map.on('moveend resize', this._redraw, this);
+            map.on('click', this._onClick, this);
+            this._redraw();
+        },
+
+        onRemove: function (map) {
+            L.DomUtil.remove(this._canvas);
+            map.off('moveend resize', this._redraw, this);
+            map.off('click', this._onClick, this);
+        },
+
+        _screen: function (i, scale, origin) {
+            return [this._x[i] * scale - origin.x, this._y[i] * scale - origin.y];
+        },
+
+        _redraw: function () {
+            var map = this._map, size = map.getSize(), o = this.options;
+            var canvas = this._canvas, ratio = window.devicePixelRatio || 1;
+            L.DomUtil.setPosition(canvas, map.containerPointToLayerPoint([0, 0]));
+            canvas.width = size.x * ratio;
+            canvas.height = size.y * ratio;
+            canvas.style.width = size.x + 'px';
+            canvas.style.height = size.y + 'px';
+            var ctx = canvas.getContext('2d');
+            ctx.scale(ratio, ratio);
+
+            var scale = map.getZoomScale(map.getZoom(), 0);
+            var origin = map.getPixelBounds().min;
+            var i, p, lx = NaN, ly = NaN;
+
+            if (o.line && this._n > 1) {
+                ctx.strokeStyle = o.lineColor;
+                ctx.lineWidth = o.lineWeight;
+                ctx.globalAlpha = 0.8;
+                ctx.lineJoin = ctx.lineCap = 'round';
+                ctx.beginPath();
+                for (i = 0; i < this._n; i++) {
+                    p = this._screen(i, scale, origin);
+                    // Punten op dezelfde pixel overslaan
+                    if (Math.round(p[0]) === lx && Math.round(p[1]) === ly) continue;
+                    if (i === 0) ctx.moveTo(p[0], p[1]); else ctx.lineTo(p[0], p[1]);
+                    lx = Math.round(p[0]);
+                    ly = Math.round(p[1]);
+                }
+                ctx.stroke();
+            }
+
+            if (o.points) {
+                var cell = Math.max(1, o.pointRadius), cols = Math.ceil(size.x / cell) + 1;
+                var taken = new Uint8Array(cols * (Math.ceil(size.y / cell) + 1));
+                ctx.globalAlpha = 0.9;
+                ctx.fillStyle = o.pointColor;
+                ctx.beginPath();
+                for (i = 0; i < this._n; i++) {
+                    p = this._screen(i, scale, origin);
+                    if (p[0] < 0 || p[1] < 0 || p[0] > size.x || p[1] > size.y) continue;
+                    var k = Math.floor(p[1] / cell) * cols + Math.floor(p[0] / cell);
+                    if (taken[k]) continue;
+                    taken[k] = 1;
+                    ctx.moveTo(p[0] + o.pointRadius, p[1]);
+                    ctx.arc(p[0], p[1], o.pointRadius, 0, 2 * Math.PI);
+                }
+                ctx.fill();
+            }
+        },
+
+        _onClick: function (e) {
+            var map = this._map, o = this.options;
+            var scale = map.getZoomScale(map.getZoom(), 0);
+            var origin = map.getPixelBounds().min;
+            var best = -1, bestD = o.tolerance * o.tolerance;
+            for (var i = 0; i < this._n; i++) {
+                var p = this._screen(i, scale, origin);
+                var dx = p[0] - e.containerPoint.x, dy = p[1] - e.containerPoint.y;
+                if (dx * dx + dy * dy <= bestD) { best = i; bestD = dx * dx + dy * dy; }
+            }
+            if (best < 0) return;
+            L.popup().setLatLng([this._lat[best], this._lon[best]])
+                .setContent(this._popup(best)).openOn(map);
+        },
+
+        _popup: function (i) {
+            // Tijd, acc en snelheid pas bij de eerste klik decoderen
+            var d = this._data;
+            if (!this._ts) {
+                this._ts = decode(d.t, 1)[0];
+                this._acc = decode(d.a, 1)[0];
+                this._vel = decode(d.v, 1)[0];
+            }
+            var when = new Date(this._ts[i] * 1000).toLocaleString('nl-NL', { timeZone: d.tz });
+            var acc = this._acc[i] < 0 ? '?' : this._acc[i];
+            var vel = this._vel[i] < 0 ? '?' : Math.round(this._vel[i] / d.vf * 3.6);
+            return 'Tijd: ' + when + ', Acc: ' + acc + 'm, Snelheid: ' + vel + ' km/h';
+        }
+    });
+})();
+</script>
+"""
+
+
+def track_data(locations, tz="Europe/Amsterdam"):
+    """Compacte reeks voor TrackCanvasLayer uit dicts met lat, lon, timestamp, acc, vel"""
+    def known(value, factor=1):
+        return UNKNOWN if value is None else round(float(value) * factor)
+
+    return {
+        "precision": PRECISION,
+        "p": encode_polyline([(loc["lat"], loc["lon"]) for loc in locations]),
+        "t": encode_values([loc["timestamp"] for loc in locations]),
+        "a": encode_values([known(loc.get("acc")) for loc in locations]),
+        "v": encode_values([known(loc.get("vel"), VEL_FACTOR) for loc in locations]),
+        "vf": VEL_FACTOR,
+        "tz": tz,
+    }
+
+
+def js_json(data):
+    """JSON voor in het folium-script
+
+    branca leest het gerenderde script nog een keer als Jinja-template, en de
+    polyline-tekens lopen tot en met '{', '|' en '}': '{{' of '{%' in de data
+    moet dus geëscaped worden (binnen een JSON-string is dat gewoon geldig).
+    """
+    def value(v):
+        return json.dumps(v).replace("{", "\\u007b").replace("}", "\\u007d")
+
+    return "{" + ", ".join(f"{json.dumps(k)}: {value(v)}" for k, v in data.items()) + "}"
+
+
+class TrackCanvas(Layer):
+    """Lijn en punten van een track als één canvaslaag met popups bij een klik"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new TrackCanvasLayer(
+                {{ this.data_json }},
+                {{ this.options|tojson }}
+            );
+        {% endmacro %}
+    """)
+
+    def __init__(self, locations, name=None, overlay=True, control=False, show=True,
+                 line=True, points=True, line_color="blue", point_color="red"):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "TrackCanvas"
+        self.data_json = js_json(track_data(locations))
+        self.options = {
+            "line": line,
+            "points": points,
+            "lineColor": line_color,
+            "pointColor": point_color,
+        }
+
+    def render(self, **kwargs):
+        self.get_root().header.add_child(Element(TRACK_CANVAS_JS), name="track_canvas_js")
+        super().render(**kwargs)
@@ -1,55 +1,78 @@
 #!/usr/bin/env python3
 
 '''
-Dit script visualiseert de locatiegegevens uit de MariaDB database op een interactieve kaart.
+Dit script visualiseert de locatiegegevens uit de database (MariaDB of SQLite) op een interactieve kaart.
 
 Gebruik:
 1. Zorg ervoor dat de databaseverbinding correct is ingesteld in config.py
 2. Voer het script uit met: python locatie_visualisatie.py
 3. Open de gegenereerde HTML-bestanden in een webbrowser
 
+Zonder argumenten vraagt het script om één datum. Voor een hele periode:
+    python locatie_visualisatie.py --van 2026-01-01 --tot 2026-01-31
+    python locatie_visualisatie.py --van 2025-01-01 --tot 2025-12-31 --per rit --tid xm --uit kaarten
+De punten komen in één bereikquery binnen en worden per dag (of per rit) in
+een procespool gerenderd. Kaarten waarvan de punten niet veranderd zijn
+(zelfde hash in <uit>/hashes.json) worden overgeslagen.
+
 '''
 
 
-import mysql.connector
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import folium
 from datetime import datetime, timedelta
-import pytz
-from config import DB_CONFIG
+import archive
+import storage
+from trips import GAP_THRESHOLD_SECONDS
+from kaartlaag import TrackCanvas
+from storage import Error, day_bounds
+
+# Ophogen als de kaart er anders uit gaat zien: dan worden alle kaarten opnieuw gemaakt
+RENDER_VERSION = 1
+HASH_FILE = "hashes.json"
+ARCHIVE_COLUMNS = ("lat", "lon", "readable_time", "timestamp", "acc", "vel")
 
 def get_db_connection():
-    """Maak verbinding met de MariaDB database"""
-    return mysql.connector.connect(**DB_CONFIG)
+    """Verbinding met de database uit config.py (MariaDB of SQLite)"""
+    return storage.get_connection()
 
 def get_locations_for_date(date_str):
     """Haal locaties op voor een specifieke datum"""
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
-    # Zet de datum om naar de lokale tijdzone
-    local_tz = pytz.timezone('Europe/Amsterdam')
+    # Daggrenzen in de lokale tijdzone, als bereik op de geïndexeerde timestamp
+    start_ts, end_ts = day_bounds(date_str)
     
     try:
         cursor.execute("""
-            SELECT lat, lon, readable_time, acc, vel 
+            SELECT lat, lon, readable_time, timestamp, acc, vel 
             FROM locations 
-            WHERE DATE(readable_time) = %s 
+            WHERE timestamp >= %s AND timestamp < %s 
             ORDER BY timestamp ASC
-        """, (date_str,))
+        """, (start_ts, end_ts))
         
         locations = cursor.fetchall()
         
+        # Gearchiveerde maanden uit het kolomarchief erbij
+        archived = [dict(zip(ARCHIVE_COLUMNS, row))
+                    for row in archive.rows(start_ts, end_ts, columns=ARCHIVE_COLUMNS, by_time=True)]
+        if archived:
+            locations = list(archive.merge(locations, archived, key=lambda loc: loc['timestamp'],
+                                           unique=False))
+        
         # Voeg extra informatie toe aan elk punt
         for loc in locations:
-            # Controleer of readable_time al een datetime object is
-            if isinstance(loc['readable_time'], str):
-                loc['datetime'] = datetime.strptime(loc['readable_time'], '%Y-%m-%d %H:%M:%S')
-            else:
-                loc['datetime'] = loc['readable_time']
+            add_datetime(loc)
         
         return locations
     
-    except mysql.connector.Error as e:
+    except Error as e:
         print(f"Fout bij ophalen locaties: {e}")
         return []
     
@@ -57,6 +80,14 @@ def get_locations_for_date(date_str):
         cursor.close()
         conn.close()
 
+def add_datetime(loc):
+    # Controleer of readable_time al een datetime object is
+    if isinstance(loc['readable_time'], str):
+        loc['datetime'] = datetime.strptime(loc['readable_time'], '%Y-%m-%d %H:%M:%S')
+    else:
+        loc['datetime'] = loc['readable_time']
+    return loc
+
 def create_route_map(locations):
     """Maak een Folium-kaart met de route"""
     if not locations:
@@ -65,9 +96,8 @@ def create_route_map(locations):
     # Maak een kaart gecentreerd op het eerste punt
     m = folium.Map(location=[locations[0]['lat'], locations[0]['lon']], zoom_start=13)
     
-    # Teken de route
-    route_points = [(loc['lat'], loc['lon']) for loc in locations]
-    folium.PolyLine(route_points, color='blue', weight=4, opacity=0.8).add_to(m)
+    # Route en punten als één canvaslaag; popups pas bij een klik (zie kaartlaag.py)
+    TrackCanvas(locations).add_to(m)
     
     # Markeer start- en eindpunt
     folium.Marker(
@@ -82,20 +112,152 @@ def create_route_map(locations):
         icon=folium.Icon(color='red')
     ).add_to(m)
     
-    # Voeg details toe aan elke locatie
-    for loc in locations:
-        folium.CircleMarker(
-            [loc['lat'], loc['lon']],
-            radius=3,
-            popup=f"Tijd: {loc['readable_time']}, Acc: {loc['acc']}m, Snelheid: {loc['vel']} km/h",
-            color='red',
-            fill=True,
-            fillColor='red'
-        ).add_to(m)
-    
     return m
 
+# =====================
+# PERIODE EXPORTEREN
+# =====================
+
+def iter_days(start_day, end_day, tid=None):
+    """(dag, locaties) per dag uit één bereikquery, in tijdsvolgorde"""
+    start_ts, end_ts = day_bounds(start_day)[0], day_bounds(end_day)[1]
+    sql = """
+        SELECT lat, lon, readable_time, timestamp, acc, vel
+        FROM locations
+        WHERE timestamp >= %s AND timestamp < %s
+    """
+    params = [start_ts, end_ts]
+    if tid:
+        sql += " AND tid = %s"
+        params.append(tid)
+    sql += " ORDER BY timestamp ASC"
+
+    # Afgesloten maanden staan (deels) in het kolomarchief (archive.py)
+    archived = (dict(zip(ARCHIVE_COLUMNS, row))
+                for row in archive.rows(start_ts, end_ts, tid, ARCHIVE_COLUMNS, by_time=True))
+
+    conn = get_db_connection()
+    # Ongebufferd: er staat nooit meer dan één dag in het geheugen
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(sql, params)
+        day, locations = None, []
+        for loc in archive.merge(cursor, archived, key=lambda loc: loc['timestamp'], unique=bool(tid)):
+            loc_day = str(loc['readable_time'])[:10]
+            if loc_day != day and locations:
+                yield day, locations
+                locations = []
+            day = loc_day
+            locations.append(add_datetime(loc))
+        if locations:
+            yield day, locations
+    finally:
+        cursor.close()
+        conn.close()
+
+def split_trips(locations, gap=GAP_THRESHOLD_SECONDS):
+    """Splits een dag op tijdgaten, zoals de ritten in trips.py"""
+    trips = [[locations[0]]]
+    for prev, loc in zip(locations, locations[1:]):
+        if loc['timestamp'] - prev['timestamp'] > gap:
+            trips.append([])
+        trips[-1].append(loc)
+    return trips
+
+def content_hash(locations):
+    h = hashlib.sha1(f"v{RENDER_VERSION}".encode())
+    for loc in locations:
+        h.update(f"{loc['timestamp']},{loc['lat']},{loc['lon']},{loc['acc']},{loc['vel']};".encode())
+    return h.hexdigest()
+
+def render_file(path, locations):
+    """Procespool: één kaart bouwen en opslaan"""
+    create_route_map(locations).save(path)
+    return path
+
+def export_range(start_day, end_day, tid=None, per="dag", out_dir=".", workers=None, force=False):
+    os.makedirs(out_dir, exist_ok=True)
+    hash_path = os.path.join(out_dir, HASH_FILE)
+    try:
+        with open(hash_path) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+
+    prefix = f"route_map_{tid}_" if tid else "route_map_"
+    stats = {"dagen": 0, "punten": 0, "geschreven": 0, "overgeslagen": 0}
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for day, locations in iter_days(start_day, end_day, tid):
+            stats["dagen"] += 1
+            stats["punten"] += len(locations)
+            if per == "rit":
+                parts = [(f"{prefix}{day}_rit{i:02d}.html", trip)
+                         for i, trip in enumerate(split_trips(locations), 1)]
+            else:
+                parts = [(f"{prefix}{day}.html", locations)]
+
+            for name, part in parts:
+                path = os.path.join(out_dir, name)
+                digest = content_hash(part)
+                if not force and hashes.get(name) == digest and os.path.exists(path):
+                    stats["overgeslagen"] += 1
+                    continue
+                pending[pool.submit(render_file, path, part)] = (name, digest)
+
+            # Niet meer dagen in de wachtrij dan de pool bijhoudt (geheugen)
+            while len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, pending.pop(future), hashes, stats)
+
+        for future in list(pending):
+            collect(future, pending.pop(future), hashes, stats)
+
+    with open(hash_path, "w") as f:
+        json.dump(hashes, f, indent=0, sort_keys=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n{stats['dagen']} dagen, {stats['punten']} punten in {elapsed:.1f}s")
+    print(f"  kaarten geschreven:   {stats['geschreven']}")
+    print(f"  ongewijzigd (hash):   {stats['overgeslagen']}")
+    if elapsed > 0:
+        print(f"  doorvoer:             {stats['punten'] / elapsed:,.0f} punten/s, "
+              f"{stats['geschreven'] / elapsed:.1f} kaarten/s ({workers} processen)")
+    return stats
+
+def collect(future, item, hashes, stats):
+    name, digest = item
+    try:
+        future.result()
+    except Exception as e:
+        print(f"Fout bij {name}: {e}")
+        return
+    hashes[name] = digest
+    stats["geschreven"] += 1
+
 def main():
+    parser = argparse.ArgumentParser(description="Locaties als HTML-kaart")
+    parser.add_argument("--van", help="eerste dag YYYY-MM-DD (zonder: vraag om één datum)")
+    parser.add_argument("--tot", help="laatste dag YYYY-MM-DD (standaard gelijk aan --van)")
+    parser.add_argument("--tid", help="alleen dit apparaat")
+    parser.add_argument("--per", choices=("dag", "rit"), default="dag", help="één kaart per dag of per rit")
+    parser.add_argument("--uit", default=".", help="map voor de kaarten")
+    parser.add_argument("--processen", type=int, help="aantal processen (standaard: aantal cores)")
+    parser.add_argument("--forceer", action="store_true", help="ook ongewijzigde kaarten opnieuw maken")
+    args = parser.parse_args()
+
+    if args.van:
+        try:
+            export_range(args.van, args.tot or args.van, args.tid, args.per,
+                         args.uit, args.processen, args.forceer)
+        except Error as e:
+            print(f"Fout bij ophalen locaties: {e}")
+        return
+
     # Vraag de gebruiker om een datum
     date_input = input("Geef een datum (YYYY-MM-DD) of druk Enter voor vandaag: ")
     
@@ -122,4 +284,4 @@ def main():
     print(f"Laatste punt: {locations[-1]['readable_time']}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+'''
+Logging voor de ingest en de views: via een wachtrij en gesampled.
+
+Een print() per opgeslagen punt is een write-syscall in de request-thread
+(met PYTHONUNBUFFERED=1 zonder buffer). Hier zet de request-thread alleen
+een LogRecord in een begrensde wachtrij; één achtergrondthread
+(QueueListener) schrijft naar stdout en dus naar de journal. Is de
+wachtrij vol, dan wordt de regel weggegooid en geteld
+(timeline_log_dropped_total) in plaats van te wachten.
+
+Meldingen onder WARNING worden gesampled: van elke melding (zelfde
+formatstring) komt de eerste en daarna één op de LOG_SAMPLE door.
+Waarschuwingen en fouten komen altijd door. Aantallen staan in /metrics,
+dus de log hoeft niet elk punt te tonen.
+
+Gebruik:
+    from log import log
+    log.info("Locatie in wachtrij: %s", readable_time)
+'''
+
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+import config
+import metrics
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+LOG_SAMPLE = int(os.environ.get("TIMELINE_LOG_SAMPLE") or getattr(config, "LOG_SAMPLE", 100))
+LOG_LEVEL = os.environ.get("TIMELINE_LOG_LEVEL") or getattr(config, "LOG_LEVEL", "INFO")
+LOG_QUEUE_MAX = 10000   # regels in de wachtrij voordat er weggegooid wordt
+LOG_FORMAT = "%(levelname)s %(message)s"   # tijd en proces zet de journal er zelf bij
+
+
+class SampleFilter(logging.Filter):
+    """Eerste en daarna één op de `rate` per melding onder WARNING"""
+
+    def __init__(self, rate=LOG_SAMPLE):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate == 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            n = self._counts.get(key, 0)
+            self._counts[key] = n + 1
+        return n % self.rate == 0
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler die nooit blokkeert en na een fork zijn listener opnieuw start"""
+
+    def __init__(self, maxsize=LOG_QUEUE_MAX):
+        super().__init__(queue.Queue(maxsize))
+        self._pid = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # gunicorn importeert de app in de master; de thread bestaat dan niet in de worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                output = logging.StreamHandler(sys.stdout)
+                output.setFormatter(logging.Formatter(LOG_FORMAT))
+                self._listener = QueueListener(self.queue, output)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+    def stop(self):
+        """Wachtrij leegschrijven (bij afsluiten)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+def make_logger(name="timeline", level=LOG_LEVEL, sample=LOG_SAMPLE):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = DroppingQueueHandler()
+        handler.addFilter(SampleFilter(sample))
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        # Niet ook nog via de root-logger (en werkzeug/gunicorn) naar buiten
+        logger.propagate = False
+        atexit.register(handler.stop)
+    return logger
+
+
+log = make_logger()
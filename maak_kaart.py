@@ -3,11 +3,12 @@
 from flask import Flask, request, render_template
 import sqlite3
 import time
-from math import radians, sin, cos, sqrt, atan2
+from geo import distance_m
 from collections import deque
 from datetime import datetime, date, timedelta
 import os
 import folium
+from kaartlaag import TrackCanvas
 
 # =====================
 # CONFIGURATIE
@@ -29,14 +30,6 @@ app = Flask(__name__)
 # HULPFUNCTIES
 # =====================
 
-def distance_m(lat1, lon1, lat2, lon2):
-    R = 6371000
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-    return R * 2 * atan2(sqrt(a), sqrt(1 - a))
-
-
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
@@ -123,16 +116,22 @@ def timeline():
 
     cur = db.cursor()
     cur.execute(
-        "SELECT lat, lon FROM locations WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp",
+        "SELECT lat, lon, acc, timestamp FROM locations WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp",
         (start_ts, end_ts)
     )
-    points = cur.fetchall()
+    points = [
+        {"lat": lat, "lon": lon, "acc": acc, "timestamp": ts}
+        for lat, lon, acc, ts in cur.fetchall()
+    ]
 
     if points:
-        m = folium.Map(location=points[0], zoom_start=13)
-        folium.PolyLine(points, color="blue", weight=4).add_to(m)
-        folium.Marker(points[0], tooltip="Start").add_to(m)
-        folium.Marker(points[-1], tooltip="Einde").add_to(m)
+        first = [points[0]["lat"], points[0]["lon"]]
+        last = [points[-1]["lat"], points[-1]["lon"]]
+        m = folium.Map(location=first, zoom_start=13)
+        # Eén canvaslaag in plaats van een PolyLine met alle coördinaten als JSON
+        TrackCanvas(points, points=False).add_to(m)
+        folium.Marker(first, tooltip="Start").add_to(m)
+        folium.Marker(last, tooltip="Einde").add_to(m)
     else:
         m = folium.Map(location=[52.0, 5.0], zoom_start=7)
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+'''
+Metrieken voor /metrics in het tekstformaat van Prometheus.
+
+Een eigen, kleine registry (tellers, histogrammen en gauges met labels)
+zonder extra afhankelijkheid. Bijwerken is een dict-update onder een lock,
+dus goedkoop genoeg voor de ingest van elk punt.
+
+Met meerdere gunicorn-workers heeft elk proces zijn eigen tellers. Is er
+een gedeeld statusbestand (TIMELINE_SHARED_STATE), dan zet elke worker
+hooguit eens per PUBLISH_INTERVAL zijn stand in shared.MetricSnapshots en
+telt /metrics de standen van alle levende workers op. Een herstarte worker
+begint weer bij nul; Prometheus ziet dat als een reset van de teller.
+'''
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+PUBLISH_INTERVAL = 10   # seconden tussen publicaties naar het gedeelde bestand
+
+# Seconden: van een cache-hit (< 1 ms) tot een dag van 50.000 punten
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+POINT_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+REGISTRY = []
+
+# =====================
+# METRIEKEN
+# =====================
+
+def _key(labelnames, labels):
+    return "\x1f".join(str(labels.get(name, "")) for name in labelnames)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        # Per label-combinatie: [aantal per bucket (niet cumulatief) ..., +Inf, som]
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = _key(self.labelnames, labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[i] += 1
+            values[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(values) for key, values in self._values.items()}
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+
+class Gauge:
+    """Waarde die pas bij het uitlezen wordt opgevraagd (bv. de wachtrijdiepte)"""
+    kind = "gauge"
+    labelnames = ()
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        return {"": self.fn()} if self.fn is not None else {}
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+# Filterketen: één uitkomst per bericht, zie ingest.OUTCOMES
+INGEST = Counter("timeline_ingest_total", "Berichten per uitkomst van de filterketen", ("outcome",))
+REQUEST_SECONDS = Histogram("timeline_request_seconds", "Duur van een request (tot de response klaar is)",
+                            labelnames=("route", "method"))
+DB_CONNECT_SECONDS = Histogram("timeline_db_connect_seconds", "Wachten op een verbinding uit de pool")
+DB_QUERY_SECONDS = Histogram("timeline_db_query_seconds", "Duur van de leesqueries van de views",
+                             labelnames=("query",))
+DB_COMMIT_SECONDS = Histogram("timeline_db_commit_seconds", "Duur van de commit van een batch")
+FLUSH_SECONDS = Histogram("timeline_batch_flush_seconds", "Duur van een hele batch (INSERT, hooks, commit)")
+FLUSHES = Counter("timeline_batch_flushes_total", "Batchpogingen per resultaat (ok, error, dropped)",
+                  ("result",))
+ROWS = Counter("timeline_rows_total", "Rijen per resultaat (stored, dropped)", ("result",))
+DAY_POINTS = Histogram("timeline_day_points", "Punten per dagweergave", POINT_BUCKETS, ("view",))
+CACHE = Counter("timeline_response_cache_total", "Dagweergaven uit de cache of opnieuw gemaakt",
+                ("result",))
+LOG_DROPPED = Counter("timeline_log_dropped_total", "Logregels weggegooid omdat de logwachtrij vol zat")
+QUEUE_DEPTH = Gauge("timeline_queue_depth", "Punten in de schrijfwachtrij")
+
+# =====================
+# UITLEZEN
+# =====================
+
+_shared = None
+_next_publish = 0.0
+
+
+def share(snapshots):
+    """Standen delen via shared.MetricSnapshots (met meerdere workers)"""
+    global _shared
+    _shared = snapshots
+
+
+def snapshot():
+    return {m.name: m.snapshot() for m in REGISTRY}
+
+
+def maybe_publish():
+    """Na een request: hooguit eens per PUBLISH_INTERVAL de stand van dit proces delen"""
+    global _next_publish
+    if _shared is None or time.monotonic() < _next_publish:
+        return
+    _next_publish = time.monotonic() + PUBLISH_INTERVAL
+    _shared.publish(snapshot())
+
+
+def collect():
+    """Stand van alle workers (of alleen dit proces) als {naam: {labels: waarde}}"""
+    if _shared is None:
+        return snapshot()
+    _shared.publish(snapshot())
+    total = {}
+    by_name = {m.name: m for m in REGISTRY}
+    for snap in _shared.collect():
+        for name, values in snap.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            merged = total.setdefault(name, {})
+            for key, value in values.items():
+                merged[key] = metric.merge(merged[key], value) if key in merged else value
+    return total
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key.split("\x1f") if labelnames else ())) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Tekstformaat 0.0.4 voor Prometheus"""
+    values = collect()
+    lines = []
+    for m in REGISTRY:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        for key, value in sorted(values.get(m.name, {}).items()):
+            if m.kind != "histogram":
+                lines.append(f"{m.name}{_labels(m.labelnames, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(m.buckets + ("+Inf",), value[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(float(bound))
+                lines.append(f"{m.name}_bucket{_labels(m.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{m.name}_sum{_labels(m.labelnames, key)} {_number(float(value[-1]))}")
+            lines.append(f"{m.name}_count{_labels(m.labelnames, key)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+'''
+OwnTracks via MQTT, naast HTTP /pub.
+
+Met HTTP is elk punt een eigen request/response vanaf de telefoon. In
+MQTT-modus houdt OwnTracks één verbinding open met een broker (mosquitto);
+dit script is daar een vaste abonnee op owntracks/#. De berichten gaan door
+dezelfde filterketen (ingest.process_location) en dezelfde BatchWriter als
+de Flask-route, dus ook de dagsamenvatting, plekken en cache-invalidatie.
+
+De sessie is persistent (vaste client-id, clean_session=False, QoS 1): is
+dit script even weg, dan bewaart de broker de berichten en komen ze bij het
+opnieuw verbinden alsnog binnen. Een bericht wordt pas bevestigd als het in
+de schrijfwachtrij staat; is die vol, dan wacht de ontvangst (en dus de
+broker) tot er weer plek is.
+
+Draaien Flask en dit script als losse processen, zet dan voor beide
+TIMELINE_SHARED_STATE, anders heeft elk proces zijn eigen filterstatus.
+
+Gebruik:
+    python mqtt_ingest.py --host localhost --port 1883
+'''
+
+import argparse
+import json
+import os
+import signal
+import sys
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+import config
+from storage import Error
+from ingest import process_location
+from timeline import init_db, get_db_connection, devices, writer
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+MQTT_HOST = os.environ.get("TIMELINE_MQTT_HOST") or getattr(config, "MQTT_HOST", "localhost")
+MQTT_PORT = int(os.environ.get("TIMELINE_MQTT_PORT") or getattr(config, "MQTT_PORT", 1883))
+MQTT_USER = getattr(config, "MQTT_USER", None)
+MQTT_PASSWORD = getattr(config, "MQTT_PASSWORD", None)
+MQTT_TOPIC = "owntracks/#"
+MQTT_QOS = 1
+CLIENT_ID = "timeline-ingest"   # vast, anders is de sessie niet terug te vinden
+KEEPALIVE = 60                  # seconden
+
+results = Counter()
+
+
+def store_blocking(row):
+    # Wachten tot er plek is: zolang on_message niet terugkeert gaat er geen
+    # PUBACK naar de broker en houdt die het bericht vast
+    return writer.put(row, timeout=None)
+
+
+def handle_message(topic, payload, retain=False):
+    """Eén MQTT-bericht door de filters; geeft het resultaat zoals /pub"""
+    if retain:
+        # Het bewaarde laatste punt van de telefoon is al eens binnengekomen
+        return "ignored"
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return "ignored"
+    if not isinstance(data, dict):
+        return "ignored"
+    # Via HTTP stuurt OwnTracks het topic mee in het bericht, via MQTT niet
+    data.setdefault("topic", topic)
+    return process_location(devices, data, store_blocking)
+
+
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code.is_failure:
+        print(f"MQTT verbinding geweigerd: {reason_code}")
+        return
+    print(f"MQTT verbonden (sessie {'hervat' if flags.session_present else 'nieuw'})")
+    client.subscribe(MQTT_TOPIC, qos=MQTT_QOS)
+
+
+def on_disconnect(client, userdata, flags, reason_code, properties):
+    print(f"MQTT verbinding verbroken: {reason_code}")
+
+
+def on_message(client, userdata, msg):
+    results[handle_message(msg.topic, msg.payload, msg.retain)] += 1
+
+
+def make_client(client_id=CLIENT_ID, clean_session=False):
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                         clean_session=clean_session, protocol=mqtt.MQTTv311)
+    if MQTT_USER:
+        client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    # Niet te veel onbevestigde berichten tegelijk; de rest wacht bij de broker
+    client.max_inflight_messages_set(100)
+    client.reconnect_delay_set(min_delay=1, max_delay=60)
+    return client
+
+
+def warm_up():
+    init_db()
+    try:
+        conn = get_db_connection()
+        print(f"Filterstatus geladen voor {devices.warm(conn)} apparaten")
+        conn.close()
+    except Error as e:
+        print(f"Fout bij laden filterstatus: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OwnTracks ingest via MQTT")
+    parser.add_argument("--host", default=MQTT_HOST)
+    parser.add_argument("--port", type=int, default=MQTT_PORT)
+    args = parser.parse_args()
+
+    warm_up()
+    writer.start()
+    client = make_client()
+
+    def shutdown(signum, frame):
+        client.disconnect()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    client.connect_async(args.host, args.port, KEEPALIVE)
+    try:
+        # Verbindt zelf (opnieuw) zodra de broker er is, tot disconnect()
+        client.loop_forever(retry_first_connection=True)
+    finally:
+        # Wachtrij leegschrijven voordat het proces stopt
+        writer.stop()
+        print("Resultaten:", dict(results))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
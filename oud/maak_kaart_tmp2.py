@@ -1,6 +1,11 @@
 
+import os
 import sqlite3
+import sys
 import folium
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from kaartlaag import TrackCanvas
 from datetime import datetime
 
 # Instellingen
@@ -52,9 +57,9 @@ def maak_rit_kaart():
         # Maak een groep voor deze rit
         groep = folium.FeatureGroup(name=rit_naam)
         
-        # Teken de lijn
-        coords = [[p[0], p[1]] for p in rit]
-        folium.PolyLine(coords, color="blue", weight=4, opacity=0.6, tooltip=rit_naam).add_to(groep)
+        # Teken de lijn (één canvas per rit, popup met de tijd bij een klik)
+        punten = [{"lat": p[0], "lon": p[1], "timestamp": p[2]} for p in rit]
+        TrackCanvas(punten, points=False).add_to(groep)
         
         # Voeg markers toe voor start en eind van de rit
         folium.Marker([rit[0][0], rit[0][1]], popup=f"START: {start_tijd}", icon=folium.Icon(color='green')).add_to(groep)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+'''
+Maandpartities voor de tabel locations (MariaDB).
+
+locations wordt gepartitioneerd met RANGE op timestamp, één partitie per
+kalendermaand in Europe/Amsterdam plus een vangnet pmax. Omdat de grenzen
+op lokale middernacht liggen, raakt een dagquery (timestamp >= start AND
+timestamp < eind) precies één partitie; MariaDB snoeit de rest zelf weg. Dat
+geldt ook voor locatie_visualisatie, summary.rebuild_day en trips.stream_points,
+die allemaal op een timestamp-bereik filteren.
+
+MariaDB eist dat elke unieke sleutel de partitiekolom bevat: de primaire
+sleutel wordt daarom (id, timestamp); uniq_tid_timestamp voldoet al.
+
+Komende maanden worden vooraf aangemaakt door pmax te splitsen (REORGANIZE),
+bij het opstarten en daarna hooguit eens per CHECK_INTERVAL vanuit de
+BatchWriter. Oude maanden weggooien is een DROP PARTITION in plaats van een
+grote DELETE; daily_summary en trips blijven daarbij gewoon staan.
+
+Gebruik:
+    python partitions.py                      # overzicht, komende maanden aanmaken
+    python partitions.py --partitioneer       # bestaande tabel eenmalig omzetten
+    python partitions.py --verwijder-voor 2023-01
+    python partitions.py --archiveer-voor 2023-01   # maand wordt een losse tabel
+    python partitions.py --uitleg 2026-03-01  # welke partities een dagquery leest
+
+Met de SQLite-backend is er geen partitionering: de dagquery gebruikt daar
+de index op timestamp en --verwijder-voor wordt een DELETE op dat bereik.
+'''
+
+import argparse
+import time
+from datetime import datetime
+
+import storage
+from log import log
+from storage import Error, local_tz, day_bounds
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+AHEAD_MONTHS = 3            # zoveel maanden na de huidige vooraf aanmaken
+CHECK_INTERVAL = 6 * 3600   # seconden tussen controles vanuit de BatchWriter
+CATCH_ALL = "pmax"
+
+# =====================
+# MAANDEN
+# =====================
+
+def month_start(year, month):
+    """Epoch-seconden van middernacht (lokale tijd) op de eerste van de maand"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return int(local_tz.localize(datetime(year, month, 1)).timestamp())
+
+
+def month_of(ts):
+    dt = datetime.fromtimestamp(ts, local_tz)
+    return dt.year, dt.month
+
+
+def add_months(year, month, n):
+    index = year * 12 + (month - 1) + n
+    return index // 12, index % 12 + 1
+
+
+def partition_name(year, month):
+    return f"p{year:04d}{month:02d}"
+
+
+def partition_def(year, month):
+    """Partitie voor één maand: alles vóór het begin van de volgende maand"""
+    upper = month_start(*add_months(year, month, 1))
+    return f"PARTITION {partition_name(year, month)} VALUES LESS THAN ({upper})"
+
+
+def parse_month(value):
+    year, month = map(int, value.split("-"))
+    return year, month
+
+# =====================
+# SCHEMA
+# =====================
+
+def list_partitions(cur):
+    """[(naam, bovengrens of None voor MAXVALUE, geschat aantal rijen)] in volgorde"""
+    cur.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'locations'
+          AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    return [
+        (name, None if upper == "MAXVALUE" else int(upper), rows)
+        for name, upper, rows in cur.fetchall()
+    ]
+
+
+def partition_table(cur, ahead=AHEAD_MONTHS):
+    """Zet locations om naar maandpartities (kopieert de tabel één keer)"""
+    # Rijen zonder timestamp kunnen niet in de primaire sleutel
+    cur.execute("""
+        UPDATE locations SET timestamp = UNIX_TIMESTAMP(readable_time)
+        WHERE timestamp IS NULL AND readable_time IS NOT NULL
+    """)
+    cur.execute("DELETE FROM locations WHERE timestamp IS NULL")
+
+    cur.execute("SELECT MIN(timestamp) FROM locations")
+    oldest = cur.fetchone()[0]
+    first = month_of(oldest if oldest is not None else time.time())
+    last = add_months(*month_of(time.time()), ahead)
+
+    defs = []
+    month = first
+    while month <= last:
+        defs.append(partition_def(*month))
+        month = add_months(*month, 1)
+    defs.append(f"PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE")
+
+    print(f"locations partitioneren: {partition_name(*first)} t/m {partition_name(*last)}...")
+    cur.execute("ALTER TABLE locations DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)")
+    cur.execute(
+        "ALTER TABLE locations PARTITION BY RANGE (timestamp) (\n    "
+        + ",\n    ".join(defs) + "\n)"
+    )
+
+
+def ensure_partitions(cur, ahead=AHEAD_MONTHS):
+    """Maak ontbrekende maanden tot en met `ahead` maanden vooruit aan
+
+    Geeft het aantal nieuwe partities terug.
+    """
+    parts = list_partitions(cur)
+    months = [p for p in parts if p[0] != CATCH_ALL]
+    if not months:
+        return 0
+    # Bovengrens van de laatste maandpartitie is het begin van de maand erna
+    start = month_of(months[-1][1])
+    last = add_months(*month_of(time.time()), ahead)
+
+    defs = []
+    month = start
+    while month <= last:
+        defs.append(partition_def(*month))
+        month = add_months(*month, 1)
+    if not defs:
+        return 0
+
+    cur.execute(
+        f"ALTER TABLE locations REORGANIZE PARTITION {CATCH_ALL} INTO (\n    "
+        + ",\n    ".join(defs)
+        + f",\n    PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE\n)"
+    )
+    return len(defs)
+
+
+def ensure(cur):
+    """Bij het opstarten: partities bijwerken of een nieuwe, lege tabel omzetten"""
+    if storage.BACKEND != "mariadb":
+        return
+    if list_partitions(cur):
+        added = ensure_partitions(cur)
+        if added:
+            log.info("%d nieuwe maandpartitie(s) aangemaakt", added)
+        return
+    cur.execute("SELECT 1 FROM locations LIMIT 1")
+    if cur.fetchone() is None:
+        partition_table(cur)
+    else:
+        print("locations is nog niet gepartitioneerd: python partitions.py --partitioneer")
+
+
+_next_check = 0.0
+
+
+def maybe_extend(batch):
+    """after_commit-hook voor de BatchWriter: af en toe komende maanden aanmaken"""
+    global _next_check
+    if storage.BACKEND != "mariadb" or time.monotonic() < _next_check:
+        return
+    _next_check = time.monotonic() + CHECK_INTERVAL
+    try:
+        conn = storage.get_connection()
+        cur = conn.cursor()
+        if list_partitions(cur):
+            added = ensure_partitions(cur)
+            if added:
+                log.info("%d nieuwe maandpartitie(s) aangemaakt", added)
+        cur.close()
+        conn.close()
+    except Error as e:
+        # Geen ramp: nieuwe punten komen dan tijdelijk in pmax terecht
+        log.error("Fout bij aanmaken partities: %s", e)
+
+# =====================
+# BEWAREN EN OPRUIMEN
+# =====================
+
+def partitions_before(cur, year, month):
+    """Maandpartities die helemaal vóór de gegeven maand liggen"""
+    cutoff = month_start(year, month)
+    return [
+        name for name, upper, _ in list_partitions(cur)
+        if name != CATCH_ALL and upper is not None and upper <= cutoff
+    ]
+
+
+def drop_before(cur, year, month):
+    """Verwijder alle punten vóór de gegeven maand; geeft de verwijderde partities terug"""
+    if storage.BACKEND != "mariadb":
+        cur.execute("DELETE FROM locations WHERE timestamp < %s", (month_start(year, month),))
+        print(f"{cur.rowcount} punten verwijderd")
+        return []
+    names = partitions_before(cur, year, month)
+    if names:
+        cur.execute(f"ALTER TABLE locations DROP PARTITION {', '.join(names)}")
+    return names
+
+
+def archive_before(cur, year, month):
+    """Maak van elke maand vóór de gegeven maand een losse tabel locations_pYYYYMM
+
+    Gebruikt CONVERT PARTITION (MariaDB 10.7+); de tabel kan daarna los
+    worden weggeschreven (mysqldump) en verwijderd.
+    """
+    names = partitions_before(cur, year, month)
+    for name in names:
+        cur.execute(f"ALTER TABLE locations CONVERT PARTITION {name} TO TABLE locations_{name}")
+    return names
+
+
+def explain_day(cur, day_str):
+    """Partities die de dagquery van de timeline leest"""
+    cur.execute(
+        "EXPLAIN PARTITIONS SELECT lat, lon FROM locations"
+        " WHERE timestamp >= %s AND timestamp < %s ORDER BY timestamp",
+        day_bounds(day_str),
+    )
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maandpartities van locations beheren")
+    parser.add_argument("--partitioneer", action="store_true",
+                        help="bestaande tabel eenmalig omzetten (kopieert de hele tabel)")
+    parser.add_argument("--verwijder-voor", metavar="YYYY-MM",
+                        help="alle punten vóór deze maand weggooien")
+    parser.add_argument("--archiveer-voor", metavar="YYYY-MM",
+                        help="maanden vóór deze maand loskoppelen als eigen tabel")
+    parser.add_argument("--uitleg", metavar="YYYY-MM-DD",
+                        help="toon welke partities de dagquery leest")
+    args = parser.parse_args()
+
+    conn = storage.get_connection()
+    cur = conn.cursor()
+    try:
+        if storage.BACKEND != "mariadb":
+            if args.verwijder_voor:
+                drop_before(cur, *parse_month(args.verwijder_voor))
+            else:
+                print("SQLite-backend: geen partities (dagquery's gebruiken idx_timestamp)")
+            return
+        if args.partitioneer and not list_partitions(cur):
+            partition_table(cur)
+        if args.verwijder_voor:
+            names = drop_before(cur, *parse_month(args.verwijder_voor))
+            if names:
+                print(f"Verwijderd: {', '.join(names)}")
+        if args.archiveer_voor:
+            for name in archive_before(cur, *parse_month(args.archiveer_voor)):
+                print(f"Losgekoppeld: {name} -> locations_{name}")
+        if args.uitleg:
+            for row in explain_day(cur, args.uitleg):
+                print(f"partities: {row.get('partitions')}  rijen: {row.get('rows')}")
+
+        parts = list_partitions(cur)
+        if not parts:
+            print("locations is niet gepartitioneerd (gebruik --partitioneer)")
+            return
+        added = ensure_partitions(cur)
+        if added:
+            print(f"{added} nieuwe maandpartitie(s) aangemaakt")
+            parts = list_partitions(cur)
+        for name, upper, rows in parts:
+            until = datetime.fromtimestamp(upper, local_tz).strftime('%Y-%m-%d') if upper else "MAXVALUE"
+            print(f"{name:<10} < {until:<10} ~{rows} rijen")
+    except Error as e:
+        print(f"Fout bij partitiebeheer: {e}")
+    finally:
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+
+'''
+Verblijfplekken (places) en bezoeken (visits) uit de punten.
+
+De stilstandfilter in de ingest gooit punten weg zodra je ergens langer dan
+STATIONARY_TIME binnen STATIONARY_RADIUS staat, maar onthoudt niet wáár.
+Deze module doet dat wel, in twee stappen:
+
+  1. Verblijfpunten (stay points): zolang de punten binnen STAY_RADIUS van
+     het eerste punt van het venster blijven en dat minstens STAY_MIN_TIME
+     duurt, is het een verblijf. Een tijdgat telt gewoon mee: door de
+     stilstandfilter komt er tijdens een verblijf vaak urenlang niets binnen.
+  2. Plekken: verblijven binnen PLACE_RADIUS van elkaar horen bij dezelfde
+     plek. Bij het opnieuw opbouwen met DBSCAN over alle verblijven (met een
+     raster van PLACE_RADIUS als buurtindex); daarna per nieuw verblijf de
+     dichtstbijzijnde bestaande plek, of een nieuwe.
+
+De BatchWriter roept update_batch() aan na elke commit. Per apparaat wordt
+alleen gelezen vanaf het watermerk: het begin van het nog open venster.
+De timelinepagina leest daarna alleen visits en places.
+
+Gebruik:
+    python places.py --opnieuw          # alles opnieuw opbouwen (DBSCAN)
+    python places.py --lijst            # plekken met aantal bezoeken
+    python places.py --noem 12 Thuis    # plek 12 een naam geven
+'''
+
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from math import cos, radians
+
+import numpy as np
+
+import archive
+import storage
+from config import STATIONARY_RADIUS, STATIONARY_TIME
+from geo import distance_m
+from log import log
+from spatial import cell_of, COLS
+from storage import COL, Error, local_tz, day_bounds
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+STAY_RADIUS = STATIONARY_RADIUS     # meter – zo ver mag je afdwalen tijdens een verblijf
+STAY_MIN_TIME = STATIONARY_TIME     # seconden – zo lang binnen de straal = verblijf
+PLACE_RADIUS = 75                   # meter – verblijven dichterbij zijn dezelfde plek
+MIN_SAMPLES = 2                     # DBSCAN: verblijven voor een kern
+MAX_VISIT_DAYS = 3                  # langste bezoek waar een dagquery naar terugkijkt
+ARCHIVE_END = 2 ** 62               # bovengrens voor archive.rows: alles na het watermerk
+
+
+def create_tables(cur):
+    if storage.BACKEND == "sqlite":
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS places (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                cell INTEGER NOT NULL,
+                visit_count INTEGER NOT NULL DEFAULT 0,
+                total_s INTEGER NOT NULL DEFAULT 0,
+                name TEXT
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_places_cell ON places (cell)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS visits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tid TEXT NOT NULL DEFAULT '',
+                place_id INTEGER NOT NULL,
+                start_ts INTEGER NOT NULL,
+                end_ts INTEGER NOT NULL,
+                lat REAL,
+                lon REAL,
+                point_count INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (tid, start_ts)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_visits_time ON visits (start_ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_visits_place ON visits (place_id)")
+    else:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS places (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                lat DOUBLE NOT NULL,
+                lon DOUBLE NOT NULL,
+                cell BIGINT NOT NULL,
+                visit_count INT NOT NULL DEFAULT 0,
+                total_s BIGINT NOT NULL DEFAULT 0,
+                name VARCHAR(100),
+                INDEX idx_places_cell (cell)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS visits (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                tid VARCHAR(10) NOT NULL DEFAULT '',
+                place_id INT NOT NULL,
+                start_ts BIGINT NOT NULL,
+                end_ts BIGINT NOT NULL,
+                lat DOUBLE,
+                lon DOUBLE,
+                point_count INT NOT NULL DEFAULT 0,
+                UNIQUE KEY uniq_visit (tid, start_ts),
+                INDEX idx_visits_time (start_ts),
+                INDEX idx_visits_place (place_id)
+            )
+        """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS place_watermark (
+            tid VARCHAR(10) NOT NULL PRIMARY KEY,
+            last_ts BIGINT NOT NULL
+        )
+    """)
+
+# =====================
+# VERBLIJFPUNTEN
+# =====================
+
+class Stay:
+    __slots__ = ("start_ts", "end_ts", "lat", "lon", "point_count")
+
+    def __init__(self, points, end_ts=None):
+        self.start_ts = points[0][2]
+        self.end_ts = points[-1][2] if end_ts is None else end_ts
+        self.lat = sum(p[0] for p in points) / len(points)
+        self.lon = sum(p[1] for p in points) / len(points)
+        self.point_count = len(points)
+
+    @property
+    def duration(self):
+        return self.end_ts - self.start_ts
+
+
+class StayDetector:
+    """Vindt verblijven in een stroom (lat, lon, ts) punten in tijdsvolgorde
+
+    feed() geeft een Stay zodra een verblijf is afgelopen (het eerste punt
+    buiten de straal); window bevat het nog open stuk. Het verblijf loopt
+    tot dat eerste punt buiten de straal: tijdens stilstand gooit de ingest
+    bijna alle punten weg, dus het laatste punt binnen de straal is vaak
+    nog van vlak na aankomst.
+    """
+
+    def __init__(self, radius=STAY_RADIUS, min_time=STAY_MIN_TIME):
+        self.radius = radius
+        self.min_time = min_time
+        self.window = []
+
+    def feed(self, point):
+        window = self.window
+        anchor = window[0] if window else None
+        if anchor is None or distance_m(anchor[0], anchor[1], point[0], point[1]) <= self.radius:
+            window.append(point)
+            return None
+
+        # Het tijdgat tot het vertrek telt mee (zie de docstring van de module)
+        if point[2] - anchor[2] >= self.min_time:
+            stay = Stay(window, end_ts=point[2])
+            self.window = [point]
+            return stay
+
+        # Geen verblijf: anker opschuiven tot het nieuwe punt weer binnen de straal valt
+        while window and distance_m(window[0][0], window[0][1], point[0], point[1]) > self.radius:
+            window.pop(0)
+        window.append(point)
+        return None
+
+# =====================
+# PLEKKEN
+# =====================
+
+def neighbour_cells(lat, lon):
+    # Een vak is veel groter dan PLACE_RADIUS, dus 3x3 vakken is ruim genoeg
+    cell = cell_of(lat, lon)
+    return [cell + dr * COLS + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+
+def nearest_place(cur, lat, lon, radius=PLACE_RADIUS):
+    cells = neighbour_cells(lat, lon)
+    cur.execute(
+        "SELECT id, lat, lon, visit_count FROM places WHERE cell IN ({})".format(
+            ", ".join(["%s"] * len(cells))),
+        cells,
+    )
+    best = None
+    for pid, plat, plon, count in cur.fetchall():
+        d = distance_m(lat, lon, plat, plon)
+        if d <= radius and (best is None or d < best[0]):
+            best = (d, pid, plat, plon, count)
+    return best
+
+
+def assign_place(cur, stay):
+    """Koppel een verblijf aan de dichtstbijzijnde plek, of maak een nieuwe"""
+    best = nearest_place(cur, stay.lat, stay.lon)
+    if best is None:
+        cur.execute("""
+            INSERT INTO places (lat, lon, cell, visit_count, total_s)
+            VALUES (%s, %s, %s, 1, %s)
+        """, (stay.lat, stay.lon, cell_of(stay.lat, stay.lon), stay.duration))
+        return cur.lastrowid
+
+    _, pid, plat, plon, count = best
+    # Middelpunt schuift mee als lopend gemiddelde over de bezoeken
+    lat = (plat * count + stay.lat) / (count + 1)
+    lon = (plon * count + stay.lon) / (count + 1)
+    cur.execute("""
+        UPDATE places SET lat = %s, lon = %s, cell = %s,
+               visit_count = visit_count + 1, total_s = total_s + %s
+        WHERE id = %s
+    """, (lat, lon, cell_of(lat, lon), stay.duration, pid))
+    return pid
+
+
+INSERT_VISIT_SQL = """
+    INSERT INTO visits (tid, place_id, start_ts, end_ts, lat, lon, point_count)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE place_id = VALUES(place_id), end_ts = VALUES(end_ts),
+        lat = VALUES(lat), lon = VALUES(lon), point_count = VALUES(point_count)
+"""
+
+
+def dbscan(lats, lons, eps=PLACE_RADIUS, min_samples=MIN_SAMPLES):
+    """Clusterlabels per punt; buren via een raster met vakken van eps meter
+
+    Ruis (geen kern in de buurt) krijgt elk een eigen label, want ook een
+    eenmalig verblijf is een plek.
+    """
+    n = len(lats)
+    lat0 = radians(float(np.mean(lats))) if n else 0.0
+    x = np.radians(np.asarray(lons, dtype=float)) * 6371000 * cos(lat0)
+    y = np.radians(np.asarray(lats, dtype=float)) * 6371000
+    grid = defaultdict(list)
+    keys = [(int(a // eps), int(b // eps)) for a, b in zip(x, y)]
+    for i, key in enumerate(keys):
+        grid[key].append(i)
+
+    def neighbours(i):
+        gx, gy = keys[i]
+        found = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in grid.get((gx + dx, gy + dy), ()):
+                    if (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 <= eps * eps:
+                        found.append(j)
+        return found
+
+    labels = [None] * n
+    label = 0
+    for i in range(n):
+        if labels[i] is not None:
+            continue
+        near = neighbours(i)
+        if len(near) < min_samples:
+            labels[i] = -1
+            continue
+        labels[i] = label
+        queue = list(near)
+        while queue:
+            j = queue.pop()
+            if labels[j] == -1:
+                labels[j] = label       # randpunt
+            if labels[j] is not None:
+                continue
+            labels[j] = label
+            near_j = neighbours(j)
+            if len(near_j) >= min_samples:
+                queue.extend(near_j)
+        label += 1
+
+    for i in range(n):
+        if labels[i] == -1:
+            labels[i] = label
+            label += 1
+    return labels
+
+# =====================
+# BIJWERKEN
+# =====================
+
+def read_points(cur, tid, after_ts):
+    """Punten na after_ts in tijdsvolgorde, ook die in het kolomarchief"""
+    if tid:
+        cur.execute("""
+            SELECT lat, lon, timestamp FROM locations
+            WHERE tid = %s AND timestamp > %s ORDER BY timestamp ASC
+        """, (tid, after_ts))
+    else:
+        cur.execute("""
+            SELECT lat, lon, timestamp FROM locations
+            WHERE (tid IS NULL OR tid = '') AND timestamp > %s ORDER BY timestamp ASC
+        """, (after_ts,))
+    archived = archive.rows(after_ts + 1, ARCHIVE_END, tid, ("lat", "lon", "timestamp"))
+    return list(archive.merge(cur.fetchall(), archived, key=lambda row: row[2]))
+
+
+def watermark_after(detector, last_ts):
+    # Alles vóór het open venster kan niet meer bij een verblijf horen
+    return detector.window[0][2] - 1 if detector.window else last_ts
+
+
+def process_device(conn, tid):
+    """Nieuwe verblijven van één apparaat; geeft de geraakte (dag, tid) terug"""
+    cur = conn.cursor()
+    # Eerst een schrijfactie op de rij: die vergrendelt het apparaat (MariaDB:
+    # rijlock, SQLite: de schrijflock), zodat twee workers niet tegelijk rekenen
+    cur.execute("""
+        INSERT INTO place_watermark (tid, last_ts) VALUES (%s, -1)
+        ON DUPLICATE KEY UPDATE tid = tid
+    """, (tid,))
+    cur.execute("SELECT last_ts FROM place_watermark WHERE tid = %s FOR UPDATE", (tid,))
+    last_ts = cur.fetchone()[0]
+
+    detector = StayDetector()
+    changed = set()
+    for point in read_points(cur, tid, last_ts):
+        stay = detector.feed(point)
+        last_ts = point[2]
+        if stay is None:
+            continue
+        place_id = assign_place(cur, stay)
+        cur.execute(INSERT_VISIT_SQL, (tid, place_id, stay.start_ts, stay.end_ts,
+                                       stay.lat, stay.lon, stay.point_count))
+        for ts in (stay.start_ts, stay.end_ts):
+            changed.add((datetime.fromtimestamp(ts, local_tz).strftime('%Y-%m-%d'), tid or None))
+
+    cur.execute("UPDATE place_watermark SET last_ts = %s WHERE tid = %s",
+                (watermark_after(detector, last_ts), tid))
+    conn.commit()
+    cur.close()
+    return changed
+
+
+def update_batch(batch):
+    """after_commit-hook voor de BatchWriter; geeft de (dag, tid) met nieuwe bezoeken"""
+    changed = set()
+    try:
+        conn = storage.get_connection()
+        try:
+            for tid in {row[COL["tid"]] or "" for row in batch}:
+                changed |= process_device(conn, tid)
+        finally:
+            conn.close()
+    except Error as e:
+        # Niet erg: de volgende batch begint weer bij het watermerk
+        log.error("Fout bij bijwerken plekken: %s", e)
+    return changed
+
+
+def rebuild():
+    """Alle verblijven opnieuw zoeken en met DBSCAN tot plekken clusteren"""
+    conn = storage.get_connection()
+    cur = conn.cursor()
+    create_tables(cur)
+    # Namen bewaren we op locatie, zodat 'Thuis' na het opnieuw opbouwen blijft
+    cur.execute("SELECT lat, lon, name FROM places WHERE name IS NOT NULL")
+    names = cur.fetchall()
+    cur.execute("DELETE FROM visits")
+    cur.execute("DELETE FROM places")
+    cur.execute("DELETE FROM place_watermark")
+
+    cur.execute("SELECT DISTINCT COALESCE(tid, '') FROM locations")
+    # Ook apparaten die alleen nog in het archief staan
+    devices = sorted({r[0] for r in cur.fetchall()} | set(archive.devices()))
+
+    stays, watermarks = [], {}
+    for tid in devices:
+        detector = StayDetector()
+        last_ts = -1
+        for point in read_points(cur, tid, -1):
+            stay = detector.feed(point)
+            last_ts = point[2]
+            if stay is not None:
+                stays.append((tid, stay))
+        watermarks[tid] = watermark_after(detector, last_ts)
+        print(f"Apparaat '{tid or '-'}': {sum(1 for t, _ in stays if t == tid)} verblijven")
+
+    labels = dbscan([s.lat for _, s in stays], [s.lon for _, s in stays])
+    clusters = defaultdict(list)
+    for (tid, stay), label in zip(stays, labels):
+        clusters[label].append((tid, stay))
+
+    for members in clusters.values():
+        lat = sum(s.lat for _, s in members) / len(members)
+        lon = sum(s.lon for _, s in members) / len(members)
+        name = next((n for nlat, nlon, n in names
+                     if distance_m(lat, lon, nlat, nlon) <= PLACE_RADIUS), None)
+        cur.execute("""
+            INSERT INTO places (lat, lon, cell, visit_count, total_s, name)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (lat, lon, cell_of(lat, lon), len(members),
+              sum(s.duration for _, s in members), name))
+        place_id = cur.lastrowid
+        cur.executemany(INSERT_VISIT_SQL, [
+            (tid, place_id, s.start_ts, s.end_ts, s.lat, s.lon, s.point_count)
+            for tid, s in members
+        ])
+
+    for tid, ts in watermarks.items():
+        cur.execute("INSERT INTO place_watermark (tid, last_ts) VALUES (%s, %s)", (tid, ts))
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"✅ {len(clusters)} plekken, {len(stays)} bezoeken")
+
+# =====================
+# LEZEN
+# =====================
+
+def fetch_day_visits(conn, day_str, tid=None):
+    """Bezoeken die (deels) op deze dag vallen, met plek en tijden"""
+    start_ts, end_ts = day_bounds(day_str)
+    sql = """
+        SELECT v.tid, v.place_id, v.start_ts, v.end_ts, p.lat, p.lon, p.name, p.visit_count
+        FROM visits v JOIN places p ON p.id = v.place_id
+        WHERE v.start_ts >= %s AND v.start_ts < %s AND v.end_ts >= %s
+    """
+    params = [start_ts - MAX_VISIT_DAYS * 86400, end_ts, start_ts]
+    if tid:
+        sql += " AND v.tid = %s"
+        params.append(tid)
+    sql += " ORDER BY v.start_ts"
+    cur = conn.cursor(dictionary=True)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+
+    def clock(ts):
+        return datetime.fromtimestamp(ts, local_tz).strftime('%H:%M')
+
+    return [
+        {
+            "plek": r["place_id"],
+            "naam": r["name"] or f"Plek {r['place_id']}",
+            "lat": r["lat"],
+            "lon": r["lon"],
+            # Buiten deze dag afkappen op middernacht
+            "van": clock(r["start_ts"]) if r["start_ts"] >= start_ts else "00:00",
+            "tot": clock(r["end_ts"]) if r["end_ts"] < end_ts else "24:00",
+            "minuten": (min(r["end_ts"], end_ts) - max(r["start_ts"], start_ts)) // 60,
+            "bezoeken": r["visit_count"],
+        }
+        for r in rows
+    ]
+
+
+def list_places(conn, limit=50):
+    cur = conn.cursor(dictionary=True)
+    cur.execute("""
+        SELECT id, lat, lon, name, visit_count, total_s FROM places
+        ORDER BY total_s DESC LIMIT %s
+    """, (limit,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verblijfplekken en bezoeken")
+    parser.add_argument("--opnieuw", action="store_true",
+                        help="alle plekken en bezoeken opnieuw opbouwen (DBSCAN)")
+    parser.add_argument("--lijst", action="store_true", help="plekken met de meeste tijd")
+    parser.add_argument("--noem", nargs=2, metavar=("ID", "NAAM"), help="geef een plek een naam")
+    args = parser.parse_args()
+
+    try:
+        if args.opnieuw:
+            rebuild()
+        if args.noem:
+            conn = storage.get_connection()
+            cur = conn.cursor()
+            cur.execute("UPDATE places SET name = %s WHERE id = %s", (args.noem[1], int(args.noem[0])))
+            conn.commit()
+            cur.close()
+            conn.close()
+        if args.lijst or not (args.opnieuw or args.noem):
+            conn = storage.get_connection()
+            for p in list_places(conn):
+                print(f"{p['id']:>5}  {p['name'] or '-':<20} {p['lat']:.5f},{p['lon']:.5f}  "
+                      f"{p['visit_count']:>4} bezoeken  {p['total_s'] / 3600:>7.1f} uur")
+            conn.close()
+    except Error as e:
+        print(f"Fout bij plekken: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+'''
+Compacte codering van tracks voor de API.
+
+Coördinaten gaan als Google encoded polyline (standaard 6 decimalen),
+tijden en snelheden als lijsten van verschillen tussen opeenvolgende
+gehele getallen. Beide zijn veel kleiner dan een dict per punt.
+'''
+
+PRECISION = 6
+
+
+def _encode_value(value, out):
+    # Zigzag: teken in het laagste bit, daarna 5-bits blokken met vervolgbit
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(coords, precision=PRECISION):
+    """[(lat, lon), ...] -> encoded polyline string"""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in coords:
+        ilat, ilon = int(round(lat * factor)), int(round(lon * factor))
+        _encode_value(ilat - prev_lat, out)
+        _encode_value(ilon - prev_lon, out)
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def encode_values(values):
+    """[a, b, c] (gehele getallen) -> polyline-tekens van de verschillen
+
+    Zelfde codering als één coördinaat van een encoded polyline; voor
+    tijden en nauwkeurigheden 1-2 tekens per punt.
+    """
+    out = []
+    prev = 0
+    for v in values:
+        v = int(round(v or 0))
+        _encode_value(v - prev, out)
+        prev = v
+    return "".join(out)
+
+
+def decode_polyline(text, precision=PRECISION):
+    """Encoded polyline string -> [(lat, lon), ...]"""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lon = 0
+    while index < len(text):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append((lat / factor, lon / factor))
+    return coords
+
+
+def decode_values(text):
+    """Omgekeerde van encode_values()"""
+    values = []
+    index = total = 0
+    while index < len(text):
+        shift = result = 0
+        while True:
+            b = ord(text[index]) - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        total += ~(result >> 1) if result & 1 else result >> 1
+        values.append(total)
+    return values
+
+
+def delta_encode(values):
+    """[a, b, c] -> [a, b-a, c-b] (gehele getallen)"""
+    out = []
+    prev = 0
+    for v in values:
+        v = int(round(v or 0))
+        out.append(v - prev)
+        prev = v
+    return out
+
+
+def delta_decode(deltas):
+    out = []
+    total = 0
+    for d in deltas:
+        total += d
+        out.append(total)
+    return out
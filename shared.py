@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+'''
+Gedeelde status voor meerdere workers (gunicorn) via een SQLite/WAL-bestand.
+
+Met meerdere processen kan de filterstatus per apparaat niet meer in het
+geheugen van één proces staan: twee opeenvolgende berichten van dezelfde
+telefoon kunnen bij verschillende workers uitkomen. Dit bestand houdt
+daarom bij:
+  - device_state: laatst opgeslagen punten en smoothing-buffer per apparaat
+  - cache_generation: versienummer per (dag, tid) voor de responsecache
+  - metric_snapshot: stand van de metrieken per worker (zie metrics.py)
+
+SharedDeviceRegistry heeft dezelfde vorm als ingest.DeviceRegistry: de lock
+van een status is hier een lock per apparaat (DeviceLocks: een byte in een
+lockbestand, plus een threading.Lock binnen het proces), die de rij bij het
+binnengaan leest en bij het verlaten terugschrijft. De schrijflock van
+SQLite wordt alleen voor dat ene INSERT vastgehouden, niet tijdens de
+filters en het in de wachtrij zetten; apparaten wachten dus niet op elkaar.
+process_location() werkt ongewijzigd en gedraagt zich hetzelfde als met
+één proces.
+'''
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+
+from ingest import SMOOTH_WINDOW, IDLE_TIMEOUT, latest_points
+
+EVICT_EVERY = 1000      # na zoveel get()-aanroepen oude apparaten opruimen
+LOCK_SLOTS = 256        # locks per apparaat; apparaten met dezelfde slot wachten op elkaar
+
+
+class SidecarDB:
+    """Eén SQLite-verbinding per thread op het gedeelde bestand"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        conn = self.connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS device_state (
+                key TEXT PRIMARY KEY,
+                last_lat REAL,
+                last_lon REAL,
+                last_ts INTEGER,
+                last_points TEXT,
+                prev_point TEXT,
+                pending_row TEXT,
+                updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS cache_generation (
+                day TEXT,
+                tid TEXT,
+                gen INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, tid)
+            );
+            CREATE TABLE IF NOT EXISTS metric_snapshot (
+                pid INTEGER PRIMARY KEY,
+                data TEXT,
+                updated REAL
+            );
+        """)
+        # Bestanden van voor compress.py hebben deze kolommen nog niet
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(device_state)")}
+        for column in ("prev_point", "pending_row"):
+            if column not in existing:
+                conn.execute(f"ALTER TABLE device_state ADD COLUMN {column} TEXT")
+
+    def connection(self):
+        if self._pid != os.getpid():
+            # Na een fork nooit de verbinding van het ouderproces gebruiken
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transacties zelf regelen met BEGIN/COMMIT
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+# =====================
+# FILTERSTATUS
+# =====================
+
+def _json_or_none(value):
+    return None if value is None else json.dumps(value)
+
+
+class DeviceLocks:
+    """Exclusieve lock per apparaat over threads en processen heen
+
+    fcntl-locks gelden per proces, dus per slot ook een threading.Lock voor
+    de threads binnen één worker. De slot volgt uit crc32 van de sleutel
+    (hash() verschilt per proces).
+    """
+
+    def __init__(self, path, slots=LOCK_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._pid = None
+        self._fd = None
+        self._threads = None
+        self._init_lock = threading.Lock()
+
+    def _ensure(self):
+        if self._pid == os.getpid():
+            return
+        with self._init_lock:
+            if self._pid != os.getpid():
+                # fcntl-locks gaan niet mee over een fork; eigen bestand en locks per proces
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._threads = [threading.Lock() for _ in range(self.slots)]
+                self._pid = os.getpid()
+
+    def slot(self, key):
+        return zlib.crc32(key.encode()) % self.slots
+
+    def acquire(self, key):
+        self._ensure()
+        slot = self.slot(key)
+        self._threads[slot].acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, slot)
+        except BaseException:
+            self._threads[slot].release()
+            raise
+        return slot
+
+    def release(self, slot):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+        self._threads[slot].release()
+
+
+class _Transaction:
+    """Contextmanager die als DeviceState.lock dient"""
+
+    def __init__(self, state):
+        self.state = state
+        self._slot = None
+
+    def __enter__(self):
+        state = self.state
+        self._slot = state.locks.acquire(state.key)
+        try:
+            self._load()
+        except BaseException:
+            state.locks.release(self._slot)
+            raise
+        return state
+
+    def _load(self):
+        state = self.state
+        row = state.db.connection().execute(
+            "SELECT last_lat, last_lon, last_ts, last_points, prev_point, pending_row"
+            " FROM device_state WHERE key = ?",
+            (state.key,),
+        ).fetchone()
+        state.last_points = deque(maxlen=SMOOTH_WINDOW)
+        state.last_saved_point = state.prev_saved_point = state.pending_row = None
+        if row:
+            if row[2] is not None:
+                state.last_saved_point = (row[0], row[1], row[2])
+            state.last_points.extend(tuple(p) for p in json.loads(row[3] or "[]"))
+            if row[4]:
+                state.prev_saved_point = tuple(json.loads(row[4]))
+            if row[5]:
+                state.pending_row = tuple(json.loads(row[5]))
+
+    def __exit__(self, exc_type, exc, tb):
+        state = self.state
+        try:
+            if exc_type is None:
+                # Eén statement in autocommit: de schrijflock van SQLite alleen hier
+                point = state.last_saved_point or (None, None, None)
+                state.db.connection().execute("""
+                    INSERT OR REPLACE INTO device_state
+                        (key, last_lat, last_lon, last_ts, last_points, prev_point, pending_row, updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (state.key, point[0], point[1], point[2], json.dumps(list(state.last_points)),
+                      _json_or_none(state.prev_saved_point), _json_or_none(state.pending_row),
+                      time.time()))
+        finally:
+            state.locks.release(self._slot)
+        return False
+
+
+class SharedDeviceState:
+    def __init__(self, db, locks, key):
+        self.db = db
+        self.locks = locks
+        self.key = key
+        self.last_saved_point = None
+        self.prev_saved_point = None
+        self.pending_row = None
+        self.last_points = deque(maxlen=SMOOTH_WINDOW)
+        self.lock = _Transaction(self)
+
+
+class SharedDeviceRegistry:
+    """Zelfde interface als ingest.DeviceRegistry, maar gedeeld tussen processen"""
+
+    def __init__(self, path, idle_timeout=IDLE_TIMEOUT):
+        self.db = SidecarDB(path)
+        self.locks = DeviceLocks(path + ".lock")
+        self.idle_timeout = idle_timeout
+        self._calls = 0
+
+    def get(self, key):
+        self._calls += 1
+        if self._calls % EVICT_EVERY == 0:
+            self.db.connection().execute(
+                "DELETE FROM device_state WHERE updated < ?",
+                (time.time() - self.idle_timeout,),
+            )
+        return SharedDeviceState(self.db, self.locks, key)
+
+    def __len__(self):
+        return self.db.connection().execute("SELECT COUNT(*) FROM device_state").fetchone()[0]
+
+    def warm(self, conn):
+        """Vul ontbrekende apparaten met hun laatste punt uit de database"""
+        rows = latest_points(conn)
+        sidecar = self.db.connection()
+        sidecar.execute("BEGIN IMMEDIATE")
+        for key, lat, lon, ts in rows:
+            # Bestaat het apparaat al (een andere worker was eerder), dan niet overschrijven
+            sidecar.execute("""
+                INSERT OR IGNORE INTO device_state (key, last_lat, last_lon, last_ts, last_points, updated)
+                VALUES (?, ?, ?, ?, '[]', ?)
+            """, (key, lat, lon, ts, time.time()))
+        sidecar.execute("COMMIT")
+        return len(rows)
+
+# =====================
+# CACHE-GENERATIES
+# =====================
+
+class CacheGenerations:
+    """Versienummer per (dag, tid); een verhoging maakt de cache van alle workers ongeldig"""
+
+    def __init__(self, path):
+        self.db = SidecarDB(path)
+
+    def get(self, day, tid):
+        row = self.db.connection().execute(
+            "SELECT gen FROM cache_generation WHERE day = ? AND tid = ?", (day, tid or "")
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, day, tid):
+        self.db.connection().execute("""
+            INSERT INTO cache_generation (day, tid, gen) VALUES (?, ?, 1)
+            ON CONFLICT (day, tid) DO UPDATE SET gen = gen + 1
+        """, (day, tid or ""))
+
+# =====================
+# METRIEKEN
+# =====================
+
+class MetricSnapshots:
+    """Stand van metrics.py per worker; /metrics telt de levende workers op"""
+
+    def __init__(self, path):
+        self.db = SidecarDB(path)
+
+    def publish(self, snapshot):
+        self.db.connection().execute(
+            "INSERT OR REPLACE INTO metric_snapshot (pid, data, updated) VALUES (?, ?, ?)",
+            (os.getpid(), json.dumps(snapshot), time.time()),
+        )
+
+    def collect(self):
+        conn = self.db.connection()
+        snapshots = []
+        for pid, data in conn.execute("SELECT pid, data FROM metric_snapshot").fetchall():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # Worker bestaat niet meer
+                conn.execute("DELETE FROM metric_snapshot WHERE pid = ?", (pid,))
+                continue
+            except PermissionError:
+                pass
+            snapshots.append(json.loads(data))
+        return snapshots
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+'''
+Vereenvoudiging van een track voor de kaart (Douglas-Peucker).
+
+De tolerantie hangt af van het zoomniveau: op zoom z beslaat één pixel
+ongeveer 156543 * cos(lat) / 2^z meter, en alles wat minder dan een
+paar pixels afwijkt is op het scherm toch niet te zien. De track wordt
+eerst opgeknipt op de punten waar de snelheidsklasse van getColor() in
+timeline.html verandert, zodat de kleuren van de lijn gelijk blijven.
+'''
+
+from math import cos, radians, log2
+
+import numpy as np
+
+TOLERANCE_PX = 1.5      # toegestane afwijking in schermpixels
+VIEWPORT_PX = (1000, 800)  # aangenomen kaartgrootte als er geen zoom is opgegeven
+MAX_ZOOM = 19
+
+# Grenzen (km/u) van getColor() in templates/timeline.html
+SPEED_CLASSES_KMH = (5, 50)
+
+
+def meters_per_pixel(zoom, lat):
+    return 156543.03392 * cos(radians(lat)) / 2**zoom
+
+
+def fit_zoom(lats, lons, viewport=VIEWPORT_PX):
+    """Zoomniveau waarop Leaflet's fitBounds de track ongeveer laat zien"""
+    lat0 = radians((min(lats) + max(lats)) / 2)
+    height_m = (max(lats) - min(lats)) * 111320
+    width_m = (max(lons) - min(lons)) * 111320 * cos(lat0)
+    extent = max(width_m / viewport[0], height_m / viewport[1], 1e-9)
+    zoom = log2(156543.03392 * cos(lat0) / extent)
+    return max(0, min(MAX_ZOOM, int(zoom)))
+
+
+def speed_class(vel):
+    """Snelheidsklasse zoals getColor() die kleurt (vel in m/s)"""
+    kmh = (vel or 0) * 3.6
+    return sum(kmh > limit for limit in SPEED_CLASSES_KMH)
+
+
+def douglas_peucker(x, y, tolerance):
+    """Indexen van de punten die overblijven (x/y in meter)"""
+    n = len(x)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(dx * py - dy * px) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return np.flatnonzero(keep)
+
+
+def simplify_points(points, zoom=None):
+    """Vereenvoudig een lijst punt-dicts (lat/lon/vel) voor het gegeven zoomniveau"""
+    if len(points) < 3:
+        return points
+
+    lat = np.array([p['lat'] for p in points], dtype=float)
+    lon = np.array([p['lon'] for p in points], dtype=float)
+    if zoom is None:
+        zoom = fit_zoom(lat, lon)
+    lat0 = float(lat.mean())
+    tolerance = TOLERANCE_PX * meters_per_pixel(zoom, lat0)
+
+    # Lokale projectie naar meters (equirectangulair, ruim voldoende binnen een dag)
+    x = np.radians(lon) * 6371000 * cos(radians(lat0))
+    y = np.radians(lat) * 6371000
+
+    # Knip op wisselingen van snelheidsklasse; elk stuk wordt apart vereenvoudigd
+    classes = [speed_class(p.get('vel')) for p in points]
+    breaks = [0] + [i for i in range(1, len(points)) if classes[i] != classes[i - 1]]
+    breaks.append(len(points) - 1)
+
+    keep = set()
+    for start, end in zip(breaks[:-1], breaks[1:]):
+        idx = douglas_peucker(x[start:end + 1], y[start:end + 1], tolerance)
+        keep.update(int(i) + start for i in idx)
+    return [points[i] for i in sorted(keep)]
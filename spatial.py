@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+'''
+"Wanneer was ik hier?" – ruimtelijke zoekvragen over de hele historie.
+
+locations krijgt een gegenereerde kolom cell: het nummer van het vak van
+1/CELLS_PER_DEG graad (ongeveer 1,1 x 0,7 km in Nederland) waar het punt in
+ligt, met een index op (cell, timestamp). Vakken zijn rij voor rij
+genummerd, dus een rechthoek is per vakrij één aaneengesloten bereik:
+    cell BETWEEN rij * COLS + kolom_links AND rij * COLS + kolom_rechts
+Een straal- of bbox-vraag leest zo alleen de punten in de vakken eromheen;
+de precieze afstand wordt daarna in NumPy berekend.
+Afgesloten maanden in het kolomarchief (archive.py) worden per maand op
+de int32 lat/lon-kolommen gefilterd en meegenomen.
+
+De kolom wordt door de database zelf gevuld (MariaDB PERSISTENT, SQLite
+VIRTUAL met index), dus ingest, import en migraties hoeven niets te doen.
+
+Gebruik:
+    python spatial.py --lat 52.0907 --lon 5.1214 --straal 150
+    python spatial.py --bbox 52.08,5.10,52.10,5.13 --van 2025-01-01
+'''
+
+import argparse
+from bisect import bisect_right
+from datetime import datetime
+
+import numpy as np
+
+import archive
+import storage
+from storage import Error, local_tz, day_bounds
+from geo import haversine
+from trips import GAP_THRESHOLD_SECONDS
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+CELLS_PER_DEG = 100             # vakken per graad; ook de factor in de kolomdefinitie
+COLS = 360 * CELLS_PER_DEG      # vakken per vakrij
+MAX_RANGES = 200                # meer vakrijen: terugvallen op de (lat, lon)-index
+MAX_RADIUS = 50000              # meter – grootste straal voor /api/hier
+ARCHIVE_END = 2 ** 62           # bovengrens voor archive.rows zonder einddatum
+VISIT_GAP = GAP_THRESHOLD_SECONDS  # seconden tussen treffers die nog één bezoek zijn
+
+# Zelfde rekenwerk als cell_of(); (lat + 90) en (lon + 180) zijn nooit negatief,
+# dus afkappen naar een geheel getal is hier hetzelfde als afronden naar beneden
+CELL_COLUMN = {
+    "mariadb": (
+        f"cell BIGINT AS (FLOOR((lat + 90) * {CELLS_PER_DEG}) * {COLS}"
+        f" + FLOOR((lon + 180) * {CELLS_PER_DEG})) PERSISTENT"
+    ),
+    "sqlite": (
+        f"cell INTEGER GENERATED ALWAYS AS (CAST((lat + 90) * {CELLS_PER_DEG} AS INTEGER) * {COLS}"
+        f" + CAST((lon + 180) * {CELLS_PER_DEG} AS INTEGER)) VIRTUAL"
+    ),
+}
+CELL_INDEX = ("idx_cell_timestamp", "cell, timestamp")
+
+
+def ensure_column(cur):
+    """Voeg de kolom cell en zijn index toe als die er nog niet zijn"""
+    if not storage.column_exists(cur, "locations", "cell"):
+        print("Kolom cell toevoegen (eenmalig, kan bij veel punten even duren)...")
+        cur.execute(f"ALTER TABLE locations ADD COLUMN {CELL_COLUMN[storage.BACKEND]}")
+    name, columns = CELL_INDEX
+    if not storage.index_exists(cur, "locations", name):
+        print(f"Index {name} ({columns}) toevoegen...")
+        storage.add_index(cur, "locations", name, columns)
+
+# =====================
+# VAKKEN
+# =====================
+
+def cell_row(lat):
+    return int(np.floor((lat + 90) * CELLS_PER_DEG))
+
+
+def cell_col(lon):
+    return int(np.floor((lon + 180) * CELLS_PER_DEG))
+
+
+def cell_of(lat, lon):
+    return cell_row(lat) * COLS + cell_col(lon)
+
+
+def radius_bbox(lat, lon, radius_m):
+    """(zuid, west, noord, oost) rond een cirkel"""
+    dlat = radius_m / 111320.0
+    dlon = radius_m / (111320.0 * max(np.cos(np.radians(lat)), 1e-6))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def bbox_fits(bbox, max_radius=MAX_RADIUS):
+    """True als de bbox niet groter is dan de bbox van de grootste straal
+
+    Zonder grens laadt een wereld-bbox de hele historie in het geheugen.
+    """
+    south, west, north, east = bbox
+    limit = radius_bbox((south + north) / 2, (west + east) / 2, max_radius)
+    return north - south <= limit[2] - limit[0] and east - west <= limit[3] - limit[1]
+
+
+def cell_ranges(bbox):
+    """[(laagste, hoogste)] cellen per vakrij die de bbox bedekken"""
+    south, west, north, east = bbox
+    south, north = max(south, -90.0), min(north, 89.999999)
+    west, east = max(west, -180.0), min(east, 179.999999)
+    col_lo, col_hi = cell_col(west), cell_col(east)
+    return [
+        (row * COLS + col_lo, row * COLS + col_hi)
+        for row in range(cell_row(south), cell_row(north) + 1)
+    ]
+
+# =====================
+# ZOEKEN
+# =====================
+
+def find_points(conn, bbox, tid=None, start_ts=None, end_ts=None):
+    """Kandidaatpunten (tid, lat, lon, timestamp, readable_time) in bbox, per apparaat op tijd"""
+    ranges = cell_ranges(bbox)
+    if len(ranges) <= MAX_RANGES:
+        where = "(" + " OR ".join(["cell BETWEEN %s AND %s"] * len(ranges)) + ")"
+        params = [v for r in ranges for v in r]
+    else:
+        # Heel groot gebied: dan is de (lat, lon)-index goedkoper dan honderden bereiken
+        where = "lat >= %s AND lat <= %s"
+        params = [bbox[0], bbox[2]]
+    # Precies op de bbox, de vakken zijn groter
+    where += " AND lat >= %s AND lat <= %s AND lon >= %s AND lon <= %s"
+    params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+    if tid:
+        where += " AND tid = %s"
+        params.append(tid)
+    if start_ts is not None:
+        where += " AND timestamp >= %s"
+        params.append(start_ts)
+    if end_ts is not None:
+        where += " AND timestamp < %s"
+        params.append(end_ts)
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COALESCE(tid, ''), lat, lon, timestamp, CAST(readable_time AS CHAR)
+        FROM locations
+        WHERE {where}
+        ORDER BY COALESCE(tid, ''), timestamp
+    """, params)
+    rows = cur.fetchall()
+    cur.close()
+    # Afgesloten maanden staan (deels) in het kolomarchief; zelfde volgorde
+    archived = archive.rows(start_ts if start_ts is not None else 0,
+                            end_ts if end_ts is not None else ARCHIVE_END, tid or None,
+                            ("tid", "lat", "lon", "timestamp", "readable_time"), bbox=bbox)
+    return list(archive.merge(rows, archived, key=lambda row: (row[0], row[3])))
+
+
+def group_visits(rows, distances=None, gap=VISIT_GAP):
+    """Opeenvolgende treffers per apparaat samenvoegen tot bezoeken"""
+    visits = []
+    current = None
+    for i, (tid, lat, lon, ts, readable_time) in enumerate(rows):
+        d = None if distances is None else float(distances[i])
+        if current and current["tid"] == tid and ts - current["eind_ts"] <= gap:
+            current["eind_ts"], current["tot"] = ts, readable_time
+            current["punten"] += 1
+            if d is not None:
+                current["min_afstand_m"] = min(current["min_afstand_m"], round(d, 1))
+            continue
+        current = {
+            "tid": tid, "start_ts": ts, "eind_ts": ts,
+            "van": readable_time, "tot": readable_time, "punten": 1,
+            "min_afstand_m": None if d is None else round(d, 1),
+        }
+        visits.append(current)
+    return visits
+
+
+def attach_trips(conn, visits):
+    """Ritten (tabel trips) die een bezoek overlappen"""
+    if not visits:
+        return []
+    cur = conn.cursor(dictionary=True)
+    cur.execute(
+        "SELECT * FROM trips WHERE kind = 'trip' AND end_ts >= %s AND start_ts <= %s ORDER BY start_ts",
+        (min(v["start_ts"] for v in visits), max(v["eind_ts"] for v in visits)),
+    )
+    rows = cur.fetchall()
+    cur.close()
+
+    by_tid = {}
+    for v in visits:
+        by_tid.setdefault(v["tid"], []).append(v)
+    starts = {tid: [v["start_ts"] for v in vs] for tid, vs in by_tid.items()}
+
+    result = []
+    for trip in rows:
+        vs = by_tid.get(trip["tid"])
+        if not vs:
+            continue
+        # Bezoeken overlappen elkaar niet: alleen het laatste dat vóór het einde begint telt
+        i = bisect_right(starts[trip["tid"]], trip["end_ts"]) - 1
+        if i >= 0 and vs[i]["eind_ts"] >= trip["start_ts"]:
+            result.append({k: trip[k] for k in (
+                "tid", "start_ts", "end_ts", "start_lat", "start_lon",
+                "end_lat", "end_lon", "distance_m")})
+    return result
+
+
+def _result(conn, rows, distances=None):
+    visits = group_visits(rows, distances)
+    days = sorted({v["van"][:10] for v in visits} | {v["tot"][:10] for v in visits})
+    return {
+        "punten": len(rows),
+        "dagen": days,
+        "bezoeken": visits,
+        "ritten": attach_trips(conn, visits),
+    }
+
+
+def query_radius(conn, lat, lon, radius_m, tid=None, start_ts=None, end_ts=None):
+    """Alle keren dat er een punt binnen radius_m van (lat, lon) lag"""
+    rows = find_points(conn, radius_bbox(lat, lon, radius_m), tid, start_ts, end_ts)
+    if rows:
+        lats = np.fromiter((r[1] for r in rows), dtype=float, count=len(rows))
+        lons = np.fromiter((r[2] for r in rows), dtype=float, count=len(rows))
+        d = haversine(lats, lons, lat, lon)
+        inside = d <= radius_m
+        rows = [r for r, ok in zip(rows, inside) if ok]
+        d = d[inside]
+    else:
+        d = np.zeros(0)
+    return _result(conn, rows, d)
+
+
+def query_bbox(conn, bbox, tid=None, start_ts=None, end_ts=None):
+    """Alle keren dat er een punt binnen (zuid, west, noord, oost) lag"""
+    return _result(conn, find_points(conn, bbox, tid, start_ts, end_ts))
+
+
+def period(van=None, tot=None):
+    """(start_ts, end_ts) uit dagen YYYY-MM-DD; ontbrekende grenzen zijn None"""
+    return (day_bounds(van)[0] if van else None,
+            day_bounds(tot)[1] if tot else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wanneer was ik hier?")
+    parser.add_argument("--lat", type=float)
+    parser.add_argument("--lon", type=float)
+    parser.add_argument("--straal", type=float, default=100, help="meter (standaard 100)")
+    parser.add_argument("--bbox", help="zuid,west,noord,oost in plaats van een straal")
+    parser.add_argument("--tid")
+    parser.add_argument("--van", help="YYYY-MM-DD")
+    parser.add_argument("--tot", help="YYYY-MM-DD")
+    args = parser.parse_args()
+    if not args.bbox and (args.lat is None or args.lon is None):
+        parser.error("geef --lat en --lon, of --bbox")
+
+    start_ts, end_ts = period(args.van, args.tot)
+    try:
+        conn = storage.get_connection()
+        if args.bbox:
+            bbox = tuple(float(v) for v in args.bbox.split(","))
+            result = query_bbox(conn, bbox, args.tid, start_ts, end_ts)
+        else:
+            result = query_radius(conn, args.lat, args.lon, args.straal, args.tid, start_ts, end_ts)
+        conn.close()
+    except Error as e:
+        print(f"Fout bij zoeken: {e}")
+        return
+
+    print(f"{result['punten']} punten, {len(result['bezoeken'])} bezoeken op {len(result['dagen'])} dagen")
+    for v in result["bezoeken"]:
+        dist = f"  ({v['min_afstand_m']} m)" if v["min_afstand_m"] is not None else ""
+        print(f"  {v['van']} – {v['tot'][11:]}  {v['tid'] or '-'}  {v['punten']} punten{dist}")
+    for t in result["ritten"]:
+        start = datetime.fromtimestamp(t["start_ts"], local_tz).strftime('%Y-%m-%d %H:%M')
+        print(f"  rit {start}  {t['tid'] or '-'}  {t['distance_m'] / 1000:.1f} km")
+
+
+if __name__ == "__main__":
+    main()
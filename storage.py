@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+
+'''
+Schrijfpad voor de ingest: een connection pool en een gebufferde batch-writer.
+
+In plaats van per OwnTracks-bericht een nieuwe verbinding te openen, zet
+/pub het punt in een begrensde wachtrij. Een achtergrondthread pakt de punten
+samen tot één multi-row INSERT met één commit per batch. Er wordt geflusht
+zodra de batch vol is of het oudste punt te lang wacht, en bij afsluiten
+wordt de rest weggeschreven.
+
+De opslag is MariaDB of een SQLite-bestand (storage_sqlite), te kiezen met
+DB_BACKEND in config.py of de omgevingsvariabele TIMELINE_BACKEND. Beide
+geven een verbinding uit een pool met dezelfde interface.
+'''
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from mysql.connector import pooling, Error as MySQLError
+from mysql.connector.errors import PoolError
+
+import config
+import metrics
+import storage_sqlite
+from log import log
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+POOL_SIZE = 5           # aantal open verbindingen in de pool
+POOL_WAIT = 5.0         # seconden wachten op een vrije verbinding
+BATCH_SIZE = 200        # max aantal rijen per INSERT/commit
+FLUSH_INTERVAL = 1.0    # seconden – max wachttijd van een punt in de buffer
+QUEUE_MAX = 10000       # max aantal punten in de wachtrij
+FLUSH_RETRIES = 3       # pogingen per batch voordat we opgeven
+
+local_tz = pytz.timezone('Europe/Amsterdam')
+
+# 'mariadb' of 'sqlite'
+BACKEND = os.environ.get("TIMELINE_BACKEND") or getattr(config, "DB_BACKEND", "mariadb")
+SQLITE_PATH = os.environ.get("TIMELINE_SQLITE_PATH") or getattr(config, "SQLITE_PATH", "location_data.db")
+
+# Databasefouten van beide backends, voor except-clausules
+Error = (MySQLError, sqlite3.Error)
+
+# Volgorde van de velden in een rij uit de wachtrij
+COLUMNS = ("readable_time", "lat", "lon", "acc", "timestamp", "vel", "tid", "topic", "err_bound")
+COL = {name: i for i, name in enumerate(COLUMNS)}
+
+# Een punt dat al bestaat (zelfde tid en timestamp, bv. een herhaalde
+# offline-wachtrij) laten we staan
+INSERT_SQL = "INSERT INTO locations ({}) VALUES ({}) ON DUPLICATE KEY UPDATE id = id".format(
+    ", ".join(COLUMNS), ", ".join(["%s"] * len(COLUMNS))
+)
+
+# =====================
+# CONNECTION POOL
+# =====================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Maak de pool bij het eerste gebruik aan"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if BACKEND == "sqlite":
+                _pool = storage_sqlite.ConnectionPool(SQLITE_PATH, POOL_SIZE)
+            else:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="timeline",
+                    pool_size=POOL_SIZE,
+                    pool_reset_session=True,
+                    **config.DB_CONFIG
+                )
+    return _pool
+
+
+def close_pool():
+    """Sluit alle verbindingen, bv. in de gunicorn-master vóór het forken"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            if BACKEND == "sqlite":
+                _pool.close()
+            else:
+                _pool._remove_connections()
+            _pool = None
+
+
+def get_connection():
+    """Verbinding uit de pool; close() geeft hem terug aan de pool"""
+    with metrics.DB_CONNECT_SECONDS.time():
+        if BACKEND == "sqlite":
+            return get_pool().get()
+        deadline = time.monotonic() + POOL_WAIT
+        while True:
+            try:
+                return get_pool().get_connection()
+            except PoolError:
+                # Pool is (tijdelijk) leeg, even wachten op een vrije verbinding
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+# =====================
+# SCHEMA MIGRATIES
+# =====================
+
+LOCATIONS_DDL = {
+    "mariadb": """
+        CREATE TABLE IF NOT EXISTS locations (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            readable_time DATETIME,
+            SSID VARCHAR(255),
+            acc FLOAT,
+            alt FLOAT,
+            batt INT,
+            bs INT,
+            cog FLOAT,
+            conn VARCHAR(50),
+            created_at BIGINT,
+            lat DOUBLE,
+            lon DOUBLE,
+            m INT,
+            source VARCHAR(50),
+            tid VARCHAR(10),
+            topic VARCHAR(255),
+            vac FLOAT,
+            vel FLOAT,
+            timestamp BIGINT,
+            err_bound FLOAT,
+            INDEX (readable_time),
+            INDEX idx_timestamp (timestamp),
+            INDEX idx_lat_lon (lat, lon),
+            UNIQUE KEY uniq_tid_timestamp (tid, timestamp)
+        )
+    """,
+    # Zelfde kolommen als de oude location_data.db, dus die kan zo door
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            readable_time TEXT,
+            SSID TEXT,
+            acc REAL,
+            alt REAL,
+            batt INTEGER,
+            bs INTEGER,
+            cog REAL,
+            conn TEXT,
+            created_at INTEGER,
+            lat REAL,
+            lon REAL,
+            m INTEGER,
+            source TEXT,
+            tid TEXT,
+            topic TEXT,
+            vac REAL,
+            vel REAL,
+            timestamp INTEGER,
+            err_bound REAL
+        )
+    """,
+}
+
+# (naam, kolommen) – indexen die de dag-, apparaat- en tegelqueries nodig hebben
+INDEXES = [
+    ("idx_timestamp", "timestamp"),
+    ("idx_lat_lon", "lat, lon"),
+]
+
+# Eén punt per apparaat per seconde; maakt importeren en herhalen idempotent
+UNIQUE_KEY = ("uniq_tid_timestamp", "tid, timestamp")
+
+
+def create_schema(cur):
+    """Maak de tabel locations aan en breng hem bij naar het huidige schema"""
+    cur.execute(LOCATIONS_DDL[BACKEND])
+    migrate_schema(cur)
+
+
+def index_exists(cur, table, name):
+    if BACKEND == "sqlite":
+        cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+            (table, name),
+        )
+    else:
+        cur.execute("""
+            SELECT 1 FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+            LIMIT 1
+        """, (table, name))
+    return cur.fetchone() is not None
+
+
+def column_exists(cur, table, name):
+    if BACKEND == "sqlite":
+        # table_xinfo toont ook gegenereerde kolommen
+        cur.execute(f"PRAGMA table_xinfo({table})")
+        return any(row[1] == name for row in cur.fetchall())
+    cur.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        LIMIT 1
+    """, (table, name))
+    return cur.fetchone() is not None
+
+
+def add_index(cur, table, name, columns, unique=False):
+    if BACKEND == "sqlite":
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        cur.execute(f"CREATE {kind} {name} ON {table} ({columns})")
+    else:
+        kind = "UNIQUE KEY" if unique else "INDEX"
+        cur.execute(f"ALTER TABLE {table} ADD {kind} {name} ({columns})")
+
+
+def drop_index(cur, table, name):
+    if BACKEND == "sqlite":
+        cur.execute(f"DROP INDEX {name}")
+    else:
+        cur.execute(f"ALTER TABLE {table} DROP INDEX {name}")
+
+
+def migrate_schema(cur):
+    """Breng een bestaande tabel locations bij naar het huidige schema"""
+    for name, columns in INDEXES:
+        if not index_exists(cur, "locations", name):
+            print(f"Index {name} ({columns}) toevoegen...")
+            add_index(cur, "locations", name, columns)
+
+    name, columns = UNIQUE_KEY
+    if not index_exists(cur, "locations", name):
+        # Dubbele (tid, timestamp) eerst opruimen, anders faalt de unieke sleutel
+        if BACKEND == "sqlite":
+            cur.execute("""
+                DELETE FROM locations
+                WHERE EXISTS (
+                    SELECT 1 FROM locations l2
+                    WHERE l2.tid = locations.tid AND l2.timestamp = locations.timestamp
+                      AND l2.id < locations.id
+                )
+            """)
+        else:
+            cur.execute("""
+                DELETE l1 FROM locations l1
+                JOIN locations l2
+                  ON l1.tid = l2.tid AND l1.timestamp = l2.timestamp AND l1.id > l2.id
+            """)
+        if cur.rowcount:
+            print(f"{cur.rowcount} dubbele punten verwijderd")
+        print(f"Unieke sleutel {name} ({columns}) toevoegen...")
+        add_index(cur, "locations", name, columns, unique=True)
+
+    # Punten zonder tid staan sinds de unieke sleutel als ''; NULL is in een
+    # unieke sleutel altijd verschillend, dus oude NULL-rijen eerst ontdubbelen
+    cur.execute("SELECT 1 FROM locations WHERE tid IS NULL LIMIT 1")
+    if cur.fetchone() is not None:
+        if BACKEND == "sqlite":
+            cur.execute("""
+                DELETE FROM locations
+                WHERE tid IS NULL AND EXISTS (
+                    SELECT 1 FROM locations l2
+                    WHERE l2.timestamp = locations.timestamp
+                      AND (l2.tid = '' OR (l2.tid IS NULL AND l2.id < locations.id))
+                )
+            """)
+        else:
+            cur.execute("""
+                DELETE l1 FROM locations l1
+                JOIN locations l2
+                  ON l2.timestamp = l1.timestamp
+                 AND (l2.tid = '' OR (l2.tid IS NULL AND l2.id < l1.id))
+                WHERE l1.tid IS NULL
+            """)
+        if cur.rowcount:
+            print(f"{cur.rowcount} dubbele punten zonder tid verwijderd")
+        print("Punten zonder tid omzetten naar ''...")
+        cur.execute("UPDATE locations SET tid = '' WHERE tid IS NULL")
+
+    # De oude gewone index op (tid, timestamp) is nu overbodig
+    if index_exists(cur, "locations", "idx_tid_timestamp"):
+        drop_index(cur, "locations", "idx_tid_timestamp")
+
+    # Foutgrens van de ingest-compressie (compress.py); NULL voor oudere punten
+    if not column_exists(cur, "locations", "err_bound"):
+        print("Kolom err_bound toevoegen...")
+        cur.execute("ALTER TABLE locations ADD COLUMN err_bound FLOAT")
+
+# =====================
+# DAGQUERIES
+# =====================
+
+def day_bounds(day_str):
+    """Halfopen interval [start, eind) in epoch-seconden voor een lokale dag
+
+    De grenzen komen uit Europe/Amsterdam, dus een DST-dag is 23 of 25 uur.
+    """
+    day = datetime.strptime(day_str, '%Y-%m-%d')
+    start = local_tz.localize(day)
+    end = local_tz.localize(day + timedelta(days=1))
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def fetch_day_points(conn, day_str, tid=None):
+    """Alle punten van één dag, gesorteerd op tijd
+
+    Filtert op een bereik van de kolom timestamp zodat de database de index
+    gebruikt in plaats van DATE(readable_time) voor elke rij uit te rekenen.
+    """
+    start_ts, end_ts = day_bounds(day_str)
+    # We gebruiken CAST(... AS CHAR) om de datum direct als tekst op te halen
+    sql = """
+        SELECT
+            lat,
+            lon,
+            vel,
+            timestamp,
+            CAST(readable_time AS CHAR) as readable_time
+        FROM locations
+        WHERE timestamp >= %s AND timestamp < %s
+    """
+    params = [start_ts, end_ts]
+    if tid:
+        sql += " AND tid = %s"
+        params.append(tid)
+    sql += " ORDER BY timestamp ASC"
+
+    cur = conn.cursor(dictionary=True)
+    cur.execute(sql, params)
+    points = cur.fetchall()
+    cur.close()
+    return points
+
+# =====================
+# BATCH WRITER
+# =====================
+
+class BatchWriter:
+    """Achtergrondthread die punten uit de wachtrij in batches opslaat"""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 maxsize=QUEUE_MAX):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Functies (conn, batch) die in dezelfde transactie meedraaien
+        self.hooks = []
+        # Functies (batch) die na een geslaagde commit draaien
+        self.after_commit = []
+
+        # Statistieken voor /status
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.dropped_rows = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="batch-writer", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, row, timeout=0.5):
+        """Zet een rij in de wachtrij; False als de wachtrij vol blijft"""
+        self.start()
+        try:
+            self.queue.put(row, timeout=timeout)
+            return True
+        except queue.Full:
+            self.dropped_rows += 1
+            metrics.ROWS.inc(result="dropped")
+            return False
+
+    def write_now(self, rows):
+        """Schrijf rijen meteen in één transactie, in de thread van de aanroeper
+
+        Voor bulkberichten op /pub: de client hoort pas 'ok' als alles vastligt.
+        Lukt het niet, dan gaan de rijen alsnog via de wachtrij (met de gewone
+        herkansingen) en komt er False terug.
+        """
+        if not rows:
+            return True
+        if self._flush(rows, retries=1, drop=False):
+            return True
+        for row in rows:
+            self.put(row)
+        return False
+
+    def stop(self):
+        """Stop de thread en schrijf alles wat nog in de wachtrij staat weg"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        rest = []
+        while True:
+            try:
+                rest.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(rest), self.batch_size):
+            self._flush(rest[i:i + self.batch_size])
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # Verzamel tot de batch vol is of het eerste punt te oud wordt
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception:
+                # Nooit de thread laten sterven: dan loopt de wachtrij vol en
+                # krijgt /pub 'ok' terwijl elk punt wordt weggegooid
+                self.errors += 1
+                log.exception("Onverwachte fout in de batch-writer (%d rijen)", len(batch))
+
+    def _flush(self, batch, retries=FLUSH_RETRIES, drop=True):
+        """Eén transactie met hooks; True als de batch is opgeslagen"""
+        if not batch:
+            return True
+        for attempt in range(1, retries + 1):
+            start = time.perf_counter()
+            try:
+                conn = get_connection()
+                try:
+                    cur = conn.cursor()
+                    # MariaDB maakt hier één multi-row INSERT van, SQLite hergebruikt
+                    # één voorbereid statement; in beide gevallen één transactie
+                    cur.executemany(INSERT_SQL, batch)
+                    for hook in self.hooks:
+                        hook(conn, batch)
+                    with metrics.DB_COMMIT_SECONDS.time():
+                        conn.commit()
+                    cur.close()
+                finally:
+                    # Een pool-reset rolt een half afgeronde transactie terug
+                    conn.close()
+            except Error as e:
+                self.errors += 1
+                metrics.FLUSHES.inc(result="error")
+                log.error("Fout bij opslaan batch (%d rijen, poging %d): %s", len(batch), attempt, e)
+                if attempt < retries:
+                    time.sleep(0.5 * attempt)
+                continue
+
+            # De rijen staan vast; een fout in een hook mag daar niets meer aan veranderen
+            for hook in self.after_commit:
+                try:
+                    hook(batch)
+                except Exception as e:
+                    log.error("Fout in after_commit-hook %s: %s", getattr(hook, "__name__", hook), e)
+
+            seconds = time.perf_counter() - start
+            metrics.FLUSH_SECONDS.observe(seconds)
+            metrics.FLUSHES.inc(result="ok")
+            metrics.ROWS.inc(len(batch), result="stored")
+            ms = seconds * 1000
+            self.last_flush_ms = ms
+            self.max_flush_ms = max(self.max_flush_ms, ms)
+            self._total_flush_ms += ms
+            self.flushed_batches += 1
+            self.flushed_rows += len(batch)
+            return True
+
+        if drop:
+            self.dropped_rows += len(batch)
+            metrics.FLUSHES.inc(result="dropped")
+            metrics.ROWS.inc(len(batch), result="dropped")
+            log.error("Batch van %d rijen definitief niet opgeslagen.", len(batch))
+        return False
+
+    def status(self):
+        """Wachtrijdiepte en flush-latency"""
+        avg = self._total_flush_ms / self.flushed_batches if self.flushed_batches else 0.0
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_max": self.queue.maxsize,
+            "flushed_rows": self.flushed_rows,
+            "flushed_batches": self.flushed_batches,
+            "dropped_rows": self.dropped_rows,
+            "errors": self.errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(avg, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
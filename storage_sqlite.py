@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+'''
+SQLite als opslag voor de timeline, naast MariaDB.
+
+storage.get_connection() geeft met TIMELINE_BACKEND=sqlite een verbinding
+uit deze module. Die gedraagt zich als een mysql.connector-verbinding
+(cursor(dictionary=True), executemany, commit, close geeft terug aan de
+pool), zodat storage, summary, trips en importeer dezelfde queries
+gebruiken. De MariaDB-dialectstukken worden per query eenmalig vertaald:
+  - %s                              -> ?
+  - ON DUPLICATE KEY UPDATE id = id -> ON CONFLICT DO NOTHING
+  - ON DUPLICATE KEY UPDATE a = VALUES(a) -> ON CONFLICT DO UPDATE SET a = excluded.a
+  - SELECT ... FOR UPDATE           -> zonder FOR UPDATE (één schrijver tegelijk)
+  - CAST(x AS CHAR), LEFT(x, n)     -> CAST(x AS TEXT), substr(x, 1, n)
+Tabellen aanmaken (DDL) doet elke module zelf per backend.
+
+Het bestand draait in WAL-modus: lezers (de webpagina) blokkeren de
+BatchWriter niet en andersom. Een schrijftransactie begint met BEGIN
+IMMEDIATE, zodat een tweede schrijver netjes op busy_timeout wacht.
+'''
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import date
+from functools import lru_cache
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",    # in WAL alleen fsync bij een checkpoint
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",     # 64 MB paginacache per verbinding
+    "PRAGMA mmap_size=268435456",   # 256 MB van het bestand gemapt lezen
+    "PRAGMA busy_timeout=10000",    # ms wachten op de schrijflock
+)
+
+# =====================
+# DIALECT
+# =====================
+
+_UPSERT = re.compile(r"ON DUPLICATE KEY UPDATE\s+(.*)$", re.S | re.I)
+_KEEP = re.compile(r"^\s*id\s*=\s*id\s*$", re.I)
+_VALUES = re.compile(r"VALUES\((\w+)\)", re.I)
+_FOR_UPDATE = re.compile(r"\s+FOR UPDATE\b", re.I)
+_CAST_CHAR = re.compile(r"\bAS CHAR\)", re.I)
+_LEFT = re.compile(r"\bLEFT\((.+?),\s*(\d+)\)", re.I)
+_PLACEHOLDER = re.compile(r"%([s%])")
+
+
+@lru_cache(maxsize=256)
+def translate(sql):
+    """Vertaal een MariaDB-query naar SQLite"""
+    match = _UPSERT.search(sql)
+    if match:
+        updates = match.group(1)
+        if _KEEP.match(updates):
+            tail = "ON CONFLICT DO NOTHING"
+        else:
+            tail = "ON CONFLICT DO UPDATE SET " + _VALUES.sub(r"excluded.\1", updates)
+        sql = sql[:match.start()] + tail
+    sql = _FOR_UPDATE.sub("", sql)
+    sql = _CAST_CHAR.sub("AS TEXT)", sql)
+    sql = _LEFT.sub(r"substr(\1, 1, \2)", sql)
+    # %s wordt ?, en %% (een letterlijke % in mysql.connector) weer %
+    return _PLACEHOLDER.sub(lambda m: "?" if m.group(1) == "s" else "%", sql)
+
+
+def _params(params):
+    # datetime.date heeft in sqlite3 geen standaard adapter meer
+    return [p.isoformat() if isinstance(p, date) else p for p in params]
+
+
+def _dict_row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+# =====================
+# VERBINDING
+# =====================
+
+class Cursor:
+    """sqlite3-cursor met de interface van een mysql.connector-cursor"""
+
+    def __init__(self, cur, dictionary=False):
+        self._cur = cur
+        if dictionary:
+            cur.row_factory = _dict_row
+
+    def execute(self, sql, params=()):
+        self._cur.execute(translate(sql), _params(params))
+
+    def executemany(self, sql, rows):
+        self._cur.executemany(translate(sql), (_params(r) for r in rows))
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size):
+        return self._cur.fetchmany(size)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+
+class Connection:
+    """Verbinding uit de pool; close() geeft hem terug, net als bij MariaDB"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def cursor(self, dictionary=False, buffered=None):
+        # sqlite3 leest altijd rij voor rij; buffered=False is dus vanzelf zo
+        return Cursor(self._raw.cursor(), dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is not None:
+            self._pool.release(self._raw)
+            self._raw = None
+
+
+class ConnectionPool:
+    """Hergebruikt open verbindingen op één SQLite-bestand
+
+    Elke get() geeft een verbinding die niemand anders gebruikt, dus twee
+    verbindingen in dezelfde thread (lezen en schrijven, zoals de backfill)
+    zitten elkaar niet in de weg. Na een fork (gunicorn) begint het kind met
+    een lege pool.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        raw = sqlite3.connect(self.path, timeout=10, isolation_level="IMMEDIATE",
+                              check_same_thread=False)
+        for pragma in PRAGMAS:
+            raw.execute(pragma)
+        return raw
+
+    def get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle, self._pid = [], os.getpid()
+            raw = self._idle.pop() if self._idle else None
+        return Connection(self, raw or self._open())
+
+    def release(self, raw):
+        # Een half afgeronde transactie nooit aan de volgende gebruiker meegeven
+        raw.rollback()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(raw)
+                return
+        raw.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for raw in idle:
+            raw.close()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+'''
+Voorberekende dagsamenvatting per apparaat (tabel daily_summary).
+
+De ingest werkt de rij van (dag, tid) bij in dezelfde transactie als de
+INSERT van de punten, zodat de timelinepagina en de maand-/jaaroverzichten
+één rij lezen in plaats van alle punten van de dag opnieuw door te rekenen.
+
+Bestaande historie vullen:
+    python summary.py --backfill
+'''
+
+import argparse
+from collections import defaultdict
+from datetime import date
+
+import archive
+import storage
+from geo import distance_m, track_metrics, NOISE_DIST, MOVING_SPEED
+from storage import COL, Error, day_bounds
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+ARCHIVE_END = 2 ** 62        # bovengrens voor archive.rows: de hele geschiedenis
+
+SUMMARY_FIELDS = (
+    "distance_m", "point_count", "first_ts", "last_ts",
+    "min_lat", "max_lat", "min_lon", "max_lon",
+    "moving_s", "last_lat", "last_lon",
+)
+
+UPSERT_SQL = """
+    INSERT INTO daily_summary (day, tid, {fields})
+    VALUES (%s, %s, {values})
+    ON DUPLICATE KEY UPDATE {updates}
+""".format(
+    fields=", ".join(SUMMARY_FIELDS),
+    values=", ".join(["%s"] * len(SUMMARY_FIELDS)),
+    updates=", ".join(f"{f} = VALUES({f})" for f in SUMMARY_FIELDS),
+)
+
+
+def create_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            day DATE NOT NULL,
+            tid VARCHAR(10) NOT NULL DEFAULT '',
+            distance_m DOUBLE NOT NULL DEFAULT 0,
+            point_count INT NOT NULL DEFAULT 0,
+            first_ts BIGINT,
+            last_ts BIGINT,
+            min_lat DOUBLE,
+            max_lat DOUBLE,
+            min_lon DOUBLE,
+            max_lon DOUBLE,
+            moving_s INT NOT NULL DEFAULT 0,
+            last_lat DOUBLE,
+            last_lon DOUBLE,
+            PRIMARY KEY (day, tid)
+        )
+    """)
+
+# =====================
+# SAMENVATTING
+# =====================
+
+class DaySummary:
+    """Loopt punten van één dag in tijdsvolgorde af"""
+
+    def __init__(self, row=None):
+        self.distance_m = 0.0
+        self.point_count = 0
+        self.first_ts = self.last_ts = None
+        self.min_lat = self.max_lat = self.min_lon = self.max_lon = None
+        self.moving_s = 0
+        self.last_lat = self.last_lon = None
+        if row:
+            for name in SUMMARY_FIELDS:
+                setattr(self, name, row[name])
+
+    def add(self, lat, lon, ts):
+        if self.point_count:
+            d = distance_m(self.last_lat, self.last_lon, lat, lon)
+            dt = ts - self.last_ts
+            if d > NOISE_DIST:
+                self.distance_m += d
+                if dt > 0 and d / dt >= MOVING_SPEED:
+                    self.moving_s += dt
+            self.min_lat, self.max_lat = min(self.min_lat, lat), max(self.max_lat, lat)
+            self.min_lon, self.max_lon = min(self.min_lon, lon), max(self.max_lon, lon)
+        else:
+            self.first_ts = ts
+            self.min_lat = self.max_lat = lat
+            self.min_lon = self.max_lon = lon
+        self.point_count += 1
+        self.last_ts, self.last_lat, self.last_lon = ts, lat, lon
+
+    @classmethod
+    def from_track(cls, lat, lon, ts):
+        """Samenvatting van een hele dag in één gevectoriseerde doorloop"""
+        day = cls()
+        if not len(ts):
+            return day
+        metrics = track_metrics(lat, lon, ts)
+        day.distance_m = metrics["distance_m"]
+        day.moving_s = metrics["moving_s"]
+        day.point_count = len(ts)
+        day.first_ts, day.last_ts = int(ts[0]), int(ts[-1])
+        day.min_lat, day.max_lat = float(min(lat)), float(max(lat))
+        day.min_lon, day.max_lon = float(min(lon)), float(max(lon))
+        day.last_lat, day.last_lon = float(lat[-1]), float(lon[-1])
+        return day
+
+    def values(self):
+        return tuple(getattr(self, name) for name in SUMMARY_FIELDS)
+
+
+def _tid_filter(tid):
+    # Punten zonder tid staan in de samenvatting onder ''
+    if tid:
+        return " AND tid = %s", [tid]
+    return " AND (tid IS NULL OR tid = '')", []
+
+
+def rebuild_day(cur, day_str, tid):
+    """Reken één dag opnieuw uit op basis van de ruwe punten
+
+    Ook die in het kolomarchief: een laat punt in een gearchiveerde maand
+    staat alleen in locations, de rest van de dag in het archief.
+    """
+    start_ts, end_ts = day_bounds(day_str)
+    where, params = _tid_filter(tid)
+    cur.execute(
+        "SELECT lat, lon, timestamp FROM locations"
+        " WHERE timestamp >= %s AND timestamp < %s" + where +
+        " ORDER BY timestamp ASC",
+        [start_ts, end_ts] + params,
+    )
+    rows = list(archive.merge(cur.fetchall(),
+                              archive.rows(start_ts, end_ts, tid, ("lat", "lon", "timestamp")),
+                              key=lambda r: r[2]))
+    return DaySummary.from_track(
+        [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]
+    )
+
+
+def apply_batch(conn, batch):
+    """Hook voor de BatchWriter: werk daily_summary bij voor een batch rijen"""
+    groups = defaultdict(list)
+    for row in batch:
+        key = (row[COL["readable_time"]][:10], row[COL["tid"]] or "")
+        groups[key].append((row[COL["timestamp"]], row[COL["lat"]], row[COL["lon"]]))
+
+    cur = conn.cursor()
+    dcur = conn.cursor(dictionary=True)
+    for (day_str, tid), points in groups.items():
+        points.sort()
+        dcur.execute(
+            "SELECT * FROM daily_summary WHERE day = %s AND tid = %s FOR UPDATE",
+            (day_str, tid),
+        )
+        existing = dcur.fetchone()
+
+        if existing and existing["last_ts"] is not None and points[0][0] <= existing["last_ts"]:
+            # Punt(en) van vóór of gelijk aan het laatst verwerkte punt (herhaald
+            # of te laat binnengekomen): dag opnieuw opbouwen
+            day = rebuild_day(cur, day_str, tid)
+        else:
+            day = DaySummary(existing)
+            for ts, lat, lon in points:
+                day.add(lat, lon, ts)
+
+        cur.execute(UPSERT_SQL, (day_str, tid) + day.values())
+    dcur.close()
+    cur.close()
+
+# =====================
+# LEZEN
+# =====================
+
+def fetch_day(conn, day_str, tid=None):
+    """Samenvatting van één dag; zonder tid opgeteld over alle apparaten"""
+    cur = conn.cursor(dictionary=True)
+    if tid:
+        cur.execute("SELECT * FROM daily_summary WHERE day = %s AND tid = %s", (day_str, tid))
+    else:
+        cur.execute("""
+            SELECT SUM(distance_m) AS distance_m, SUM(point_count) AS point_count,
+                   MIN(first_ts) AS first_ts, MAX(last_ts) AS last_ts,
+                   MIN(min_lat) AS min_lat, MAX(max_lat) AS max_lat,
+                   MIN(min_lon) AS min_lon, MAX(max_lon) AS max_lon,
+                   SUM(moving_s) AS moving_s
+            FROM daily_summary WHERE day = %s
+        """, (day_str,))
+    row = cur.fetchone()
+    cur.close()
+    if not row or not row["point_count"]:
+        return None
+    return row
+
+
+def fetch_overview(conn, period, tid=None):
+    """Totalen per dag (periode 'YYYY-MM') of per maand (periode 'YYYY')"""
+    if len(period) == 4:
+        year = int(period)
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+        group = "LEFT(CAST(day AS CHAR), 7)"
+    else:
+        year, month = map(int, period.split("-"))
+        start = date(year, month, 1)
+        end = date(year + month // 12, month % 12 + 1, 1)
+        group = "CAST(day AS CHAR)"
+
+    sql = f"""
+        SELECT {group} AS periode,
+               SUM(distance_m) AS distance_m, SUM(point_count) AS point_count,
+               SUM(moving_s) AS moving_s
+        FROM daily_summary
+        WHERE day >= %s AND day < %s
+    """
+    params = [start, end]
+    if tid:
+        sql += " AND tid = %s"
+        params.append(tid)
+    sql += " GROUP BY periode ORDER BY periode"
+
+    cur = conn.cursor(dictionary=True)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+    return [
+        {
+            "periode": r["periode"],
+            "km": round(float(r["distance_m"]) / 1000, 2),
+            "punten": int(r["point_count"]),
+            "bewogen_min": int(r["moving_s"]) // 60,
+        }
+        for r in rows
+    ]
+
+# =====================
+# BACKFILL
+# =====================
+
+def backfill():
+    """Bouw daily_summary in één doorloop over locations en het archief opnieuw op"""
+    read_conn = storage.get_connection()
+    write_conn = storage.get_connection()
+    rcur = read_conn.cursor(buffered=False)
+    wcur = write_conn.cursor()
+    create_table(wcur)
+
+    rcur.execute("""
+        SELECT COALESCE(tid, ''), timestamp, lat, lon, CAST(readable_time AS CHAR)
+        FROM locations
+        ORDER BY COALESCE(tid, ''), timestamp
+    """)
+    # Zelfde volgorde als het archief; een dag kan deels gearchiveerd zijn
+    # (nagekomen punten), dus beide stromen samen en niet locations alleen
+    archived = archive.rows(0, ARCHIVE_END, None,
+                            ("tid", "timestamp", "lat", "lon", "readable_time"))
+    merged = archive.merge(rcur, archived, key=lambda row: (row[0], row[1]))
+
+    def save(key, lats, lons, tss):
+        wcur.execute(UPSERT_SQL, key + DaySummary.from_track(lats, lons, tss).values())
+
+    key, days = None, 0
+    lats, lons, tss = [], [], []
+    for tid, ts, lat, lon, readable_time in merged:
+        row_key = (readable_time[:10], tid or "")
+        if row_key != key:
+            if key is not None:
+                save(key, lats, lons, tss)
+                days += 1
+                if days % 100 == 0:
+                    write_conn.commit()
+                    print(f"{days} dagen verwerkt...")
+            key, lats, lons, tss = row_key, [], [], []
+        lats.append(lat)
+        lons.append(lon)
+        tss.append(ts)
+    if key is not None:
+        save(key, lats, lons, tss)
+        days += 1
+
+    write_conn.commit()
+    rcur.close()
+    wcur.close()
+    read_conn.close()
+    write_conn.close()
+    print(f"✅ daily_summary gevuld: {days} dagen")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Onderhoud van de tabel daily_summary")
+    parser.add_argument("--backfill", action="store_true",
+                        help="bouw de samenvatting opnieuw op uit alle punten")
+    args = parser.parse_args()
+    if args.backfill:
+        try:
+            backfill()
+        except Error as e:
+            print(f"Fout bij backfill: {e}")
+    else:
+        parser.print_help()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+'''
+Kaarttegels (/tiles/{z}/{x}/{y}.geojson) met de hele historie.
+
+Per tegel in het gewone webmercator-raster van Leaflet/OSM:
+  - t/m HEAT_MAX_ZOOM: puntdichtheid, geteld per cel van HEAT_CELL_PX
+    pixels (GeoJSON Points met eigenschap n); de tegel blijft begrensd,
+    hoeveel jaren er ook in staan
+  - daarboven: lijnen per apparaat, geknipt op tijdgaten en vereenvoudigd
+    met Douglas-Peucker in tegelpixels, zodat een tegel nooit meer punten
+    bevat dan er op het scherm verschil maken
+
+Een tegel wordt één keer uit locations (en het kolomarchief) opgebouwd en als bestand in
+CACHE_DIR bewaard. De BatchWriter gooit na elke commit de lijntegels weg
+waar de nieuwe punten in vallen. Dichtheidstegels niet: die lezen elk punt
+in hun (grote) gebied en zouden tijdens de ingest elke seconde opnieuw
+moeten; een paar nieuwe punten ziet daar niemand. Die worden na HEAT_TTL
+seconden opnieuw opgebouwd.
+
+Lage zoomniveaus lezen veel punten; die kunnen vooraf worden aangemaakt:
+    python tiles.py --vooraf 0-8
+'''
+
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from math import ceil, log10
+
+import numpy as np
+
+import archive
+import storage
+from storage import COL, Error, day_bounds
+from cache import GZIP_MIN
+from simplify import douglas_peucker, TOLERANCE_PX, MAX_ZOOM
+from trips import GAP_THRESHOLD_SECONDS
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+TILE_SIZE = 256
+HEAT_MAX_ZOOM = 8       # t/m deze zoom dichtheid in plaats van lijnen
+HEAT_CELL_PX = 4        # celgrootte van de dichtheid in pixels
+HEAT_TTL = 3600         # seconden – zo oud mag een dichtheidstegel worden
+BUFFER_PX = 16          # rand rond de tegel, zodat lijnen doorlopen tot over de rand
+FETCH_SIZE = 5000
+ARCHIVE_END = 2 ** 62   # bovengrens voor archive.rows zonder einddatum
+CACHE_DIR = os.environ.get("TIMELINE_TILE_CACHE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tile_cache")
+
+# =====================
+# PROJECTIE
+# =====================
+
+def project(lat, lon, zoom):
+    """Webmercator-pixelcoördinaten op zoom (werkt op scalars en arrays)"""
+    scale = TILE_SIZE * 2**zoom
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    x = (np.asarray(lon) + 180.0) / 360.0 * scale
+    s = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def unproject(x, y, zoom):
+    scale = TILE_SIZE * 2**zoom
+    lon = np.asarray(x) / scale * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y) / scale))))
+    return lat, lon
+
+
+def tile_bbox(z, x, y, buffer_px=0):
+    """(zuid, west, noord, oost) van een tegel, met een rand in pixels"""
+    x0, y0 = x * TILE_SIZE - buffer_px, y * TILE_SIZE - buffer_px
+    x1, y1 = (x + 1) * TILE_SIZE + buffer_px, (y + 1) * TILE_SIZE + buffer_px
+    north, west = unproject(x0, y0, z)
+    south, east = unproject(x1, y1, z)
+    return float(south), float(west), float(north), float(east)
+
+
+def decimals(zoom):
+    """Aantal decimalen waarbij een graad-afronding onder één pixel blijft"""
+    return max(1, ceil(log10(TILE_SIZE * 2**zoom / 360.0)))
+
+# =====================
+# OPBOUWEN
+# =====================
+
+def stream_points(conn, bbox, tid=None, start_ts=None, end_ts=None):
+    """Blokken (tid, lat, lon, timestamp) binnen bbox, per apparaat op tijd gesorteerd"""
+    south, west, north, east = bbox
+    sql = """
+        SELECT COALESCE(tid, ''), lat, lon, timestamp FROM locations
+        WHERE lat >= %s AND lat < %s AND lon >= %s AND lon < %s
+    """
+    params = [south, north, west, east]
+    if tid:
+        sql += " AND tid = %s"
+        params.append(tid)
+    if start_ts is not None:
+        sql += " AND timestamp >= %s"
+        params.append(start_ts)
+    if end_ts is not None:
+        sql += " AND timestamp < %s"
+        params.append(end_ts)
+    sql += " ORDER BY COALESCE(tid, ''), timestamp"
+
+    cur = conn.cursor(buffered=False)
+    cur.execute(sql, params)
+
+    def db_rows():
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+    # Afgesloten maanden uit het kolomarchief, in dezelfde volgorde erbij
+    archived = archive.rows(start_ts if start_ts is not None else 0,
+                            end_ts if end_ts is not None else ARCHIVE_END, tid,
+                            ("tid", "lat", "lon", "timestamp"), bbox=bbox)
+    merged = archive.merge(db_rows(), archived, key=lambda row: (row[0], row[3]))
+    try:
+        while True:
+            rows = list(itertools.islice(merged, FETCH_SIZE))
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+
+def heat_features(conn, z, x, y, **filters):
+    """Aantal punten per cel van HEAT_CELL_PX pixels"""
+    cells = TILE_SIZE // HEAT_CELL_PX
+    counts = np.zeros((cells, cells), dtype=np.int64)
+    for rows in stream_points(conn, tile_bbox(z, x, y), **filters):
+        lat = np.fromiter((r[1] for r in rows), dtype=float, count=len(rows))
+        lon = np.fromiter((r[2] for r in rows), dtype=float, count=len(rows))
+        px, py = project(lat, lon, z)
+        cx = np.clip(((px - x * TILE_SIZE) // HEAT_CELL_PX).astype(int), 0, cells - 1)
+        cy = np.clip(((py - y * TILE_SIZE) // HEAT_CELL_PX).astype(int), 0, cells - 1)
+        np.add.at(counts, (cy, cx), 1)
+
+    cy, cx = np.nonzero(counts)
+    lat, lon = unproject(x * TILE_SIZE + (cx + 0.5) * HEAT_CELL_PX,
+                         y * TILE_SIZE + (cy + 0.5) * HEAT_CELL_PX, z)
+    digits = decimals(z)
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point",
+                         "coordinates": [round(float(lo), digits), round(float(la), digits)]},
+            "properties": {"n": int(n)},
+        }
+        for la, lo, n in zip(lat, lon, counts[cy, cx])
+    ]
+
+
+def line_features(conn, z, x, y, **filters):
+    """Lijnen per apparaat, geknipt op tijdgaten en vereenvoudigd voor zoom z"""
+    digits = decimals(z)
+    features = []
+
+    def emit(tid, track):
+        if len(track) < 2:
+            return
+        lat = np.array([p[0] for p in track])
+        lon = np.array([p[1] for p in track])
+        px, py = project(lat, lon, z)
+        idx = douglas_peucker(px, py, TOLERANCE_PX)
+        coords = []
+        for i in idx:
+            c = [round(float(lon[i]), digits), round(float(lat[i]), digits)]
+            if not coords or c != coords[-1]:
+                coords.append(c)
+        if len(coords) > 1:
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": coords},
+                "properties": {"tid": tid},
+            })
+
+    current, track, last_ts = None, [], None
+    for rows in stream_points(conn, tile_bbox(z, x, y, BUFFER_PX), **filters):
+        for tid, lat, lon, ts in rows:
+            if tid != current or ts - last_ts > GAP_THRESHOLD_SECONDS:
+                emit(current, track)
+                current, track = tid, []
+            track.append((lat, lon))
+            last_ts = ts
+    emit(current, track)
+    return features
+
+
+def build_tile(conn, z, x, y, tid=None, start_ts=None, end_ts=None):
+    filters = {"tid": tid, "start_ts": start_ts, "end_ts": end_ts}
+    if z <= HEAT_MAX_ZOOM:
+        features = heat_features(conn, z, x, y, **filters)
+    else:
+        features = line_features(conn, z, x, y, **filters)
+    return {"type": "FeatureCollection", "features": features}
+
+# =====================
+# SCHIJFCACHE
+# =====================
+
+def variant_dir(tid=None, van=None, tot=None):
+    """Map per combinatie van filters; de hash houdt gebruikersinvoer uit het pad"""
+    if not (tid or van or tot):
+        return os.path.join(CACHE_DIR, "alle")
+    key = json.dumps([tid, van, tot]).encode()
+    return os.path.join(CACHE_DIR, hashlib.sha1(key).hexdigest()[:16])
+
+
+def tile_path(z, x, y, tid=None, van=None, tot=None):
+    return os.path.join(variant_dir(tid, van, tot), str(z), str(x), f"{y}.geojson")
+
+
+def get_tile(z, x, y, tid=None, van=None, tot=None):
+    """Pad van de tegel in de cache; bouwt hem eerst op als hij er niet is
+
+    van/tot zijn dagen (YYYY-MM-DD); een ongeldige dag geeft ValueError.
+    """
+    path = tile_path(z, x, y, tid, van, tot)
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        age = None
+    if age is not None and (z > HEAT_MAX_ZOOM or age < HEAT_TTL):
+        return path
+
+    start_ts = day_bounds(van)[0] if van else None
+    end_ts = day_bounds(tot)[1] if tot else None
+    conn = storage.get_connection()
+    try:
+        tile = build_tile(conn, z, x, y, tid, start_ts, end_ts)
+    finally:
+        conn.close()
+
+    body = json.dumps(tile, separators=(',', ':')).encode()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write(path, body)
+    if len(body) >= GZIP_MIN:
+        _write(path + ".gz", gzip.compress(body, compresslevel=6))
+    return path
+
+
+def _write(path, data):
+    # Eerst naar een tijdelijk bestand, zodat een andere worker nooit een halve tegel leest
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def invalidate_batch(batch):
+    """after_commit-hook voor de BatchWriter: lijntegels met nieuwe punten weggooien
+
+    Dichtheidstegels (t/m HEAT_MAX_ZOOM) blijven staan tot HEAT_TTL verlopen is.
+    """
+    try:
+        variants = [e.path for e in os.scandir(CACHE_DIR) if e.is_dir()]
+    except FileNotFoundError:
+        return
+    if not variants:
+        return
+
+    lat = np.array([row[COL["lat"]] for row in batch], dtype=float)
+    lon = np.array([row[COL["lon"]] for row in batch], dtype=float)
+    stale = set()
+    for z in range(HEAT_MAX_ZOOM + 1, MAX_ZOOM + 1):
+        px, py = project(lat, lon, z)
+        # Ook de buurtegels waarvan de rand over het punt valt
+        for dx in (-BUFFER_PX, BUFFER_PX):
+            for dy in (-BUFFER_PX, BUFFER_PX):
+                tx = ((px + dx) // TILE_SIZE).astype(int)
+                ty = ((py + dy) // TILE_SIZE).astype(int)
+                stale.update((z, int(a), int(b)) for a, b in zip(tx, ty))
+
+    for variant in variants:
+        for z, x, y in stale:
+            path = os.path.join(variant, str(z), str(x), f"{y}.geojson")
+            for p in (path, path + ".gz"):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+
+def clear_cache():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+# =====================
+# VOORAF AANMAKEN
+# =====================
+
+def data_bounds(conn, tid=None):
+    """(zuid, west, noord, oost) van alle punten, uit daily_summary"""
+    cur = conn.cursor()
+    sql = "SELECT MIN(min_lat), MIN(min_lon), MAX(max_lat), MAX(max_lon) FROM daily_summary"
+    if tid:
+        cur.execute(sql + " WHERE tid = %s", (tid,))
+    else:
+        cur.execute(sql)
+    row = cur.fetchone()
+    cur.close()
+    return None if row is None or row[0] is None else tuple(float(v) for v in row)
+
+
+def prerender(zooms, tid=None):
+    conn = storage.get_connection()
+    bounds = data_bounds(conn, tid)
+    conn.close()
+    if bounds is None:
+        print("Geen punten gevonden")
+        return
+    south, west, north, east = bounds
+    for z in zooms:
+        x0, y0 = project(north, west, z)
+        x1, y1 = project(south, east, z)
+        count = 0
+        for x in range(int(x0 // TILE_SIZE), int(x1 // TILE_SIZE) + 1):
+            for y in range(int(y0 // TILE_SIZE), int(y1 // TILE_SIZE) + 1):
+                get_tile(z, x, y, tid)
+                count += 1
+        print(f"zoom {z}: {count} tegels")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kaarttegels met de hele historie")
+    parser.add_argument("--vooraf", metavar="VAN-TOT", default="0-8",
+                        help="zoomniveaus om vooraf aan te maken, bv. 0-8")
+    parser.add_argument("--tid", help="alleen dit apparaat")
+    parser.add_argument("--wis", action="store_true", help="eerst de hele tegelcache weggooien")
+    args = parser.parse_args()
+    if args.wis:
+        clear_cache()
+    low, _, high = args.vooraf.partition("-")
+    try:
+        prerender(range(int(low), int(high or low) + 1), args.tid)
+    except Error as e:
+        print(f"Fout bij aanmaken tegels: {e}")
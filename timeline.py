@@ -1,73 +1,88 @@
 
 #!/usr/bin/env python3
 
-from flask import Flask, request, render_template
-import mysql.connector
-from mysql.connector import Error
-from math import radians, sin, cos, sqrt, atan2
-from collections import deque
+from flask import Flask, request, render_template, jsonify, Response, send_file
 from datetime import datetime, timedelta
 import pytz
-from config import DB_CONFIG, STATIONARY_RADIUS, STATIONARY_TIME
 import json
+import atexit
+import os
+import signal
+import sys
+import time
+import metrics
+import storage
+from storage import Error
+import summary
+import trips
+import partitions
+import tiles
+import spatial
+import places
+import export
+import archive
+from cache import ResponseCache
+from log import log
+from storage import COL
+from geo import total_distance
+from simplify import simplify_points, fit_zoom
+from polyline import encode_polyline, delta_encode, PRECISION
+from ingest import DeviceRegistry, process_location, parse_messages, process_bulk, QUEUE_FULL
 
 # =====================
 # CONFIGURATIE
 # =====================
 
-
-
-MAX_ACC = 20        
-MIN_DIST = 3        
-SMOOTH_WINDOW = 3   
 local_tz = pytz.timezone('Europe/Amsterdam')
 
+# Seconden dat de browser een afgelopen dag zonder navragen mag tonen. Niet
+# langer: achterstanden, MQTT-replay, importeer.py en nieuwe bezoeken
+# schrijven ook nog in oude dagen. Daarna vraagt hij het na met de ETag (304).
+PAST_DAY_MAX_AGE = 300
+
 app = Flask(__name__)
 
 # =====================
 # HULPFUNCTIES
 # =====================
 
-def distance_m(lat1, lon1, lat2, lon2):
-    R = 6371000
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-    return R * 2 * atan2(sqrt(a), sqrt(1 - a))
+def is_past_day(day_str):
+    return day_str < datetime.now(local_tz).strftime('%Y-%m-%d')
+
+def cached_response(entry, mimetype, day_str):
+    """Response uit de cache met sterke ETag, If-None-Match en optionele gzip"""
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, mimetype=mimetype)
+        if entry.gz is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+            response.set_data(entry.gz)
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(entry.etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    if is_past_day(day_str):
+        # Een afgelopen dag verandert zelden, maar wel soms (late punten)
+        response.headers["Cache-Control"] = f"public, max-age={PAST_DAY_MAX_AGE}"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
 
 def get_db_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+    # Verbinding uit de pool; conn.close() geeft hem terug
+    return storage.get_connection()
 
 
 def init_db():
-    """Initialiseer MariaDB tabel"""
+    """Initialiseer de tabellen (MariaDB of SQLite, zie storage.BACKEND)"""
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS locations (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                readable_time DATETIME,
-                SSID VARCHAR(255),
-                acc FLOAT,
-                alt FLOAT,
-                batt INT,
-                bs INT,
-                cog FLOAT,
-                conn VARCHAR(50),
-                created_at BIGINT,
-                lat DOUBLE,
-                lon DOUBLE,
-                m INT,
-                source VARCHAR(50),
-                tid VARCHAR(10),
-                topic VARCHAR(255),
-                vac FLOAT,
-                vel FLOAT,
-                timestamp BIGINT,
-                INDEX (readable_time)
-            )
-        """)
+        storage.create_schema(cur)
+        partitions.ensure(cur)
+        spatial.ensure_column(cur)
+        summary.create_table(cur)
+        trips.create_tables(cur)
+        places.create_tables(cur)
         conn.commit()
         cur.close()
         conn.close()
@@ -78,77 +93,110 @@ def init_db():
 # STATE (IN MEMORY)
 # =====================
 
-last_points = deque(maxlen=SMOOTH_WINDOW)
-last_saved_point = None
+# Met meerdere workers (gunicorn) staan filterstatus en cache-generaties in
+# een gedeeld SQLite-bestand; anders gewoon in het geheugen van dit proces
+SHARED_STATE = os.environ.get("TIMELINE_SHARED_STATE")
+
+# Filterstatus per apparaat (topic/tid) in plaats van globale variabelen
+if SHARED_STATE:
+    import shared
+    devices = shared.SharedDeviceRegistry(SHARED_STATE)
+    # /metrics telt de standen van alle workers op
+    metrics.share(shared.MetricSnapshots(SHARED_STATE))
+else:
+    devices = DeviceRegistry()
+
+# Punten gaan via een wachtrij in batches naar de database
+writer = storage.BatchWriter()
+metrics.QUEUE_DEPTH.fn = writer.queue.qsize
+# Dagsamenvatting bijwerken in dezelfde transactie als de INSERT
+writer.hooks.append(summary.apply_batch)
+
+# Gerenderde dagen per (dag, tid); de ingest gooit dagen met nieuwe punten weg
+response_cache = ResponseCache(
+    generations=shared.CacheGenerations(SHARED_STATE) if SHARED_STATE else None
+)
+
+def invalidate_cache(batch):
+    for day, tid in {(row[COL["readable_time"]][:10], row[COL["tid"]]) for row in batch}:
+        response_cache.invalidate(day, tid)
+
+def update_places(batch):
+    # Nieuwe bezoeken kunnen op een eerdere dag beginnen dan de batch
+    for day, tid in places.update_batch(batch):
+        response_cache.invalidate(day, tid)
+
+# Verblijven en plekken bijwerken vóór het legen van de cache, zodat een
+# opnieuw gerenderde dag de nieuwe bezoeken meteen meeneemt
+writer.after_commit.append(update_places)
+writer.after_commit.append(invalidate_cache)
+# Komende maandpartities op tijd aanmaken (alleen MariaDB)
+writer.after_commit.append(partitions.maybe_extend)
+# Kaarttegels met nieuwe punten uit de schijfcache halen
+writer.after_commit.append(tiles.invalidate_batch)
 
 # =====================
-# ROUTES
+# METRIEKEN
 # =====================
 
-@app.route("/pub", methods=["POST"])
-def receive_location():
-    global last_saved_point
-    
-    data = request.get_json(force=True)
-    if data.get("_type") != "location":
-        return "ignored", 200
+@app.before_request
+def start_timer():
+    request.started = time.perf_counter()
 
-    lat, lon, acc = data.get("lat"), data.get("lon"), data.get("acc")
-    tst = data.get('tst')
+@app.after_request
+def observe_request(response):
+    # Per route-patroon (niet per URL), anders groeit het aantal reeksen mee met de dagen
+    rule = request.url_rule.rule if request.url_rule else "onbekend"
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - request.started,
+                                    route=rule, method=request.method)
+    metrics.maybe_publish()
+    return response
 
-    # 1. Basis filters (Accuracy)
-    if lat is None or lon is None or acc > MAX_ACC:
-        return "ignored", 200
-
-    # 2. Stilstand filter
-    if last_saved_point:
-        # last_saved_point formaat: (lat, lon, timestamp)
-        dist = distance_m(last_saved_point[0], last_saved_point[1], lat, lon)
-        time_diff = tst - last_saved_point[2]
-
-        # Ben je binnen de straal?
-        if dist < STATIONARY_RADIUS:
-            # Ben je hier al langer dan de STATIONARY_TIME?
-            if time_diff > STATIONARY_TIME:
-                # We slaan dit punt niet op, want we staan al stil op deze plek
-                print(f"Stilstand gedetecteerd (> {STATIONARY_TIME}s), punt genegeerd.")
-                return "stationary ignored", 200
-        
-        # Ben je nog heel dichtbij het vorige punt (tegen jitter), maar nog niet lang genoeg?
-        if dist < MIN_DIST:
-             return "too close ignored", 200
-
-    # 3. Smoothing (optioneel, als je dit nog gebruikt)
-    last_points.append((lat, lon))
-    if len(last_points) < SMOOTH_WINDOW:
-        return "buffering", 200
-    
-    lat_smooth = sum(p[0] for p in last_points) / len(last_points)
-    lon_smooth = sum(p[1] for p in last_points) / len(last_points)
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-    # 4. Opslaan in MariaDB
-    dt_nl = datetime.fromtimestamp(tst, pytz.utc).astimezone(local_tz)
-    readable_time = dt_nl.strftime('%Y-%m-%d %H:%M:%S')
+# =====================
+# ROUTES
+# =====================
 
+@app.route("/pub", methods=["POST"])
+def receive_location():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        sql = """INSERT INTO locations (readable_time, lat, lon, acc, timestamp, vel) 
-         VALUES (%s, %s, %s, %s, %s, %s)"""
-        cur.execute(sql, (readable_time, lat, lon, acc, tst, data.get('vel', 0)))
-        conn.commit()
-        cur.close()
-        conn.close()
-
-        # Update het laatste punt met de huidige locatie en TIJD
-        last_saved_point = (lat, lon, tst)
-        print(f"✅ Locatie opgeslagen: {readable_time} (Afstand: {dist:.1f}m)")
-
-    except Error as e:
-        print("Fout bij opslaan:", e)
+        messages, bulk = parse_messages(request.get_data())
+    except ValueError:
+        return "bad request", 400
+    if bulk:
+        return jsonify(receive_bulk(messages))
+
+    data = messages[0]
+    if not isinstance(data, dict):
+        metrics.INGEST.inc(outcome="invalid")
+        return "ignored", 200
+    result = process_location(devices, data, writer.put)
+    if result == QUEUE_FULL:
         return "ok", 200 # Geef toch een OK terug, anders herprobeert de client
-
-    return "ok", 200
+    return result, 200
+
+def receive_bulk(messages):
+    """Achterstand in één request: gesorteerd op tst, één transactie, status per bericht"""
+    rows, statuses = process_bulk(devices, messages)
+    # Direct schrijven i.p.v. via de wachtrij; lukt dat niet, dan alsnog via de wachtrij
+    in_transaction = writer.write_now(rows)
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return {
+        "berichten": len(messages),
+        "opgeslagen": len(rows),
+        "transactie": in_transaction,
+        "status": counts,
+        "per_bericht": statuses,
+    }
+
+@app.route("/status")
+def status():
+    return jsonify({**writer.status(), "cache": response_cache.status()})
 
 @app.route("/")
 def index():
@@ -156,56 +204,236 @@ def index():
     if not day_str or not day_str.strip():
         day_str = datetime.now(local_tz).strftime('%Y-%m-%d')
     
+    tid = request.args.get('tid') or None
+    # Zoomniveau voor de vereenvoudiging; zonder zoom nemen we de fitBounds-zoom
+    zoom = request.args.get('zoom', type=int)
+
+    variant = ("page", zoom)
+    entry = response_cache.get(day_str, tid, variant)
+    if entry is None:
+        gen = response_cache.generation(day_str, tid)
+        html, ok = render_day(day_str, tid, zoom)
+        if not ok:
+            # Database-fout: niet cachen
+            return html
+        entry = response_cache.put(day_str, tid, variant, html.encode(), gen)
+    return cached_response(entry, "text/html", day_str)
+
+def render_day(day_str, tid, zoom):
     points = []
+    visits = []
+    display_distance = 0
+    ok = True
     try:
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        # We gebruiken CAST(... AS CHAR) om de datum direct als tekst op te halen
-        cur.execute("""
-                    SELECT 
-                        lat, 
-                        lon, 
-                        vel,
-                        CAST(readable_time AS CHAR) as readable_time 
-                    FROM locations 
-                    WHERE DATE(readable_time) = %s 
-                    ORDER BY timestamp ASC
-                """, (day_str,))
-        points = cur.fetchall()
-        cur.close()
-        conn.close()
+        # Oude maanden komen (ook) uit het kolomarchief, zie archive.py
+        with metrics.DB_QUERY_SECONDS.time(query="day_points"):
+            points = archive.fetch_day_points(conn, day_str, tid)
+        metrics.DAY_POINTS.observe(len(points), view="html")
         
-        # Berekening in timeline.py
-        total_km = 0
-        for i in range(len(points) - 1):
-            d = distance_m(points[i]['lat'], points[i]['lon'], points[i+1]['lat'], points[i+1]['lon'])
-            if d > 5: # Filter kleine ruis
-                total_km += d
+        # Afstand uit de dagsamenvatting; alleen als die er (nog) niet is
+        # rekenen we hem uit over de punten
+        with metrics.DB_QUERY_SECONDS.time(query="summary"):
+            day_summary = summary.fetch_day(conn, day_str, tid)
+        # Bezoeken komen kant-en-klaar uit de tabel visits (zie places.py)
+        with metrics.DB_QUERY_SECONDS.time(query="visits"):
+            visits = places.fetch_day_visits(conn, day_str, tid)
+        conn.close()
+        if day_summary:
+            total_km = float(day_summary['distance_m'])
+        else:
+            total_km = total_distance([p['lat'] for p in points],
+                                      [p['lon'] for p in points])
 
         # Afronden op 2 decimaal (bijv. 28.41)
         display_distance = round(total_km / 1000, 2)
                 
     except Error as e:
-        print(f"Database error: {e}")
+        log.error("Database error: %s", e)
+        ok = False
+
+    # Alleen de punten die op dit zoomniveau zichtbaar verschil maken
+    point_count = len(points)
+    if points and zoom is None:
+        zoom = fit_zoom([p['lat'] for p in points], [p['lon'] for p in points])
+    points = simplify_points(points, zoom)
 
     # Bereken navigatie
     current_dt = datetime.strptime(day_str, '%Y-%m-%d')
     prev_day = (current_dt - timedelta(days=1)).strftime('%Y-%m-%d')
     next_day = (current_dt + timedelta(days=1)).strftime('%Y-%m-%d')
-    # In timeline.py bij de berekening:
-
-    
 
-
-    return render_template(
+    html = render_template(
         "timeline.html",
         day=day_str,
         prev=prev_day,
         next=next_day,
         distance=display_distance,
+        point_count=point_count,
+        shown_count=len(points),
+        zoom=zoom,
+        visits=visits,
+        visits_json=json.dumps(visits),
         points_json=json.dumps(points) # Cruciaal: zet de lijst om naar tekst
     )
+    return html, ok
+
+@app.route("/api/track")
+def api_track():
+    """Track van één dag: encoded polyline plus delta-gecodeerde tijd/snelheid"""
+    day_str = request.args.get('day') or datetime.now(local_tz).strftime('%Y-%m-%d')
+    tid = request.args.get('tid') or None
+    zoom = request.args.get('zoom', type=int)
+
+    variant = ("track", zoom)
+    entry = response_cache.get(day_str, tid, variant)
+    if entry is None:
+        gen = response_cache.generation(day_str, tid)
+        try:
+            conn = get_db_connection()
+            with metrics.DB_QUERY_SECONDS.time(query="day_points"):
+                points = archive.fetch_day_points(conn, day_str, tid)
+            conn.close()
+        except Error as e:
+            log.error("Database error: %s", e)
+            return jsonify({"error": "database"}), 500
+        metrics.DAY_POINTS.observe(len(points), view="api")
+
+        point_count = len(points)
+        if zoom is not None:
+            points = simplify_points(points, zoom)
+
+        body = json.dumps({
+            "day": day_str,
+            "tid": tid,
+            "count": point_count,
+            "shown": len(points),
+            "precision": PRECISION,
+            "polyline": encode_polyline((p['lat'], p['lon']) for p in points),
+            "time": delta_encode(p['timestamp'] for p in points),
+            "vel": delta_encode(p['vel'] for p in points),
+        }, separators=(',', ':'))
+        entry = response_cache.put(day_str, tid, variant, body.encode(), gen)
+    return cached_response(entry, "application/json", day_str)
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.geojson")
+def tile(z, x, y):
+    """Tegel met de hele historie (of van/tot, tid) voor de laag Historie"""
+    if not (0 <= z <= tiles.MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z):
+        return "not found", 404
+    tid = request.args.get('tid') or None
+    van = request.args.get('van') or None
+    tot = request.args.get('tot') or None
+    try:
+        path = tiles.get_tile(z, x, y, tid, van, tot)
+    except ValueError:
+        return "bad request", 400
+    except Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "database"}), 500
+
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "") and os.path.exists(path + ".gz")
+    response = send_file(path + ".gz" if gzipped else path, mimetype="application/geo+json",
+                         conditional=True, etag=True)
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    # De tegel kan veranderen zodra er punten bijkomen: altijd even navragen
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/hier")
+def api_hier():
+    """Wanneer was ik hier? ?lat=&lon=&straal= (meter) of ?bbox=zuid,west,noord,oost"""
+    args = request.args
+    try:
+        start_ts, end_ts = spatial.period(args.get('van'), args.get('tot'))
+        if args.get('bbox'):
+            bbox = tuple(float(v) for v in args['bbox'].split(","))
+            if len(bbox) != 4 or not (bbox[0] < bbox[2] and bbox[1] < bbox[3]):
+                raise ValueError(args['bbox'])
+            if not spatial.bbox_fits(bbox):
+                return jsonify({"error": f"bbox te groot (hooguit {2 * spatial.MAX_RADIUS // 1000} km)"}), 400
+            query = lambda conn: spatial.query_bbox(conn, bbox, args.get('tid') or None, start_ts, end_ts)
+        else:
+            lat, lon = float(args['lat']), float(args['lon'])
+            radius = min(float(args.get('straal', 100)), spatial.MAX_RADIUS)
+            query = lambda conn: spatial.query_radius(conn, lat, lon, radius,
+                                                      args.get('tid') or None, start_ts, end_ts)
+    except (KeyError, ValueError):
+        return jsonify({"error": "geef lat en lon, of bbox"}), 400
 
-if __name__ == "__main__":
+    try:
+        conn = get_db_connection()
+        result = query(conn)
+        conn.close()
+    except Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "database"}), 500
+    return jsonify(result)
+
+@app.route("/export")
+def export_points():
+    """?from=&to=&format=gpx|kml|geojson|csv&tid= – gestreamd, gzip als de client dat wil"""
+    args = request.args
+    fmt = args.get('format', 'gpx')
+    van = args.get('from') or args.get('van')
+    tot = args.get('to') or args.get('tot')
+    tid = args.get('tid') or None
+    if fmt not in export.FORMATS or not van:
+        return jsonify({"error": "geef from (YYYY-MM-DD) en format: " + ", ".join(sorted(export.FORMATS))}), 400
+    try:
+        start_ts, end_ts = export.period_bounds(van, tot)
+    except ValueError:
+        return jsonify({"error": "datum als YYYY-MM-DD"}), 400
+
+    gzip = "gzip" in request.headers.get("Accept-Encoding", "") and args.get('gzip') != '0'
+    try:
+        # Query en eerste blok vóór de headers: een fout wordt nog een 500
+        body = export.export(fmt, start_ts, end_ts, tid, gzip)
+    except Error + (OSError,) as e:
+        log.error("Fout bij exporteren: %s", e)
+        return jsonify({"error": "database"}), 500
+    response = Response(body, mimetype=export.FORMATS[fmt][1])
+    response.headers["Content-Disposition"] = f'attachment; filename="{export.filename(fmt, van, tot, tid)}"'
+    if gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+@app.route("/overzicht")
+def overzicht():
+    # Maand (YYYY-MM) of jaar (YYYY) uit daily_summary
+    period = request.args.get('periode') or datetime.now(local_tz).strftime('%Y-%m')
+    try:
+        conn = get_db_connection()
+        rows = summary.fetch_overview(conn, period, request.args.get('tid') or None)
+        conn.close()
+    except Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "database"}), 500
+    return jsonify({"periode": period, "rijen": rows})
+
+def shutdown(signum, frame):
+    # SIGTERM van systemd omzetten naar een nette exit, zodat atexit draait
+    sys.exit(0)
+
+def warm_devices():
+    try:
+        conn = get_db_connection()
+        print(f"Filterstatus geladen voor {devices.warm(conn)} apparaten")
+        conn.close()
+    except Error as e:
+        print(f"Fout bij laden filterstatus: {e}")
+
+def main():
+    print(f"Opslag: {storage.BACKEND}")
     init_db()
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    warm_devices()
+    writer.start()
+    atexit.register(writer.stop)
+    signal.signal(signal.SIGTERM, shutdown)
+    app.run(host="0.0.0.0", port=5000)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+'''
+Ritten en verblijven uit de tabel locations.
+
+De segmentatie is een generator die punten in tijdsvolgorde leest van een
+server-side cursor en ritten (beweging) en verblijven (stilstand binnen een
+straal) teruggeeft. Resultaten gaan naar de tabel trips; per apparaat houdt
+trip_watermark bij tot welk tijdstip er verwerkt is, zodat een volgende run
+alleen nieuwe punten leest.
+
+Gebruik:
+    python trips.py            # nieuwe punten verwerken
+    python trips.py --opnieuw  # trips leeggooien en alles opnieuw indelen
+'''
+
+import argparse
+
+import archive
+import storage
+from storage import Error
+from geo import distance_m
+
+# =====================
+# CONFIGURATIE
+# =====================
+
+GAP_THRESHOLD_SECONDS = 900  # 15 minuten zonder data = nieuwe rit
+STAY_RADIUS = 50             # meter – binnen deze straal sta je stil
+STAY_MIN_TIME = 300          # seconden – zo lang binnen de straal = verblijf
+MIN_TRIP_DIST = 200          # meter – kortere 'ritten' zijn ruis
+MAX_SPEED = 70               # m/s – sprongen hierboven zijn GPS-fouten
+FETCH_SIZE = 2000            # rijen per fetchmany van de cursor
+ARCHIVE_END = 2 ** 62        # bovengrens voor archive.rows: alles na het watermerk
+
+
+def create_tables(cur):
+    if storage.BACKEND == "sqlite":
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS trips (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tid TEXT NOT NULL DEFAULT '',
+                kind TEXT NOT NULL CHECK (kind IN ('trip', 'stay')),
+                start_ts INTEGER NOT NULL,
+                end_ts INTEGER NOT NULL,
+                start_lat REAL,
+                start_lon REAL,
+                end_lat REAL,
+                end_lon REAL,
+                distance_m REAL NOT NULL DEFAULT 0,
+                point_count INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (tid, start_ts, kind)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_trips_time ON trips (start_ts)")
+    else:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS trips (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                tid VARCHAR(10) NOT NULL DEFAULT '',
+                kind ENUM('trip', 'stay') NOT NULL,
+                start_ts BIGINT NOT NULL,
+                end_ts BIGINT NOT NULL,
+                start_lat DOUBLE,
+                start_lon DOUBLE,
+                end_lat DOUBLE,
+                end_lon DOUBLE,
+                distance_m DOUBLE NOT NULL DEFAULT 0,
+                point_count INT NOT NULL DEFAULT 0,
+                UNIQUE KEY uniq_trip (tid, start_ts, kind),
+                INDEX idx_trips_time (start_ts)
+            )
+        """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS trip_watermark (
+            tid VARCHAR(10) NOT NULL PRIMARY KEY,
+            last_ts BIGINT NOT NULL
+        )
+    """)
+
+# =====================
+# SEGMENTATIE
+# =====================
+
+class Segment:
+    """Een rit of verblijf in opbouw"""
+
+    __slots__ = ("kind", "points", "distance_m")
+
+    def __init__(self, kind, first):
+        self.kind = kind
+        self.points = [first]
+        self.distance_m = 0.0
+
+    @property
+    def start(self):
+        return self.points[0]
+
+    @property
+    def end(self):
+        return self.points[-1]
+
+
+def segment(points, gap=GAP_THRESHOLD_SECONDS, radius=STAY_RADIUS,
+            min_stay=STAY_MIN_TIME, min_trip=MIN_TRIP_DIST, max_speed=MAX_SPEED):
+    """Deel een stroom (lat, lon, ts) punten in tijdsvolgorde in
+
+    Geeft Segment-objecten met kind 'trip' of 'stay'. Een verblijf begint
+    zodra de punten langer dan min_stay binnen radius van een ankerpunt
+    blijven; een tijdgat groter dan gap sluit het lopende segment af. Het
+    laatste, nog open segment wordt niet teruggegeven: dat hoort bij de
+    volgende run.
+    """
+    current = None
+    anchor = None       # index in current.points waar een mogelijk verblijf begint
+
+    for point in points:
+        if current is None:
+            current, anchor = Segment("trip", point), 0
+            continue
+
+        prev = current.end
+        dt = point[2] - prev[2]
+        d = distance_m(prev[0], prev[1], point[0], point[1])
+
+        if dt > gap:
+            # Tijdgat: wat we hadden is klaar
+            if _keep(current, min_trip):
+                yield current
+            current, anchor = Segment("trip", point), 0
+            continue
+
+        if dt > 0 and d / dt > max_speed:
+            # Uitschieter, overslaan
+            continue
+
+        if current.kind == "stay":
+            a = current.start
+            if distance_m(a[0], a[1], point[0], point[1]) <= radius:
+                current.points.append(point)
+                continue
+            # Weg van de verblijfplaats: verblijf klaar, nieuwe rit vanaf laatste punt
+            yield current
+            current, anchor = Segment("trip", current.end), 0
+
+        current.points.append(point)
+        current.distance_m += d
+
+        # Schuif het anker op tot alle punten sinds het anker binnen de straal liggen
+        a = current.points[anchor]
+        while distance_m(a[0], a[1], point[0], point[1]) > radius:
+            anchor += 1
+            a = current.points[anchor]
+
+        if point[2] - a[2] >= min_stay:
+            # Lang genoeg stil: rit tot het anker, verblijf vanaf het anker
+            trip = Segment("trip", current.start)
+            trip.points = current.points[:anchor + 1]
+            trip.distance_m = _path_length(trip.points)
+            if _keep(trip, min_trip):
+                yield trip
+            stay = Segment("stay", a)
+            stay.points = current.points[anchor:]
+            current, anchor = stay, 0
+
+
+def _keep(seg, min_trip):
+    return seg.kind == "stay" or (len(seg.points) > 1 and seg.distance_m >= min_trip)
+
+
+def _path_length(points):
+    return sum(
+        distance_m(p[0], p[1], q[0], q[1]) for p, q in zip(points, points[1:])
+    )
+
+# =====================
+# OPSLAG
+# =====================
+
+INSERT_TRIP_SQL = """
+    INSERT INTO trips (tid, kind, start_ts, end_ts, start_lat, start_lon,
+                       end_lat, end_lon, distance_m, point_count)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE end_ts = VALUES(end_ts), end_lat = VALUES(end_lat),
+        end_lon = VALUES(end_lon), distance_m = VALUES(distance_m),
+        point_count = VALUES(point_count)
+"""
+
+
+def stream_points(conn, tid, after_ts):
+    """Punten van één apparaat na after_ts, in tijdsvolgorde via een server-side cursor"""
+    cur = conn.cursor(buffered=False)
+    if tid:
+        cur.execute("""
+            SELECT lat, lon, timestamp FROM locations
+            WHERE tid = %s AND timestamp > %s
+            ORDER BY timestamp ASC
+        """, (tid, after_ts))
+    else:
+        cur.execute("""
+            SELECT lat, lon, timestamp FROM locations
+            WHERE (tid IS NULL OR tid = '') AND timestamp > %s
+            ORDER BY timestamp ASC
+        """, (after_ts,))
+    def db_rows():
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+    # Gearchiveerde maanden ervoor (of ertussen) uit het kolomarchief
+    archived = archive.rows(after_ts + 1, ARCHIVE_END, tid, ("lat", "lon", "timestamp"))
+    try:
+        yield from archive.merge(db_rows(), archived, key=lambda row: row[2])
+    finally:
+        cur.close()
+
+
+def process_device(read_conn, write_conn, tid):
+    """Verwerk nieuwe punten van één apparaat vanaf het watermerk"""
+    cur = write_conn.cursor()
+    cur.execute("SELECT last_ts FROM trip_watermark WHERE tid = %s", (tid,))
+    row = cur.fetchone()
+    after_ts = row[0] if row else -1
+
+    count = 0
+    segments = segment(stream_points(read_conn, tid, after_ts))
+    for seg in segments:
+        cur.execute(INSERT_TRIP_SQL, (
+            tid, seg.kind, seg.start[2], seg.end[2],
+            seg.start[0], seg.start[1], seg.end[0], seg.end[1],
+            seg.distance_m, len(seg.points),
+        ))
+        # Watermerk tot het einde van het afgeronde segment; het open stuk
+        # daarna wordt de volgende keer opnieuw gelezen
+        cur.execute("""
+            INSERT INTO trip_watermark (tid, last_ts) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE last_ts = VALUES(last_ts)
+        """, (tid, seg.end[2] - 1 if seg.kind == "stay" else seg.end[2]))
+        write_conn.commit()
+        count += 1
+    cur.close()
+    return count
+
+
+def process_all(rebuild=False):
+    read_conn = storage.get_connection()
+    write_conn = storage.get_connection()
+    cur = write_conn.cursor()
+    create_tables(cur)
+    if rebuild:
+        cur.execute("DELETE FROM trips")
+        cur.execute("DELETE FROM trip_watermark")
+    write_conn.commit()
+
+    cur.execute("SELECT DISTINCT COALESCE(tid, '') FROM locations")
+    devices = sorted({r[0] for r in cur.fetchall()} | set(archive.devices()))
+    cur.close()
+
+    for tid in devices:
+        n = process_device(read_conn, write_conn, tid)
+        print(f"Apparaat '{tid or '-'}': {n} ritten/verblijven opgeslagen")
+
+    read_conn.close()
+    write_conn.close()
+
+
+def fetch_trips(conn, start_ts, end_ts, tid=None):
+    """Ritten en verblijven die in [start_ts, end_ts) beginnen"""
+    sql = "SELECT * FROM trips WHERE start_ts >= %s AND start_ts < %s"
+    params = [start_ts, end_ts]
+    if tid:
+        sql += " AND tid = %s"
+        params.append(tid)
+    sql += " ORDER BY start_ts"
+    cur = conn.cursor(dictionary=True)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ritten en verblijven bijwerken")
+    parser.add_argument("--opnieuw", action="store_true",
+                        help="alle ritten weggooien en de hele historie opnieuw indelen")
+    args = parser.parse_args()
+    try:
+        process_all(rebuild=args.opnieuw)
+    except Error as e:
+        print(f"Fout bij verwerken ritten: {e}")
@@ -6,8 +6,8 @@ import time
 NAS_URL = "http://192.168.1.78:5000/pub"  # Pas IP aan naar je NAS
 
 
-def stuur_test_locatie(lat, lon, tid="test-laptop"):
-    payload = {
+def maak_payload(lat, lon, tid="xm", tst=1767292555, topic="owntracks/ajan/a14xm"):
+    return {
         "BSSID": "78:d3:8d:fd:09:dd",
         "SSID": "weiler12",  # SSID point
         "_type": "location",
@@ -19,16 +19,19 @@ def stuur_test_locatie(lat, lon, tid="test-laptop"):
         "cog": 0,  # Richting 0 graden
         "conn": "w",  # 1 = GPS, 2 = WiFi, 3 = Fused (GPS + WiFi)
         "created_at": 1767293077,  # `{timestamp}`
-        "lat": 52.1885381,
-        "lon": 5.3213312, 
+        "lat": lat,
+        "lon": lon, 
         "m": 1,  # 1 = GPS, 2 = WiFi, 3 = Fused (GPS + WiFi)
         "source": "fused",  # 1 = GPS, 2 = WiFi, 3 = Fused (GPS + WiFi)
-        "tid": "xm",  # Tracker ID
-        "topic": "owntracks/ajan/a14xm",  # Topic met username en device
-        "tst": 1767292555,  # timestamp
+        "tid": tid,  # Tracker ID
+        "topic": topic,  # Topic met username en device
+        "tst": tst,  # timestamp
         "vac": 1,  # Verticale nauwkeurigheid 10m
         "vel": 2}  # Snelheid 50 km/u
-        
+
+
+def stuur_test_locatie(lat, lon, tid="xm"):
+    payload = maak_payload(lat, lon, tid)
 
     try:
         response = requests.post(NAS_URL, json=payload)